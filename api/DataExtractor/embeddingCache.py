@@ -0,0 +1,256 @@
+"""
+Persistent embeddings cache for MartianClient
+CachedEmbeddings wraps client.embeddings(): inputs are keyed on (model and
+request options, whitespace-normalized text), duplicates within a call are
+sent once, and only cache misses reach the network - split into requests of
+at most batch_size inputs that run concurrently. Vectors are kept as float32
+blobs in a SQLite file with least-recently-used eviction once the store
+grows past max_bytes.
+"""
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "embedding_cache.db")
+)
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Inputs per embeddings request, and requests in flight at once
+EMBEDDING_REQUEST_BATCH = int(os.getenv("EMBEDDING_REQUEST_BATCH", "128"))
+EMBEDDING_REQUEST_WORKERS = int(os.getenv("EMBEDDING_REQUEST_WORKERS", "4"))
+
+
+def normalize_text(text: str) -> str:
+    """Cache key text: surrounding and repeated whitespace does not change the embedding we want"""
+    return " ".join(str(text).split())
+
+
+class CachedEmbeddings:
+    """
+    Drop-in for client.embeddings(model=..., input=...) backed by an on-disk
+    LRU store. Responses keep the OpenAI shape: data[i] is the embedding of
+    input[i], whether it came from the cache, a duplicate or the network.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        *,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_bytes: int = EMBEDDING_CACHE_MAX_BYTES,
+        batch_size: int = EMBEDDING_REQUEST_BATCH,
+        max_workers: int = EMBEDDING_REQUEST_WORKERS,
+    ):
+        self.client = client
+        self.path = path
+        self.max_bytes = max_bytes
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "inputs": 0, "hits": 0, "misses": 0, "deduplicated": 0,
+                          "requests": 0, "evicted": 0, "bytes_saved": 0, "bytes_fetched": 0}
+        self._request_seconds = 0.0
+        self._init_store()
+
+    # -----------------------------
+    # Store
+    # -----------------------------
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_store(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                response_bytes INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text)
+            ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_lru ON embedding_cache (last_used)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _lookup(self, conn: sqlite3.Connection, model_key: str, texts: List[str]) -> Dict[str, Tuple[bytes, int]]:
+        rows = conn.execute("""
+        SELECT text, vector, response_bytes FROM embedding_cache
+        WHERE model = ? AND text IN (SELECT value FROM json_each(?))
+        """, (model_key, json.dumps(texts))).fetchall()
+        now = time.time()
+        conn.executemany("UPDATE embedding_cache SET last_used = ? WHERE model = ? AND text = ?",
+                         [(now, model_key, row[0]) for row in rows])
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        """Drop least recently used vectors until the store fits max_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(LENGTH(vector) + LENGTH(text)), 0) FROM embedding_cache").fetchone()[0]
+        evicted = 0
+        while total > self.max_bytes:
+            rows = conn.execute("""
+            SELECT model, text, LENGTH(vector) + LENGTH(text) FROM embedding_cache
+            ORDER BY last_used LIMIT 500
+            """).fetchall()
+            if not rows:
+                break
+            for model, text, size in rows:
+                conn.execute("DELETE FROM embedding_cache WHERE model = ? AND text = ?", (model, text))
+                evicted += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        return evicted
+
+    # -----------------------------
+    # Network
+    # -----------------------------
+    def _fetch(self, model: Union[str, List[str]], texts: List[str], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Embed texts with as few concurrent requests as batch_size allows"""
+        # Evenly sized chunks no larger than batch_size, so concurrent requests finish together
+        count = -(-len(texts) // self.batch_size)
+        size = -(-len(texts) // count)
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+
+        def send(chunk: List[str]) -> Tuple[List[List[float]], Dict[str, Any]]:
+            response = self.client.embeddings(model=model, input=chunk, **kwargs)
+            data = sorted(response["data"], key=lambda item: item.get("index", 0))
+            if len(data) != len(chunk):
+                raise ValueError(f"Expected {len(chunk)} embeddings, got {len(data)}")
+            return [item["embedding"] for item in data], response
+
+        started = time.time()
+        if len(chunks) == 1:
+            results = [send(chunks[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks)),
+                                    thread_name_prefix="embeddings") as pool:
+                results = list(pool.map(send, chunks))
+        with self._lock:
+            self._counters["requests"] += len(chunks)
+            self._request_seconds += time.time() - started
+
+        vectors: Dict[str, Any] = {}
+        usage: Dict[str, int] = {}
+        for chunk, (embeddings, response) in zip(chunks, results):
+            vectors.update(zip(chunk, embeddings))
+            for field, value in (response.get("usage") or {}).items():
+                if isinstance(value, int):
+                    usage[field] = usage.get(field, 0) + value
+        return {"vectors": vectors, "model": results[-1][1].get("model"), "usage": usage or None}
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    def embeddings(
+        self,
+        *,
+        model: Union[str, List[str]] = "router",
+        input: Union[str, List[str]],
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """client.embeddings() with caching; extra options (e.g. dimensions) are part of the key"""
+        inputs = [input] if isinstance(input, str) else list(input)
+        keys = [normalize_text(text) for text in inputs]
+        model_key = json.dumps({"model": model, **kwargs}, sort_keys=True)
+        unique = list(dict.fromkeys(keys))
+
+        conn = self._connect()
+        try:
+            cached = self._lookup(conn, model_key, unique)
+            conn.commit()
+            misses = [key for key in unique if key not in cached]
+            fetched: Dict[str, Any] = {"vectors": {}, "model": None, "usage": None}
+            blobs = {key: blob for key, (blob, _) in cached.items()}
+            evicted = 0
+            if misses:
+                fetched = self._fetch(model, misses, kwargs)
+                now = time.time()
+                rows = []
+                for key in misses:
+                    blobs[key] = np.asarray(fetched["vectors"][key], dtype="<f4").tobytes()
+                    rows.append((model_key, key, blobs[key], len(json.dumps(fetched["vectors"][key])), now))
+                conn.executemany("""
+                INSERT OR REPLACE INTO embedding_cache (model, text, vector, response_bytes, last_used)
+                VALUES (?, ?, ?, ?, ?)
+                """, rows)
+                evicted = self._evict(conn)
+                conn.commit()
+        finally:
+            conn.close()
+
+        # Misses go through the same float32 round trip as hits, so a text embeds identically every call
+        vectors = {key: np.frombuffer(blob, dtype="<f4").tolist() for key, blob in blobs.items()}
+        with self._lock:
+            counters = self._counters
+            counters["calls"] += 1
+            counters["inputs"] += len(keys)
+            counters["hits"] += len(cached)
+            counters["misses"] += len(misses)
+            counters["deduplicated"] += len(keys) - len(unique)
+            counters["evicted"] += evicted
+            # Bytes the network did not have to carry: every input would have cost its text and
+            # response without the cache; only misses were actually sent
+            sizes = {key: size for key, (_, size) in cached.items()}
+            sizes.update((key, len(json.dumps(v))) for key, v in fetched["vectors"].items())
+            counters["bytes_saved"] += sum(sizes[key] + len(key.encode()) for key in keys) \
+                - sum(sizes[key] + len(key.encode()) for key in misses)
+            counters["bytes_fetched"] += sum(sizes[key] for key in misses)
+
+        return {
+            "object": "list",
+            "model": fetched["model"] or model,
+            "data": [{"object": "embedding", "index": i, "embedding": vectors[key]} for i, key in enumerate(keys)],
+            "usage": fetched["usage"],
+            "cache": {"hits": len(cached), "misses": len(misses), "deduplicated": len(keys) - len(unique)},
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        """Hit rate, bytes saved, request latency and the size of the on-disk store"""
+        conn = self._connect()
+        try:
+            entries, stored = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector) + LENGTH(text)), 0) FROM embedding_cache"
+            ).fetchone()
+        finally:
+            conn.close()
+        with self._lock:
+            counters = dict(self._counters)
+            request_seconds = self._request_seconds
+        looked_up = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": round(counters["hits"] / looked_up, 4) if looked_up else 0.0,
+            "avg_request_ms": round(request_seconds * 1000 / counters["requests"], 1) if counters["requests"] else 0.0,
+            "entries": entries,
+            "stored_bytes": stored,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_default: Optional[CachedEmbeddings] = None
+_default_lock = threading.Lock()
+
+
+def get_embedding_cache(client: Any = None) -> CachedEmbeddings:
+    """Process-wide cache around a MartianClient (built from MARTIAN_KEY unless given)"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            if client is None:
+                from DataExtractor.martianAPIWrapper import MartianClient
+                client = MartianClient(os.getenv("MARTIAN_KEY"))
+            _default = CachedEmbeddings(client)
+        return _default
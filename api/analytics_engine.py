@@ -0,0 +1,493 @@
+"""
+Vectorized analytics engine
+Loads a user's transactions once into NumPy columns (int64 cents, day
+numbers, category/merchant/location ids) and computes every dashboard
+analytic from those arrays in one pass, instead of one SQL scan per metric.
+Column sets are kept in a per-user LRU and reloaded when the data changed:
+every ingest - a re-upload of an existing statement included - and every
+duplicate promotion advances the change_log head (see sqlite_db).
+
+Date-range questions (this month vs all time, trends) are answered from a
+prefix-sum index over the daily_spend rollup that ingest keeps current: any
+[start, end] costs two row lookups per category, however many days it spans.
+
+Adding an analytic means adding a few array operations to compute_dashboard().
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from analytics_sql import CATEGORY_NAMES, OTHER_CATEGORY, categorize, is_internal, category_icon, category_color
+from merchants import core_name
+from sqlite_db import change_log_head, get_db_connection
+from subscriptions import get_subscriptions
+
+# Users whose columns stay in memory between requests
+ENGINE_CACHE_USERS = int(os.getenv("ANALYTICS_ENGINE_CACHE_USERS", "128"))
+
+# datetime64 NaT as an int64 day number
+NAT_DAY = np.iinfo(np.int64).min
+
+_WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+@dataclass
+class TransactionColumns:
+    """One user's non-duplicate, non-internal transactions as parallel arrays"""
+    ids: np.ndarray          # int64 transactions.id
+    cents: np.ndarray        # int64, purchases positive
+    day: np.ndarray          # int64 days since 1970-01-01 (transaction_date)
+    post_day: np.ndarray     # int64 days since 1970-01-01 (post_date, falls back to day)
+    weekday: np.ndarray      # int8, Monday = 0
+    hour: np.ndarray         # int8, 0 when only a date is known
+    category: np.ndarray     # int16 index into CATEGORY_NAMES
+    merchant: np.ndarray     # int32 index into merchants / merchant_ids
+    location: np.ndarray     # int32 index into locations, -1 when missing
+    merchants: np.ndarray    # canonical merchant names
+    merchant_ids: np.ndarray # int64 merchants.merchant_id (0 when not assigned)
+    locations: np.ndarray    # location strings
+    descriptions: np.ndarray # raw descriptions, for listing rows
+    raw_locations: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+def _parse_timestamps(values: List[Optional[str]]) -> np.ndarray:
+    """ISO date/datetime strings to datetime64[s]; unparseable values become NaT"""
+    try:
+        return np.array([v or "NaT" for v in values], dtype="datetime64[s]")
+    except ValueError:
+        out = np.empty(len(values), dtype="datetime64[s]")
+        for i, v in enumerate(values):
+            try:
+                out[i] = np.datetime64(v or "NaT", "s")
+            except ValueError:
+                out[i] = np.datetime64("NaT")
+        return out
+
+def _factorize(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    uniques, codes = np.unique(np.array(values, dtype=object).astype(str), return_inverse=True)
+    return codes.astype(np.int32), uniques
+
+def load_columns(user_id: Optional[str] = None) -> TransactionColumns:
+    """Read a user's transactions (every user when user_id is None) into columns"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        query = """
+        SELECT t.id, t.transaction_date, t.post_date, t.description, t.amount, t.location,
+               COALESCE(t.merchant_id, 0), m.name, m.category
+        FROM transactions t
+        LEFT JOIN merchants m ON m.merchant_id = t.merchant_id
+        WHERE t.duplicate_of IS NULL
+        """
+        params: Tuple = ()
+        if user_id is not None:
+            query += " AND t.statement_id IN (SELECT statement_id FROM statements WHERE user_id = ?)"
+            params = (user_id,)
+        rows = [row for row in cursor.execute(query, params) if not is_internal(row[3])]
+    finally:
+        conn.close()
+
+    ids, tx_dates, post_dates, descriptions, amounts, locations, merchant_ids, merchant_names, merchant_categories = \
+        (list(c) for c in zip(*rows)) if rows else ([],) * 9
+
+    stamps = _parse_timestamps(tx_dates)
+    day = stamps.astype("datetime64[D]")
+    post_stamps = _parse_timestamps(post_dates)
+    post_day = np.where(np.isnat(post_stamps), day, post_stamps.astype("datetime64[D]"))
+    hour_source = np.where(np.isnat(post_stamps), stamps, post_stamps)
+    hours = ((hour_source - hour_source.astype("datetime64[D]")).astype("timedelta64[h]")
+             .astype(np.int64))
+    day_numbers = day.astype(np.int64)  # NaT becomes NAT_DAY
+
+    # Categorize each distinct description once, then broadcast through the codes
+    desc_codes, unique_descs = _factorize([d or "" for d in descriptions])
+    category_of = np.array([CATEGORY_NAMES.index(categorize(d)) for d in unique_descs], dtype=np.int16)
+
+    # Group on the integer merchant id assigned at ingest (see merchants.py)
+    unique_merchants, first_seen, merchant_codes = np.unique(np.array(merchant_ids, dtype=np.int64),
+                                                             return_index=True, return_inverse=True)
+    merchants = np.array([merchant_names[i] or core_name(descriptions[i]) for i in first_seen], dtype=object)
+    # Rows the keyword rules leave in Other take their merchant's learned category (see categorizer.py)
+    learned = np.array([CATEGORY_NAMES.index(merchant_categories[i] or OTHER_CATEGORY[0]) for i in first_seen],
+                       dtype=np.int16)
+    category = category_of[desc_codes]
+    if len(learned):
+        category = np.where(category == CATEGORY_NAMES.index(OTHER_CATEGORY[0]), learned[merchant_codes], category)
+
+    location_codes, unique_locations = _factorize([loc or "" for loc in locations])
+    location_codes = np.where(unique_locations[location_codes] == "", -1, location_codes).astype(np.int32)
+
+    return TransactionColumns(
+        ids=np.array(ids, dtype=np.int64),
+        cents=np.rint(np.array([float(a or 0) for a in amounts], dtype=np.float64) * 100).astype(np.int64),
+        day=day_numbers,
+        post_day=post_day.astype(np.int64),
+        weekday=((day_numbers + 3) % 7).astype(np.int8),  # 1970-01-01 was a Thursday
+        hour=np.where(np.isnat(hour_source), 0, hours).astype(np.int8),
+        category=category,
+        merchant=merchant_codes.astype(np.int32),
+        location=location_codes,
+        merchants=merchants,
+        merchant_ids=unique_merchants,
+        locations=unique_locations,
+        descriptions=np.array(descriptions, dtype=object),
+        raw_locations=np.array(locations, dtype=object),
+    )
+
+def _day_to_iso(day_numbers: np.ndarray) -> List[str]:
+    return [str(d) for d in day_numbers.astype("datetime64[D]")]
+
+def parse_day(value: Optional[str]) -> Optional[int]:
+    """ISO date (or datetime) string to a day number; None stays None"""
+    if value is None or value == "":
+        return None
+    return int(np.datetime64(str(value)[:10], "D").astype(np.int64))
+
+# --------------------------
+# Prefix-sum date-range index
+# --------------------------
+_INDEX_FIELDS = ("transactions", "spend_count", "spend_cents", "credit_cents")
+
+@dataclass
+class DailyIndex:
+    """
+    Cumulative per-category totals over consecutive days. Row k of each array
+    holds the totals of days [first_day, first_day + k), so a range is the
+    difference of two rows.
+    """
+    first_day: int
+    cumulative: Dict[str, np.ndarray]  # field -> int64 (n_days + 1, len(CATEGORY_NAMES))
+
+    @property
+    def last_day(self) -> int:
+        return self.first_day + len(self.cumulative["transactions"]) - 2
+
+    def _row(self, day: int) -> int:
+        """Prefix row covering every day before `day`, clamped to the index"""
+        return int(np.clip(day - self.first_day, 0, len(self.cumulative["transactions"]) - 1))
+
+    def totals(self, start: Optional[int] = None, end: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Per-category totals for days start..end inclusive (open ends span everything)"""
+        lo = self._row(self.first_day if start is None else start)
+        hi = self._row(self.last_day + 1 if end is None else end + 1)
+        hi = max(hi, lo)
+        return {field: cum[hi] - cum[lo] for field, cum in self.cumulative.items()}
+
+    def series(self, boundaries: np.ndarray) -> Dict[str, np.ndarray]:
+        """Per-bucket, per-category totals for buckets [boundaries[i], boundaries[i + 1])"""
+        rows = np.clip(boundaries - self.first_day, 0, len(self.cumulative["transactions"]) - 1)
+        return {field: np.diff(cum[rows], axis=0) for field, cum in self.cumulative.items()}
+
+def load_daily_index(user_id: Optional[str] = None) -> DailyIndex:
+    """Read a user's daily_spend rollup (every user when user_id is None) into prefix sums"""
+    conn = get_db_connection()
+    try:
+        query = f"SELECT day, category, {', '.join(_INDEX_FIELDS)} FROM daily_spend"
+        params: Tuple = ()
+        if user_id is not None:
+            query += " WHERE user_id = ?"
+            params = (user_id,)
+        rows = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+    if not rows:
+        return DailyIndex(0, {field: np.zeros((1, len(CATEGORY_NAMES)), dtype=np.int64) for field in _INDEX_FIELDS})
+
+    days = np.array([row[0] for row in rows], dtype="datetime64[D]").astype(np.int64)
+    cats = np.array([CATEGORY_NAMES.index(row[1]) if row[1] in CATEGORY_NAMES else len(CATEGORY_NAMES) - 1
+                     for row in rows], dtype=np.int64)
+    first_day = int(days.min())
+    n_days = int(days.max()) - first_day + 1
+    cumulative = {}
+    for i, field in enumerate(_INDEX_FIELDS):
+        daily = np.zeros((n_days + 1, len(CATEGORY_NAMES)), dtype=np.int64)
+        np.add.at(daily, (days - first_day + 1, cats), np.array([row[2 + i] for row in rows], dtype=np.int64))
+        cumulative[field] = np.cumsum(daily, axis=0)
+    return DailyIndex(first_day, cumulative)
+
+def _category_summary(totals: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """spending_by_category entries (same shape as the dashboard) from per-category totals"""
+    order = np.argsort(-totals["spend_cents"], kind="stable")
+    return [
+        {
+            "category": CATEGORY_NAMES[i],
+            "transaction_count": int(totals["spend_count"][i]),
+            "total_amount": int(totals["spend_cents"][i]) / 100,
+            "avg_amount": round(int(totals["spend_cents"][i]) / int(totals["spend_count"][i])) / 100,
+            "icon": category_icon(CATEGORY_NAMES[i]),
+            "color": category_color(CATEGORY_NAMES[i])
+        }
+        for i in order if totals["spend_count"][i] > 0
+    ]
+
+def _range_summary(totals: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    spend_cents = int(totals["spend_cents"].sum())
+    spend_count = int(totals["spend_count"].sum())
+    return {
+        "total_spent": spend_cents / 100,
+        "total_credits": int(totals["credit_cents"].sum()) / 100,
+        "total_transactions": int(totals["transactions"].sum()),
+        "avg_transaction": spend_cents / spend_count / 100 if spend_count else 0,
+    }
+
+def compute_dashboard(cols: TransactionColumns, recent_limit: int = 10, top_locations: int = 10,
+                      top_merchants: int = 10, start: Optional[int] = None, end: Optional[int] = None,
+                      index: Optional[DailyIndex] = None) -> Dict[str, Any]:
+    """
+    Every dashboard analytic from one set of columns. With a start/end day the
+    row-level analytics only see that range and, when an index is given, the
+    totals and category breakdown come from its prefix sums.
+    """
+    if start is not None or end is not None:
+        in_range = cols.day != NAT_DAY
+        if start is not None:
+            in_range &= cols.day >= start
+        if end is not None:
+            in_range &= cols.day <= end
+        cols = TransactionColumns(**{
+            name: value[in_range] if name not in ("merchants", "merchant_ids", "locations") else value
+            for name, value in vars(cols).items()
+        })
+        if index is not None:
+            totals = index.totals(start, end)
+            return {
+                **compute_dashboard(cols, recent_limit, top_locations, top_merchants),
+                **_range_summary(totals),
+                "spending_by_category": _category_summary(totals),
+            }
+
+    spend = cols.cents > 0
+    spend_cents = cols.cents[spend]
+    n_spend = int(spend.sum())
+
+    # Category breakdown
+    cat = cols.category[spend]
+    cat_totals = np.bincount(cat, weights=spend_cents, minlength=len(CATEGORY_NAMES))
+    cat_counts = np.bincount(cat, minlength=len(CATEGORY_NAMES))
+    cat_order = np.argsort(-cat_totals, kind="stable")
+
+    # Daily trend
+    days, day_inverse = np.unique(cols.day[spend], return_inverse=True)
+    day_totals = np.bincount(day_inverse, weights=spend_cents, minlength=len(days))
+    day_counts = np.bincount(day_inverse, minlength=len(days))
+    valid_days = days != NAT_DAY
+
+    # Day-of-week x hour heatmap
+    dated = spend & (cols.day != NAT_DAY)
+    cell = cols.weekday[dated].astype(np.int64) * 24 + cols.hour[dated]
+    heat_totals = np.bincount(cell, weights=cols.cents[dated], minlength=7 * 24).reshape(7, 24)
+    heat_counts = np.bincount(cell, minlength=7 * 24).reshape(7, 24)
+    heat_cells = np.argwhere(heat_counts > 0)
+
+    # Location ranking
+    loc = cols.location[spend]
+    has_loc = loc >= 0
+    loc_totals = np.bincount(loc[has_loc], weights=spend_cents[has_loc], minlength=len(cols.locations))
+    loc_counts = np.bincount(loc[has_loc], minlength=len(cols.locations))
+    loc_order = np.argsort(-loc_totals, kind="stable")[:top_locations]
+
+    # Merchant ranking
+    merchant = cols.merchant[spend]
+    merchant_totals = np.bincount(merchant, weights=spend_cents, minlength=len(cols.merchants))
+    merchant_counts = np.bincount(merchant, minlength=len(cols.merchants))
+    merchant_order = np.argsort(-merchant_totals, kind="stable")[:top_merchants]
+
+    # Most recent rows: newest transaction date, then post date (undated rows last)
+    newest_first = np.where(cols.day == NAT_DAY, np.iinfo(np.int64).max, -cols.day)
+    recent = np.lexsort((np.where(cols.post_day == NAT_DAY, 0, -cols.post_day), newest_first))[:recent_limit]
+
+    return {
+        "total_spent": int(spend_cents.sum()) / 100,
+        "total_credits": int(-cols.cents[cols.cents < 0].sum()) / 100,
+        "total_transactions": len(cols),
+        "avg_transaction": float(spend_cents.mean()) / 100 if n_spend else 0,
+        "spending_by_category": [
+            {
+                "category": CATEGORY_NAMES[i],
+                "transaction_count": int(cat_counts[i]),
+                "total_amount": round(cat_totals[i]) / 100,
+                "avg_amount": round(cat_totals[i] / cat_counts[i]) / 100,
+                "icon": category_icon(CATEGORY_NAMES[i]),
+                "color": category_color(CATEGORY_NAMES[i])
+            }
+            for i in cat_order if cat_counts[i] > 0
+        ],
+        "recent_transactions": [
+            {
+                "date": _day_to_iso(cols.day[i:i + 1])[0] if cols.day[i] != NAT_DAY else None,
+                "description": cols.descriptions[i],
+                "amount": int(cols.cents[i]) / 100,
+                "location": cols.raw_locations[i] or ""
+            }
+            for i in recent
+        ],
+        "monthly_trend": [
+            {"date": date, "spending": round(total) / 100, "transactions": int(count)}
+            for date, total, count in zip(_day_to_iso(days[valid_days]), day_totals[valid_days], day_counts[valid_days])
+        ],
+        "weekday_hour_heatmap": [
+            {
+                "day_of_week": _WEEKDAYS[w],
+                "hour_of_day": int(h),
+                "transaction_count": int(heat_counts[w, h]),
+                "total_spent": round(heat_totals[w, h]) / 100
+            }
+            for w, h in heat_cells
+        ],
+        "top_locations": [
+            {
+                "location": str(cols.locations[i]),
+                "visits": int(loc_counts[i]),
+                "total_spent": round(loc_totals[i]) / 100,
+                "avg_per_visit": round(loc_totals[i] / loc_counts[i]) / 100
+            }
+            for i in loc_order if loc_counts[i] > 0
+        ],
+        "top_merchants": [
+            {
+                "merchant_id": int(cols.merchant_ids[i]),
+                "merchant": cols.merchants[i],
+                "transaction_count": int(merchant_counts[i]),
+                "total_spent": round(merchant_totals[i]) / 100,
+                "avg_amount": round(merchant_totals[i] / merchant_counts[i]) / 100
+            }
+            for i in merchant_order if merchant_counts[i] > 0
+        ],
+    }
+
+# --------------------------
+# Per-user cache
+# --------------------------
+# (kind, user_id) -> (data version, columns or index)
+_cache: "OrderedDict[Tuple[str, Optional[str]], Tuple[Tuple, Any]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _data_version(user_id: Optional[str]) -> Tuple:
+    """
+    Changes whenever any statement is (re)ingested or merchants are
+    recategorized. The change_log head is global, so one user's upload reloads
+    every cached user; re-uploads keep statements.inserted_at and could not be
+    told apart from it.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        head = change_log_head(cursor)
+        categorized = cursor.execute("SELECT ran_at FROM job_state WHERE job = 'categorizer'").fetchone()
+        return (head, categorized[0] if categorized else None)
+    finally:
+        conn.close()
+
+def _cached(kind: str, user_id: Optional[str], loader) -> Any:
+    """Cached loader(user_id) result, reloaded when the user's statements changed"""
+    key = (kind, user_id)
+    version = _data_version(user_id)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == version:
+            _cache.move_to_end(key)
+            return cached[1]
+
+    value = loader(user_id)
+    with _cache_lock:
+        _cache[key] = (version, value)
+        _cache.move_to_end(key)
+        # Each user holds at most a column set and an index
+        while len(_cache) > 2 * ENGINE_CACHE_USERS:
+            _cache.popitem(last=False)
+    return value
+
+def get_columns(user_id: Optional[str] = None) -> TransactionColumns:
+    """Cached columns for a user, reloaded when their statements changed"""
+    return _cached("columns", user_id, load_columns)
+
+def get_daily_index(user_id: Optional[str] = None) -> DailyIndex:
+    """Cached prefix-sum index for a user, rebuilt from daily_spend when their statements changed"""
+    return _cached("daily", user_id, load_daily_index)
+
+def invalidate(user_id: Optional[str] = None) -> None:
+    """Drop cached data (all users when user_id is None), e.g. after rebuild_dedup_index()"""
+    with _cache_lock:
+        for key in list(_cache):
+            if user_id is None or key[1] in (user_id, None):
+                del _cache[key]
+
+def get_dashboard(user_id: Optional[str] = None, start: Optional[str] = None,
+                  end: Optional[str] = None) -> Dict[str, Any]:
+    start_day, end_day = parse_day(start), parse_day(end)
+    # Detected by the subscriptions batch job; independent of the date range
+    subscriptions = get_subscriptions(user_id)
+    if start_day is None and end_day is None:
+        return {**compute_dashboard(get_columns(user_id)), "subscriptions": subscriptions}
+    return {
+        **compute_dashboard(get_columns(user_id), start=start_day, end=end_day, index=get_daily_index(user_id)),
+        "subscriptions": subscriptions,
+        "start": start,
+        "end": end,
+    }
+
+_GRANULARITIES = ("day", "week", "month")
+
+def _bucket_starts(first: int, last: int, granularity: str) -> np.ndarray:
+    """Day numbers starting each bucket that overlaps [first, last], plus the end boundary"""
+    if granularity == "day":
+        return np.arange(first, last + 2, dtype=np.int64)
+    if granularity == "week":
+        monday = first - (first + 3) % 7  # 1970-01-01 was a Thursday
+        return np.append(np.arange(monday, last + 1, 7, dtype=np.int64), last + 1)
+    months = np.arange(np.datetime64(first, "D").astype("datetime64[M]"),
+                       np.datetime64(last, "D").astype("datetime64[M]") + 2)
+    return months.astype("datetime64[D]").astype(np.int64)
+
+def get_trends(user_id: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+               granularity: str = "month") -> Dict[str, Any]:
+    """
+    Spending per period and category between start and end (defaults: the
+    user's first and last transaction day), plus the range and all-time
+    summaries - all read from the prefix-sum index.
+    """
+    if granularity not in _GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(_GRANULARITIES)}")
+    index = get_daily_index(user_id)
+    start_day, end_day = parse_day(start), parse_day(end)
+    # Buckets outside the indexed days would all be empty
+    first = index.first_day if start_day is None else max(start_day, index.first_day)
+    last = index.last_day if end_day is None else min(end_day, index.last_day)
+
+    range_totals = index.totals(start_day, end_day)
+    all_totals = index.totals()
+    periods: List[Dict[str, Any]] = []
+    if last >= first and index.last_day >= index.first_day:
+        boundaries = _bucket_starts(first, last, granularity)
+        # Partial first/last buckets only count the days inside the range
+        boundaries = np.clip(boundaries, first, last + 1)
+        series = index.series(boundaries)
+        for b, period_start in enumerate(_day_to_iso(boundaries[:-1])):
+            spend_count = int(series["spend_count"][b].sum())
+            periods.append({
+                "period": period_start,
+                "total_spent": int(series["spend_cents"][b].sum()) / 100,
+                "total_credits": int(series["credit_cents"][b].sum()) / 100,
+                "transactions": int(series["transactions"][b].sum()),
+                "avg_transaction": int(series["spend_cents"][b].sum()) / spend_count / 100 if spend_count else 0,
+                "by_category": {
+                    CATEGORY_NAMES[c]: int(series["spend_cents"][b][c]) / 100
+                    for c in np.flatnonzero(series["spend_count"][b])
+                },
+            })
+
+    return {
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "periods": periods,
+        "summary": _range_summary(range_totals),
+        "spending_by_category": _category_summary(range_totals),
+        "all_time": _range_summary(all_totals),
+    }
@@ -0,0 +1,389 @@
+"""
+Analytics query definitions
+Every spending metric is declared once here and compiled to each SQL dialect
+(SQLite for the local database, Databricks SQL for the warehouse - the DuckDB
+stand-in translates that). Category rules, the amount sign convention and the
+internal-transfer exclusion live in one place, so the dashboard, the warehouse
+analytics and databricks_queries.sql can no longer drift apart.
+
+Sign convention (as extracted from statements): purchases are stored as
+positive amounts, payments and refunds as negative amounts.
+
+Regenerate databricks_queries.sql after editing a metric:
+    python analytics_sql.py > ../databricks_queries.sql
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+SQLITE = "sqlite"
+DATABRICKS = "databricks"
+
+# (category, description substrings, icon, color) - first match wins
+CATEGORY_RULES: Tuple[Tuple[str, Tuple[str, ...], str, str], ...] = (
+    ("Transportation", ("PRESTO", "METROLINX", "GO TRANSIT", "HOPP", "CITY OF GUELPH"), "Car", "bg-blue-500"),
+    ("Shopping & Groceries", ("SOBEYS", "FOOD BASICS", "WAL-MART", "WALMART", "DOLLARAMA",
+                              "LCBO", "FROOTLAND"), "ShoppingCart", "bg-green-500"),
+    ("Food & Dining", ("MCDONALD", "HARVEY", "CHIPOTLE", "THAI", "UBER", "RESTAURANT", "AMANO", "POULET"),
+     "Coffee", "bg-red-500"),
+    ("Entertainment", ("SPOTIFY", "NETFLIX", "ENTERTAINMENT"), "Smartphone", "bg-yellow-500"),
+    ("Education", ("UNIV", "COLLEGE", "SCHOOL"), "GraduationCap", "bg-purple-500"),
+    ("Clothing", ("H&M", "HM CA", "CLOTHING"), "Shirt", "bg-pink-500"),
+    ("Housing", ("RENT", "MORTGAGE", "UTILITIES"), "Home", "bg-indigo-500"),
+)
+OTHER_CATEGORY = ("Other", "DollarSign", "bg-gray-500")
+
+# Card payments and bank transfers, not spending
+INTERNAL_PATTERNS = ("SCOTIABANK",)
+
+CATEGORY_NAMES: Tuple[str, ...] = tuple(name for name, _, _, _ in CATEGORY_RULES) + (OTHER_CATEGORY[0],)
+
+def categorize(description: str, fallback: Optional[str] = None) -> str:
+    """
+    Python twin of the {category} CASE expression. fallback (the merchant's
+    learned category, see categorizer.py) replaces Other, as in daily_spend.
+    """
+    text = (description or "").upper()
+    return next((name for name, patterns, _, _ in CATEGORY_RULES if any(p in text for p in patterns)),
+                fallback or OTHER_CATEGORY[0])
+
+def is_internal(description: str) -> bool:
+    text = (description or "").upper()
+    return any(p in text for p in INTERNAL_PATTERNS)
+
+def category_icon(category: str) -> str:
+    return next((icon for name, _, icon, _ in CATEGORY_RULES if name == category), OTHER_CATEGORY[1])
+
+def category_color(category: str) -> str:
+    return next((color for name, _, _, color in CATEGORY_RULES if name == category), OTHER_CATEGORY[2])
+
+# SQLite indexes that metrics declare in `relies_on`; created by init_database()
+SQLITE_INDEXES: Dict[str, str] = {
+    "idx_transactions_recent":
+        "CREATE INDEX IF NOT EXISTS idx_transactions_recent ON transactions (transaction_date DESC, post_date DESC)",
+    "idx_transactions_date":
+        "CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (transaction_date, amount)",
+}
+
+@dataclass(frozen=True)
+class Metric:
+    """One analytics query, written once with dialect placeholders"""
+    name: str
+    title: str
+    template: str
+    relies_on: str
+    dialects: Tuple[str, ...] = (SQLITE, DATABRICKS)
+
+# --------------------------
+# Dialect fragments
+# --------------------------
+def _category_case() -> str:
+    whens = "\n".join(
+        f"        WHEN {' OR '.join(f'UPPER(description) LIKE {chr(39)}%{p}%{chr(39)}' for p in patterns)} THEN '{name}'"
+        for name, patterns, _, _ in CATEGORY_RULES
+    )
+    return f"CASE\n{whens}\n        ELSE '{OTHER_CATEGORY[0]}'\n    END"
+
+_WEEKDAYS = ("Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday")
+
+def _fragments(dialect: str, schema: str) -> Dict[str, str]:
+    internal = " AND ".join(f"UPPER(description) NOT LIKE '%{p}%'" for p in INTERNAL_PATTERNS)
+    common = {
+        "category": _category_case(),
+        "is_spend": "amount > 0",
+        "is_credit": "amount < 0",
+        "not_internal": internal,
+        "weekday_order": " ".join(f"WHEN '{d}' THEN {(i + 6) % 7 + 1}" for i, d in enumerate(_WEEKDAYS)),
+        # Rows counted through an overlapping statement (see transaction_dedup; shipped by dbxLoader)
+        "and_not_duplicate": " AND duplicate_of IS NULL",
+    }
+    if dialect == SQLITE:
+        return {
+            **common,
+            "transactions": "transactions",
+            "statements": "statements",
+            "month": "strftime('%Y-%m', transaction_date)",
+            "weekday": "CASE strftime('%w', transaction_date) "
+                       + " ".join(f"WHEN '{i}' THEN '{d}'" for i, d in enumerate(_WEEKDAYS)) + " END",
+            "hour": "CAST(strftime('%H', COALESCE(post_date, transaction_date)) AS INTEGER)",
+            "week_start": "date(transaction_date, '-6 days', 'weekday 1')",
+        }
+    if dialect == DATABRICKS:
+        return {
+            **common,
+            "transactions": f"`{schema}`.`transactions`",
+            "statements": f"`{schema}`.`statements`",
+            "month": "DATE_FORMAT(transaction_date, 'yyyy-MM')",
+            "weekday": "DATE_FORMAT(transaction_date, 'EEEE')",
+            "hour": "HOUR(COALESCE(post_date, transaction_date))",
+            "week_start": "DATE_TRUNC('week', transaction_date)",
+        }
+    raise ValueError(f"Unknown SQL dialect: {dialect}")
+
+# --------------------------
+# Metrics
+# --------------------------
+METRICS: Dict[str, Metric] = {m.name: m for m in [
+    Metric(
+        "spending_overview", "💰 Spending overview",
+        """
+SELECT
+    COUNT(*) AS total_transactions,
+    COALESCE(SUM(CASE WHEN {is_spend} THEN amount ELSE 0 END), 0) AS total_spent,
+    COALESCE(SUM(CASE WHEN {is_credit} THEN -amount ELSE 0 END), 0) AS total_credits,
+    COALESCE(AVG(CASE WHEN {is_spend} THEN amount END), 0) AS avg_transaction
+FROM {transactions}
+WHERE {not_internal}{and_not_duplicate}
+""",
+        relies_on="full scan of transactions",
+    ),
+    Metric(
+        "spending_by_category", "🏪 Spending by category",
+        """
+SELECT
+    {category} AS category,
+    COUNT(*) AS transaction_count,
+    SUM(amount) AS total_amount,
+    AVG(amount) AS avg_amount
+FROM {transactions}
+WHERE {is_spend} AND {not_internal}{and_not_duplicate}
+GROUP BY 1
+ORDER BY total_amount DESC
+""",
+        relies_on="full scan of transactions",
+    ),
+    Metric(
+        "latest_statement_spend", "💳 Card spending on a user's latest statement (parameter: user_id)",
+        """
+SELECT COALESCE(SUM(amount), 0) AS total_spending
+FROM {transactions}
+WHERE statement_id = (
+    SELECT statement_id
+    FROM {statements}
+    WHERE user_id = ?
+    ORDER BY statement_date DESC, inserted_at DESC
+    LIMIT 1
+) AND {is_spend} AND {not_internal}
+""",
+        relies_on="idx_statements_user, idx_transactions_statement_fingerprint (statement_id prefix)",
+    ),
+    Metric(
+        "recent_transactions", "💳 Recent transactions",
+        """
+SELECT transaction_date, description, amount, location
+FROM {transactions}
+WHERE {not_internal}{and_not_duplicate}
+ORDER BY transaction_date DESC, post_date DESC
+LIMIT 10
+""",
+        relies_on="idx_transactions_recent",
+    ),
+    Metric(
+        "daily_spending", "📈 Daily spending trend",
+        """
+SELECT
+    transaction_date,
+    SUM(amount) AS daily_spending,
+    COUNT(*) AS transaction_count
+FROM {transactions}
+WHERE {is_spend} AND {not_internal}{and_not_duplicate}
+GROUP BY transaction_date
+ORDER BY transaction_date
+""",
+        relies_on="idx_transactions_date",
+    ),
+    Metric(
+        "monthly_summary", "📊 Monthly spending summary",
+        """
+SELECT
+    {month} AS month,
+    COUNT(*) AS transactions,
+    SUM(CASE WHEN {is_spend} THEN amount ELSE 0 END) AS spending,
+    SUM(CASE WHEN {is_credit} THEN -amount ELSE 0 END) AS credits
+FROM {transactions}
+WHERE {not_internal}{and_not_duplicate}
+GROUP BY 1
+ORDER BY month DESC
+""",
+        relies_on="idx_transactions_date",
+    ),
+    Metric(
+        "monthly_category_spending", "💰 Spending patterns by month and category",
+        """
+SELECT
+    {month} AS month,
+    {category} AS category,
+    COUNT(*) AS transaction_count,
+    SUM(amount) AS total_amount,
+    AVG(amount) AS avg_amount,
+    MIN(amount) AS min_amount,
+    MAX(amount) AS max_amount
+FROM {transactions}
+WHERE {is_spend} AND {not_internal}{and_not_duplicate}
+GROUP BY 1, 2
+ORDER BY month DESC, total_amount DESC
+""",
+        relies_on="full scan of transactions",
+    ),
+    Metric(
+        "weekday_hour_spending", "🕒 Spending by weekday and hour",
+        """
+SELECT
+    {weekday} AS day_of_week,
+    {hour} AS hour_of_day,
+    COUNT(*) AS transaction_count,
+    SUM(amount) AS total_spent
+FROM {transactions}
+WHERE {is_spend} AND {not_internal}{and_not_duplicate}
+GROUP BY 1, 2
+ORDER BY CASE day_of_week {weekday_order} END, hour_of_day
+""",
+        relies_on="full scan of transactions",
+    ),
+    Metric(
+        "top_locations", "📍 Top spending locations",
+        """
+SELECT
+    location,
+    COUNT(*) AS visits,
+    SUM(amount) AS total_spent,
+    AVG(amount) AS avg_per_visit
+FROM {transactions}
+WHERE {is_spend} AND {not_internal}{and_not_duplicate} AND location IS NOT NULL
+GROUP BY location
+ORDER BY total_spent DESC
+LIMIT 10
+""",
+        relies_on="full scan of transactions",
+    ),
+    Metric(
+        "statement_overview", "🎯 Statement overview",
+        """
+SELECT
+    s.statement_id, s.bank_name, s.card_type, s.period_start, s.period_end,
+    s.ending_balance, s.minimum_payment, s.payment_due_date,
+    COUNT(t.statement_id) AS transaction_count
+FROM {statements} s
+LEFT JOIN {transactions} t ON s.statement_id = t.statement_id
+GROUP BY s.statement_id, s.bank_name, s.card_type, s.period_start, s.period_end,
+         s.ending_balance, s.minimum_payment, s.payment_due_date
+ORDER BY s.period_end DESC
+""",
+        relies_on="idx_transactions_statement_fingerprint (statement_id prefix)",
+    ),
+    Metric(
+        "running_spend", "💰 Running spend with window functions",
+        """
+SELECT
+    transaction_date,
+    description,
+    amount,
+    SUM(amount) OVER (ORDER BY transaction_date ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS running_total,
+    LAG(amount, 1) OVER (ORDER BY transaction_date) AS prev_amount,
+    CASE WHEN amount > AVG(amount) OVER () THEN 'Above Average' ELSE 'Below Average' END AS spending_category
+FROM {transactions}
+WHERE {is_spend} AND {not_internal}{and_not_duplicate}
+ORDER BY transaction_date DESC
+""",
+        relies_on="idx_transactions_date",
+    ),
+    Metric(
+        "category_percentiles", "📊 Category performance with percentiles",
+        """
+SELECT
+    category,
+    COUNT(*) AS transactions,
+    SUM(amount) AS total_spent,
+    PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY amount) AS median_spend,
+    PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY amount) AS p95_spend,
+    STDDEV(amount) AS spending_volatility
+FROM (
+    SELECT {category} AS category, amount
+    FROM {transactions}
+    WHERE {is_spend} AND {not_internal}{and_not_duplicate}
+) t
+GROUP BY category
+ORDER BY total_spent DESC
+""",
+        relies_on="full scan of transactions",
+        dialects=(DATABRICKS,),
+    ),
+    Metric(
+        "weekly_features", "🕒 Weekly features for forecasting",
+        """
+SELECT
+    {week_start} AS week_start,
+    COUNT(*) AS weekly_transactions,
+    SUM(amount) AS weekly_spending,
+    AVG(amount) AS avg_transaction_size,
+    COUNT(DISTINCT transaction_date) AS active_days,
+    SUM(amount) / COUNT(DISTINCT transaction_date) AS daily_avg_spending
+FROM {transactions}
+WHERE {is_spend} AND {not_internal}{and_not_duplicate}
+GROUP BY 1
+ORDER BY week_start
+""",
+        relies_on="idx_transactions_date",
+    ),
+]}
+
+@lru_cache(maxsize=None)
+def compile_metric(name: str, dialect: str, schema: str = "finance") -> str:
+    """SQL for one metric in one dialect (compiled once per process)"""
+    metric = METRICS[name]
+    if dialect not in metric.dialects:
+        raise ValueError(f"Metric {name} is not available in {dialect}")
+    return metric.template.format(**_fragments(dialect, schema)).strip()
+
+def required_sqlite_indexes() -> List[str]:
+    """CREATE INDEX statements for every SQLite index a metric relies on"""
+    return [ddl for name, ddl in SQLITE_INDEXES.items()
+            if any(m.relies_on == name and SQLITE in m.dialects for m in METRICS.values())]
+
+# --------------------------
+# Daily rollup (SQLite)
+# --------------------------
+_DAILY_ROLLUP_TEMPLATE = """
+INSERT INTO daily_spend (user_id, day, category, transactions, spend_count, spend_cents, credit_cents)
+SELECT
+    s.user_id,
+    date(transaction_date) AS day,
+    COALESCE(NULLIF({category}, '{other}'),
+             (SELECT m.category FROM merchants m WHERE m.merchant_id = t.merchant_id), '{other}') AS category,
+    COUNT(*),
+    SUM(CASE WHEN {is_spend} THEN 1 ELSE 0 END),
+    SUM(CASE WHEN {is_spend} THEN CAST(ROUND(amount * 100) AS INTEGER) ELSE 0 END),
+    SUM(CASE WHEN {is_credit} THEN CAST(ROUND(-amount * 100) AS INTEGER) ELSE 0 END)
+FROM {transactions} t
+JOIN {statements} s ON s.statement_id = t.statement_id
+WHERE {not_internal}{and_not_duplicate} AND date(transaction_date) IS NOT NULL{filters}
+GROUP BY 1, 2, 3
+"""
+
+@lru_cache(maxsize=None)
+def daily_rollup_sql(by_user: bool = False, by_days: bool = False) -> str:
+    """
+    Refill daily_spend (per user, day and category totals in integer cents)
+    with the same category/sign/internal/duplicate rules as the metrics above;
+    rows the keyword rules leave in Other take their merchant's learned category.
+    by_user adds a user_id parameter, by_days a JSON array of ISO days.
+    """
+    filters = ""
+    if by_user:
+        filters += " AND s.user_id = ?"
+    if by_days:
+        filters += " AND date(transaction_date) IN (SELECT value FROM json_each(?))"
+    return _DAILY_ROLLUP_TEMPLATE.format(**_fragments(SQLITE, ""), other=OTHER_CATEGORY[0], filters=filters).strip()
+
+def render_sql_file(dialect: str = DATABRICKS, schema: str = "finance") -> str:
+    """All metrics for one dialect as a commented .sql script"""
+    parts = [f"-- 📊 ANALYTICS QUERIES ({dialect.upper()})",
+             "-- Generated by api/analytics_sql.py - edit the metric definitions there, not this file.", ""]
+    for metric in METRICS.values():
+        if dialect in metric.dialects:
+            parts += [f"-- {metric.title} [{metric.name}, relies on: {metric.relies_on}]",
+                      compile_metric(metric.name, dialect, schema) + ";", ""]
+    return "\n".join(parts)
+
+if __name__ == "__main__":
+    print(render_sql_file(), end="")
@@ -0,0 +1,298 @@
+"""
+Streaming anomaly detection
+Keeps running statistics (count, Welford mean and M2) per user for every
+merchant and category, both per transaction and per calendar month, and scores
+each newly ingested charge against them before folding it in. Scoring is O(1)
+per transaction: ingest never re-reads a user's history.
+
+Scopes (merchants are keyed by merchant id, see merchants.py):
+    merchant / category             - one charge vs that merchant's/category's usual charge
+    merchant_month / category_month - month-to-date total vs that key's usual monthly total
+
+Flags are written to the alerts table. Every function takes the ingest
+cursor, so stats and alerts commit atomically with the statement.
+"""
+import math
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Flag at or above this many standard deviations over the mean
+ANOMALY_ZSCORE = float(os.getenv("ANOMALY_ZSCORE", "4"))
+# Observations a key needs before it is scored (charges / months)
+ANOMALY_MIN_HISTORY = int(os.getenv("ANOMALY_MIN_HISTORY", "5"))
+ANOMALY_MIN_MONTHS = int(os.getenv("ANOMALY_MIN_MONTHS", "3"))
+# Charges (or monthly totals) below this are never flagged
+ANOMALY_MIN_AMOUNT = float(os.getenv("ANOMALY_MIN_AMOUNT", "20"))
+# Spread floor as a fraction of the mean, so a merchant that always charges
+# exactly $9.99 does not flag a $10.49 charge
+ANOMALY_MIN_STDDEV_RATIO = float(os.getenv("ANOMALY_MIN_STDDEV_RATIO", "0.25"))
+
+TRANSACTION_SCOPES = ("merchant", "category")
+MONTH_SCOPES = ("merchant_month", "category_month")
+
+# (statement_id, transaction_date, merchant_id, category, amount, location) of one canonical purchase
+SpendRow = Tuple[str, Optional[str], int, str, float, Optional[str]]
+# Canonical purchases by dedup key: (transaction id, SpendRow)
+SpendSnapshot = Dict[str, Tuple[int, SpendRow]]
+
+def ensure_tables(cursor) -> bool:
+    """Create the stats and alerts tables; True when the stats table is new and needs a backfill"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'spend_stats'")
+    created = cursor.fetchone() is None
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS spend_stats (
+        user_id TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        mean REAL NOT NULL,
+        m2 REAL NOT NULL,
+        PRIMARY KEY (user_id, scope, key)
+    ) WITHOUT ROWID
+    """)
+    # Month-to-date totals feeding the *_month scopes
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS spend_month (
+        user_id TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        month TEXT NOT NULL,
+        total REAL NOT NULL,
+        PRIMARY KEY (user_id, scope, key, month)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        period TEXT,
+        transaction_id INTEGER,
+        statement_id TEXT,
+        amount REAL NOT NULL,
+        mean REAL NOT NULL,
+        stddev REAL NOT NULL,
+        zscore REAL NOT NULL,
+        message TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alerts_user ON alerts (user_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alerts_period ON alerts (user_id, scope, key, period)")
+    return created
+
+# --------------------------
+# Welford running statistics
+# --------------------------
+def _add(stats: List[float], x: float) -> None:
+    n, mean, m2 = stats
+    n += 1
+    delta = x - mean
+    mean += delta / n
+    stats[:] = [n, mean, m2 + delta * (x - mean)]
+
+def _remove(stats: List[float], x: float) -> None:
+    """Inverse of _add, for deleted rows and superseded month totals"""
+    n, mean, m2 = stats
+    if n <= 1:
+        stats[:] = [0, 0.0, 0.0]
+        return
+    old_mean = (n * mean - x) / (n - 1)
+    stats[:] = [n - 1, old_mean, max(m2 - (x - old_mean) * (x - mean), 0.0)]
+
+def _stddev(stats: List[float]) -> float:
+    n, _, m2 = stats
+    return math.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+
+def _zscore(stats: List[float], x: float, min_history: int) -> Optional[Tuple[float, float]]:
+    """(z, effective stddev) when x is scoreable and anomalous against stats, else None"""
+    n, mean, _ = stats
+    if n < min_history or x < ANOMALY_MIN_AMOUNT or x <= mean:
+        return None
+    spread = max(_stddev(stats), ANOMALY_MIN_STDDEV_RATIO * abs(mean))
+    if spread <= 0:
+        return None
+    z = (x - mean) / spread
+    return (z, spread) if z >= ANOMALY_ZSCORE else None
+
+class _Batch:
+    """Stats and month totals touched by one ingest, read once and written back once"""
+
+    def __init__(self, cursor, user_id: str):
+        self.cursor = cursor
+        self.user_id = user_id
+        self.stats: Dict[Tuple[str, str], List[float]] = {}
+        self.months: Dict[Tuple[str, str, str], float] = {}
+        self.flagged_months = set()
+
+    def stats_for(self, scope: str, key: str) -> List[float]:
+        if (scope, key) not in self.stats:
+            self.cursor.execute("SELECT n, mean, m2 FROM spend_stats WHERE user_id = ? AND scope = ? AND key = ?",
+                                (self.user_id, scope, key))
+            row = self.cursor.fetchone()
+            self.stats[(scope, key)] = list(row) if row else [0, 0.0, 0.0]
+        return self.stats[(scope, key)]
+
+    def month_total(self, scope: str, key: str, month: str) -> Optional[float]:
+        if (scope, key, month) not in self.months:
+            self.cursor.execute(
+                "SELECT total FROM spend_month WHERE user_id = ? AND scope = ? AND key = ? AND month = ?",
+                (self.user_id, scope, key, month)
+            )
+            row = self.cursor.fetchone()
+            self.months[(scope, key, month)] = row[0] if row else None
+        return self.months[(scope, key, month)]
+
+    def label(self, scope: str, key: str) -> str:
+        """Display name for a stats key (merchant name for merchant scopes)"""
+        if scope not in ("merchant", "merchant_month"):
+            return key
+        self.cursor.execute("SELECT name FROM merchants WHERE merchant_id = ?", (int(key),))
+        row = self.cursor.fetchone()
+        return row[0] if row else f"Merchant #{key}"
+
+    def flush(self) -> None:
+        self.cursor.executemany("""
+        INSERT INTO spend_stats (user_id, scope, key, n, mean, m2) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, scope, key) DO UPDATE SET n = excluded.n, mean = excluded.mean, m2 = excluded.m2
+        """, [(self.user_id, scope, key, *stats) for (scope, key), stats in self.stats.items()])
+        self.cursor.executemany(
+            "DELETE FROM spend_month WHERE user_id = ? AND scope = ? AND key = ? AND month = ?",
+            [(self.user_id, *k) for k, total in self.months.items() if total is None]
+        )
+        self.cursor.executemany("""
+        INSERT INTO spend_month (user_id, scope, key, month, total) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, scope, key, month) DO UPDATE SET total = excluded.total
+        """, [(self.user_id, *k, total) for k, total in self.months.items() if total is not None])
+
+def _keys(row: SpendRow) -> Dict[str, str]:
+    """Stats key per scope: merchants by id (names can change), categories by name"""
+    merchant = str(row[2])
+    return {"merchant": merchant, "category": row[3], "merchant_month": merchant, "category_month": row[3]}
+
+def _apply(batch: _Batch, tx_id: int, row: SpendRow, sign: int, score: bool) -> List[Dict[str, Any]]:
+    """Fold one purchase in (sign=1) or out (sign=-1); returns alerts when score is set"""
+    alerts = []
+    amount = row[4]
+    keys = _keys(row)
+    for scope in TRANSACTION_SCOPES:
+        stats = batch.stats_for(scope, keys[scope])
+        if sign > 0:
+            flagged = _zscore(stats, amount, ANOMALY_MIN_HISTORY) if score else None
+            if flagged:
+                alerts.append(_alert(scope, keys[scope], batch.label(scope, keys[scope]), row[1], tx_id, row,
+                                     amount, stats[1], *flagged))
+            _add(stats, amount)
+        else:
+            _remove(stats, amount)
+
+    month = (row[1] or "")[:7]
+    if not month:
+        return alerts
+    for scope in MONTH_SCOPES:
+        stats = batch.stats_for(scope, keys[scope])
+        old_total = batch.month_total(scope, keys[scope], month)
+        new_total = (old_total or 0.0) + sign * amount
+        if old_total is not None:
+            _remove(stats, old_total)
+        # History excludes the month being scored
+        flagged = _zscore(stats, new_total, ANOMALY_MIN_MONTHS) if score and sign > 0 else None
+        if flagged and not _month_flagged(batch, scope, keys[scope], month):
+            alerts.append(_alert(scope, keys[scope], batch.label(scope, keys[scope]), month, tx_id, row,
+                                 new_total, stats[1], *flagged))
+        if new_total > 0.005:
+            _add(stats, new_total)
+            batch.months[(scope, keys[scope], month)] = new_total
+        else:
+            batch.months[(scope, keys[scope], month)] = None
+    return alerts
+
+def _month_flagged(batch: _Batch, scope: str, key: str, month: str) -> bool:
+    """A key's month is flagged once, not again for every later charge that month"""
+    if (scope, key, month) in batch.flagged_months:
+        return True
+    batch.flagged_months.add((scope, key, month))
+    batch.cursor.execute("SELECT 1 FROM alerts WHERE user_id = ? AND scope = ? AND key = ? AND period = ? LIMIT 1",
+                         (batch.user_id, scope, key, month))
+    return batch.cursor.fetchone() is not None
+
+def _alert(scope: str, key: str, label: str, period: Optional[str], tx_id: int, row: SpendRow,
+           amount: float, mean: float, z: float, stddev: float) -> Dict[str, Any]:
+    if scope in MONTH_SCOPES:
+        message = f"{label}: ${amount:,.2f} spent in {period}, usually ${mean:,.2f} a month ({z:.1f}σ above normal)"
+    else:
+        message = f"{label}: ${amount:,.2f} charge, usually ${mean:,.2f} ({z:.1f}σ above normal)"
+    return {
+        "scope": scope, "key": key, "period": period, "transaction_id": tx_id, "statement_id": row[0],
+        "amount": round(amount, 2), "mean": round(mean, 2), "stddev": round(stddev, 2),
+        "zscore": round(z, 2), "message": message,
+    }
+
+def record_changes(cursor, user_id: str, statement_id: str,
+                   before: SpendSnapshot, after: SpendSnapshot) -> List[Dict[str, Any]]:
+    """
+    Update the running stats with one ingest's effect on the user's canonical
+    purchases (before/after snapshots of the affected rows, keyed by dedup
+    key). A row re-inserted unchanged under a new id is not a change.
+    Rows that appeared in this statement are scored first; rows promoted from
+    another statement (a deleted canonical copy) are folded in silently.
+    Returns the alerts written.
+    """
+    batch = _Batch(cursor, user_id)
+    for key, (tx_id, row) in before.items():
+        if after.get(key, (None, None))[1] != row:
+            _apply(batch, tx_id, row, -1, score=False)
+
+    alerts = []
+    added = sorted(((tx_id, row) for key, (tx_id, row) in after.items()
+                    if before.get(key, (None, None))[1] != row),
+                   key=lambda item: (item[1][1] or "", item[0]))
+    for tx_id, row in added:
+        alerts += _apply(batch, tx_id, row, 1, score=row[0] == statement_id)
+    batch.flush()
+
+    now = datetime.now().isoformat()
+    cursor.executemany("""
+    INSERT INTO alerts (user_id, scope, key, period, transaction_id, statement_id,
+                        amount, mean, stddev, zscore, message, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (user_id, a["scope"], a["key"], a["period"], a["transaction_id"], a["statement_id"],
+         a["amount"], a["mean"], a["stddev"], a["zscore"], a["message"], now)
+        for a in alerts
+    ])
+    return alerts
+
+def rebuild(cursor, rows: Iterable[Tuple[str, int, SpendRow]]) -> None:
+    """Recompute every user's stats from (user_id, id, row) in date order, without raising alerts"""
+    cursor.execute("DELETE FROM spend_stats")
+    cursor.execute("DELETE FROM spend_month")
+    batches: Dict[str, _Batch] = {}
+    for user_id, tx_id, row in rows:
+        batch = batches.setdefault(user_id, _Batch(cursor, user_id))
+        _apply(batch, tx_id, row, 1, score=False)
+    for batch in batches.values():
+        batch.flush()
+
+def list_alerts(cursor, user_id: Optional[str] = None, scope: Optional[str] = None,
+                limit: int = 50, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Newest alerts first; page with before_id (the smallest id already seen)"""
+    filters, params = [], []
+    for column, value in (("user_id", user_id), ("scope", scope)):
+        if value is not None:
+            filters.append(f"{column} = ?")
+            params.append(value)
+    if before_id is not None:
+        filters.append("id < ?")
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    cursor.execute(f"""
+    SELECT id, user_id, scope, key, period, transaction_id, statement_id,
+           amount, mean, stddev, zscore, message, created_at
+    FROM alerts {where}
+    ORDER BY id DESC
+    LIMIT ?
+    """, (*params, limit))
+    return [dict(row) for row in cursor.fetchall()]
@@ -0,0 +1,242 @@
+"""
+Embedding categorizer (offline batch job)
+Merchants that none of the keyword rules in analytics_sql.py match end up in
+Other. This job embeds merchant names and gives each such merchant the
+category of its nearest labeled neighbours: the keyword patterns themselves
+and every merchant whose name the rules do categorize. The result is stored
+on merchants.category, which the dashboard, daily_spend, anomaly stats,
+sketches and subscriptions use in place of Other.
+
+Vectors are unit length and live in one float32 matrix file per embedding
+model (the embeddings table maps each normalized name to its row). The file
+only grows, so a name embedded once never costs another API call, and
+readers memory-map it, so every worker shares one copy through the page cache.
+
+Neighbours are found by exact brute force, not an approximate (ANN) index:
+each run scores the pending merchants against every labeled example in
+CATEGORIZER_CHUNK-row matrix products. The labeled set is the keyword patterns
+plus rule-categorized merchant names - the merchant dictionary, not the
+transactions - so it stays in the thousands and a run costs milliseconds.
+Cost grows with pending x labeled x dim; past CATEGORIZER_EXACT_LIMIT labeled
+examples the job warns, and nearest_categories() is the place to swap in an
+ANN index.
+
+Run: python categorizer.py [--full]
+"""
+import argparse
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+import sqlite_db
+from analytics_sql import CATEGORY_NAMES, CATEGORY_RULES, OTHER_CATEGORY, categorize, is_internal
+from merchants import normalize_description
+from sqlite_db import get_db_connection
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "openai/text-embedding-3-small")
+# Names sent per embeddings request
+EMBEDDING_BATCH = int(os.getenv("EMBEDDING_BATCH", "256"))
+# Directory of the matrix files (defaults to the database's directory)
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR")
+CATEGORIZER_NEIGHBOURS = int(os.getenv("CATEGORIZER_NEIGHBOURS", "5"))
+# Cosine similarity the nearest labeled example needs before a category is assigned
+CATEGORIZER_MIN_SIMILARITY = float(os.getenv("CATEGORIZER_MIN_SIMILARITY", "0.5"))
+# Query rows scored per matrix product, bounding the similarity block in memory
+CATEGORIZER_CHUNK = 1024
+# Labeled examples brute-force scoring is sized for (about 600 MB of float32 at 1536 dims)
+CATEGORIZER_EXACT_LIMIT = int(os.getenv("CATEGORIZER_EXACT_LIMIT", "100000"))
+
+# --------------------------
+# Vector store
+# --------------------------
+def matrix_path(model: str = EMBEDDING_MODEL) -> str:
+    directory = EMBEDDING_DIR or os.path.dirname(os.path.abspath(sqlite_db.DB_PATH))
+    return os.path.join(directory, f"embeddings-{re.sub(r'[^A-Za-z0-9]+', '-', model)}.f32")
+
+def _append_rows(path: str, vectors: np.ndarray) -> int:
+    """Append vectors to the matrix file; returns the row number of the first one"""
+    row_bytes = vectors.shape[1] * 4
+    with open(path, "ab") as f:
+        size = f.seek(0, os.SEEK_END)
+        # Drop a row torn by an interrupted write so rows stay aligned
+        if size % row_bytes:
+            size -= size % row_bytes
+            f.truncate(size)
+        f.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    return size // row_bytes
+
+_matrix_cache: Dict[str, Tuple[int, np.ndarray]] = {}
+_matrix_lock = threading.Lock()
+
+def load_matrix(model: str, dim: int) -> np.ndarray:
+    """Read-only memory map of a model's matrix, remapped when the file has grown"""
+    path = matrix_path(model)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    with _matrix_lock:
+        cached = _matrix_cache.get(path)
+        if cached and cached[0] == size:
+            return cached[1]
+        rows = size // (dim * 4)
+        matrix = np.memmap(path, dtype="<f4", mode="r", shape=(rows, dim)) if rows else np.zeros((0, dim), "<f4")
+        _matrix_cache[path] = (size, matrix)
+        return matrix
+
+def _default_client():
+    from DataExtractor.embeddingCache import get_embedding_cache
+    return get_embedding_cache()
+
+def _embed_batch(client, model: str, texts: List[str]) -> np.ndarray:
+    response = client.embeddings(model=model, input=texts)
+    data = sorted(response["data"], key=lambda item: item.get("index", 0))
+    vectors = np.array([item["embedding"] for item in data], dtype=np.float32)
+    if len(vectors) != len(texts):
+        raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def embed(conn, texts: Iterable[str], client=None, model: str = EMBEDDING_MODEL) -> Dict[str, Any]:
+    """
+    Matrix rows of texts, embedding only those not stored yet (EMBEDDING_BATCH
+    per request). Returns {"rows": text -> row, "dim", "requests", "embedded"}.
+    """
+    cursor = conn.cursor()
+    wanted = sorted(set(texts))
+    cursor.execute("SELECT text, row, dim FROM embeddings WHERE model = ?", (model,))
+    stored = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    rows = {t: stored[t][0] for t in wanted if t in stored}
+    dim = next(iter(stored.values()))[1] if stored else None
+
+    unseen = [t for t in wanted if t not in stored]
+    requests = 0
+    for i in range(0, len(unseen), EMBEDDING_BATCH):
+        batch = unseen[i:i + EMBEDDING_BATCH]
+        if client is None:
+            client = _default_client()
+        vectors = _embed_batch(client, model, batch)
+        requests += 1
+        if dim is not None and vectors.shape[1] != dim:
+            raise ValueError(f"{model} returned {vectors.shape[1]}-dimensional vectors, the index holds {dim}")
+        dim = vectors.shape[1]
+        first = _append_rows(matrix_path(model), vectors)
+        cursor.executemany("INSERT INTO embeddings (model, text, row, dim) VALUES (?, ?, ?, ?)",
+                           [(model, t, first + j, dim) for j, t in enumerate(batch)])
+        # Rows are durable in the file before they are recorded, so a crash only wastes space
+        conn.commit()
+        rows.update((t, first + j) for j, t in enumerate(batch))
+    return {"rows": rows, "dim": dim, "requests": requests, "embedded": len(unseen)}
+
+# --------------------------
+# Nearest-neighbour labels
+# --------------------------
+def nearest_categories(matrix: np.ndarray, query_rows: np.ndarray, label_rows: np.ndarray,
+                       labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Category index (into CATEGORY_NAMES) and best similarity per query row:
+    a similarity-weighted vote of the CATEGORIZER_NEIGHBOURS closest labeled
+    rows, or Other when even the closest is below CATEGORIZER_MIN_SIMILARITY
+    """
+    other = CATEGORY_NAMES.index(OTHER_CATEGORY[0])
+    categories = np.full(len(query_rows), other, dtype=np.int16)
+    best = np.zeros(len(query_rows), dtype=np.float32)
+    if len(query_rows) == 0 or len(label_rows) == 0:
+        return categories, best
+    if len(label_rows) > CATEGORIZER_EXACT_LIMIT:
+        print(f"⚠️ Exact kNN over {len(label_rows)} labeled merchants exceeds CATEGORIZER_EXACT_LIMIT "
+              f"({CATEGORIZER_EXACT_LIMIT}); consider an ANN index")
+    examples = np.asarray(matrix[label_rows])
+    k = min(CATEGORIZER_NEIGHBOURS, len(label_rows))
+    for start in range(0, len(query_rows), CATEGORIZER_CHUNK):
+        chunk = np.asarray(matrix[query_rows[start:start + CATEGORIZER_CHUNK]])
+        sims = chunk @ examples.T
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        votes = np.zeros((len(chunk), len(CATEGORY_NAMES)), dtype=np.float32)
+        np.add.at(votes, (np.repeat(np.arange(len(chunk)), k), labels[top].ravel()),
+                  np.maximum(top_sims, 0).ravel())
+        chunk_best = top_sims.max(axis=1)
+        end = start + len(chunk)
+        best[start:end] = chunk_best
+        categories[start:end] = np.where(chunk_best >= CATEGORIZER_MIN_SIMILARITY, votes.argmax(axis=1), other)
+    return categories, best
+
+def _labeled_examples(merchant_names: Iterable[str]) -> Dict[str, str]:
+    """Keyword patterns and rule-categorized merchant names, with their categories"""
+    examples = {normalize_description(p): name for name, patterns, _, _ in CATEGORY_RULES for p in patterns}
+    for merchant in merchant_names:
+        category = categorize(merchant)
+        if category != OTHER_CATEGORY[0]:
+            examples[merchant] = category
+    return examples
+
+def run(full: bool = False, client=None, model: str = EMBEDDING_MODEL) -> Dict[str, Any]:
+    """
+    Categorize merchants the keyword rules leave in Other (only those not
+    looked at yet unless full), then refresh the rollups that group by category.
+    """
+    started = time.time()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT merchant_id, name, category, category_source FROM merchants")
+        merchants = cursor.fetchall()
+        examples = _labeled_examples(m["name"] for m in merchants)
+        pending = [m for m in merchants
+                   if m["name"] not in examples and not is_internal(m["name"])
+                   and (full or m["category_source"] is None)]
+
+        embedded = {"embedded": 0, "requests": 0}
+        changed = 0
+        if pending:
+            embedded = embed(conn, list(examples) + [m["name"] for m in pending], client=client, model=model)
+            rows = embedded["rows"]
+            matrix = load_matrix(model, embedded["dim"])
+            categories, _ = nearest_categories(
+                matrix,
+                np.array([rows[m["name"]] for m in pending], dtype=np.int64),
+                np.array([rows[t] for t in examples], dtype=np.int64),
+                np.array([CATEGORY_NAMES.index(c) for c in examples.values()], dtype=np.int64),
+            )
+            updates = []
+            for merchant, category in zip(pending, categories):
+                learned = CATEGORY_NAMES[category] if CATEGORY_NAMES[category] != OTHER_CATEGORY[0] else None
+                changed += learned != merchant["category"]
+                updates.append((learned, merchant["merchant_id"]))
+            cursor.executemany("UPDATE merchants SET category = ?, category_source = 'nearest' WHERE merchant_id = ?",
+                               updates)
+
+        # Category totals and stats were computed with the old categories
+        if changed:
+            sqlite_db._refresh_daily_spend(cursor)
+            sqlite_db._rebuild_spend_stats(cursor)
+            sqlite_db._rebuild_sketches(cursor)
+        now = datetime.now().isoformat()
+        cursor.execute("""
+        INSERT INTO job_state (job, watermark, ran_at) VALUES ('categorizer', ?, ?)
+        ON CONFLICT (job) DO UPDATE SET watermark = excluded.watermark, ran_at = excluded.ran_at
+        """, (str(max((m["merchant_id"] for m in merchants), default=0)), now))
+        conn.commit()
+
+        result = {
+            "merchants_scanned": len(pending),
+            "recategorized": int(changed),
+            "embedded": embedded["embedded"],
+            "embedding_requests": embedded["requests"],
+            "seconds": round(time.time() - started, 2),
+        }
+        print(f"✅ Merchant categorization done: {result}")
+        return result
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Categorize merchants the keyword rules miss")
+    parser.add_argument("--full", action="store_true", help="re-score every merchant, not just new ones")
+    args = parser.parse_args()
+    run(full=args.full)
@@ -5,13 +5,20 @@ Perfect for showcasing Databricks capabilities at events!
 """
 import os
 import json
-import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
-from databricks import sql
 from dotenv import load_dotenv
-import pandas as pd
 from datetime import datetime, timedelta
 import requests
+import pyarrow as pa
+
+import dbxLoader
+import sqlite_db
+from dbx_pool import run_with_timeout as _run_with_timeout
+from warehouse import get_warehouse, arrow_to_records
+from analytics_sql import DATABRICKS, METRICS, compile_metric
 
 load_dotenv()
 
@@ -21,8 +28,28 @@ DATABRICKS_HTTP_PATH = os.getenv("DATABRICKS_HTTP_PATH", "/sql/1.0/warehouses/24
 DATABRICKS_TOKEN = os.getenv("DATABRICKS_TOKEN", "REPLACE_ME")
 DATABRICKS_SCHEMA = os.getenv("DATABRICKS_SCHEMA", "finance")
 
-# SQLite Database
-SQLITE_DB = os.path.join(os.path.dirname(__file__), "finance.db")
+# change_log consumer name in sync_state
+SYNC_TARGET = "databricks"
+
+# change_log rows read per incremental sync batch
+SYNC_BATCH_ROWS = int(os.getenv("DATABRICKS_SYNC_BATCH_ROWS", "500"))
+
+# Statements shipped per write_statements call (one MERGE per table)
+SYNC_BATCH_STATEMENTS = int(os.getenv("DATABRICKS_SYNC_BATCH_STATEMENTS", "50"))
+
+# Seconds an advanced-analytics result is served from cache (a sync clears it sooner)
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "300"))
+
+# One thread per analytics query so they overlap on separate pooled connections
+_analytics_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="dbx-analytics")
+
+def _fetch_one(conn, query: str):
+    cur = conn.cursor()
+    try:
+        cur.execute(query)
+        return cur.fetchone()
+    finally:
+        cur.close()
 
 class DatabricksVisualizer:
     """Databricks integration for advanced data visualization and analytics"""
@@ -32,39 +59,29 @@ class DatabricksVisualizer:
         self.http_path = DATABRICKS_HTTP_PATH
         self.token = DATABRICKS_TOKEN
         self.schema = DATABRICKS_SCHEMA
+        self._analytics_cache: Optional[tuple] = None  # (expires_at, result)
+        self._analytics_generation = 0
+        self._analytics_lock = threading.Lock()
         
     def test_connection(self) -> Dict[str, Any]:
         """Test Databricks connection for visualization features"""
         try:
-            # Add timeout to prevent hanging
-            import signal
-            
-            def timeout_handler(signum, frame):
-                raise TimeoutError("Databricks connection timed out")
-            
-            signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(5)  # 5 second timeout
-            
-            try:
-                with sql.connect(
-                    server_hostname=self.host,
-                    http_path=self.http_path,
-                    access_token=self.token
-                ) as conn:
-                    cur = conn.cursor()
-                    cur.execute("SELECT 1 as test, current_timestamp() as timestamp")
-                    result = cur.fetchone()
-                    signal.alarm(0)  # Cancel timeout
-                    return {
-                        "status": "success",
-                        "message": "Databricks visualization engine ready!",
-                        "test_result": result[0],
-                        "timestamp": str(result[1]),
-                        "host": self.host
-                    }
-            except Exception as e:
-                signal.alarm(0)  # Cancel timeout
-                raise e
+            # The pool bounds connect and query time on a worker thread, so this
+            # works from request handlers and background threads alike
+            warehouse = get_warehouse(self.host, self.http_path, self.token)
+            with warehouse.connection() as conn:
+                result = _run_with_timeout(
+                    lambda: _fetch_one(conn, "SELECT 1 as test, current_timestamp() as timestamp"),
+                    warehouse.check_timeout
+                )
+                return {
+                    "status": "success",
+                    "message": "Databricks visualization engine ready!",
+                    "test_result": result[0],
+                    "timestamp": str(result[1]),
+                    "host": self.host,
+                    "warehouse": warehouse.metrics()
+                }
                 
         except Exception as e:
             return {
@@ -74,222 +91,170 @@ class DatabricksVisualizer:
                 "note": "Using mock data for demo - this is normal in development"
             }
     
-    def sync_sqlite_to_databricks(self) -> Dict[str, Any]:
-        """Sync SQLite data to Databricks for visualization"""
+    def sync_sqlite_to_databricks(self, batch_size: int = SYNC_BATCH_ROWS) -> Dict[str, Any]:
+        """
+        Incrementally sync SQLite to Databricks from the change_log high-water mark.
+
+        Changed rows are resolved to their statements and each statement is
+        re-shipped through dbxLoader.write_statements, the same writer the
+        outbox uses, so Databricks has one schema and every MERGE source holds
+        a single row per (statement_id, fingerprint). The watermark is
+        committed after every batch, so a failed sync resumes where it stopped.
+        A first sync, or one whose watermark was trimmed from the log, ships
+        every statement instead.
+        """
         try:
-            # Read data from SQLite
-            sqlite_conn = sqlite3.connect(SQLITE_DB)
-            sqlite_conn.row_factory = sqlite3.Row
-            
-            # Get all transactions
-            transactions_df = pd.read_sql_query("""
-                SELECT * FROM transactions 
-                ORDER BY transaction_date DESC
-            """, sqlite_conn)
-            
-            # Get all statements
-            statements_df = pd.read_sql_query("""
-                SELECT * FROM statements
-                ORDER BY inserted_at DESC
-            """, sqlite_conn)
-            
-            sqlite_conn.close()
-            
-            if len(transactions_df) == 0:
-                return {
-                    "status": "no_data",
-                    "message": "No data to sync - upload some statements first!",
-                    "synced_records": 0
-                }
-            
-            # Connect to Databricks and sync data
-            with sql.connect(
-                server_hostname=self.host,
-                http_path=self.http_path,
-                access_token=self.token
-            ) as conn:
-                cur = conn.cursor()
-                
-                # Create schema and tables if they don't exist
-                self._ensure_databricks_schema(cur)
-                
-                # Clear existing data for fresh sync
-                cur.execute(f"DELETE FROM `{self.schema}`.`transactions`")
-                cur.execute(f"DELETE FROM `{self.schema}`.`statements`")
-                
-                # Insert transactions
-                for _, row in transactions_df.iterrows():
-                    cur.execute(f"""
-                    INSERT INTO `{self.schema}`.`transactions` 
-                    (statement_id, ref_number, transaction_date, post_date, description, amount, location)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        row['statement_id'], row['ref_number'], row['transaction_date'],
-                        row['post_date'], row['description'], row['amount'], row['location']
-                    ))
-                
-                # Insert statements
-                for _, row in statements_df.iterrows():
-                    cur.execute(f"""
-                    INSERT INTO `{self.schema}`.`statements`
-                    (statement_id, user_id, bank_name, card_type, period_start, period_end,
-                     statement_date, account_number, ending_balance, minimum_payment, 
-                     payment_due_date, customer_name, raw_json, inserted_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        row['statement_id'], row['user_id'], row['bank_name'], row['card_type'],
-                        row['period_start'], row['period_end'], row['statement_date'],
-                        row['account_number'], row['ending_balance'], row['minimum_payment'],
-                        row['payment_due_date'], row['customer_name'], row['raw_json'], row['inserted_at']
-                    ))
-                
-                conn.commit()
-                
-                return {
-                    "status": "success",
-                    "message": "Data synced to Databricks successfully!",
-                    "synced_records": {
-                        "transactions": len(transactions_df),
-                        "statements": len(statements_df)
-                    },
-                    "databricks_ready": True
-                }
-                
+            sqlite_conn = sqlite_db.get_db_connection()
+            try:
+                cursor = sqlite_conn.cursor()
+                watermark, full = sqlite_db.change_log_watermark(cursor, SYNC_TARGET)
+                head = sqlite_db.change_log_head(cursor)
+                if not full and head <= watermark:
+                    return {
+                        "status": "up_to_date",
+                        "message": "Databricks already has every change",
+                        "synced_records": 0,
+                        "watermark": watermark
+                    }
+
+                synced = {"statements": 0, "transactions": 0, "deleted": 0}
+                warehouse = get_warehouse(self.host, self.http_path, self.token)
+                with warehouse.connection() as conn:
+                    cur = conn.cursor()
+                    warehouse.run_once("dbxLoader.schema", dbxLoader._ensure_schema, cur)
+
+                    if full:
+                        # Rows from the old full-refresh sync have no key to merge on
+                        cur.execute(f"DELETE FROM {dbxLoader._qname('transactions')} WHERE fingerprint IS NULL")
+                        cursor.execute("SELECT statement_id FROM statements ORDER BY rowid")
+                        self._ship_statements(cur, cursor, [row[0] for row in cursor.fetchall()], synced)
+                        watermark = head
+                        sqlite_db.save_watermark(cursor, SYNC_TARGET, watermark)
+                        sqlite_conn.commit()
+
+                    while True:
+                        cursor.execute(
+                            "SELECT seq, table_name, row_key, op FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                            (watermark, batch_size)
+                        )
+                        changes = cursor.fetchall()
+                        if not changes:
+                            break
+
+                        self._ship_statements(cur, cursor, sqlite_db.changed_statement_ids(cursor, changes), synced)
+                        watermark = changes[-1]["seq"]
+                        sqlite_db.save_watermark(cursor, SYNC_TARGET, watermark)
+                        sqlite_conn.commit()
+
+                    try:
+                        conn.commit()
+                    except Exception:
+                        pass
+                    cur.close()
+
+                sqlite_db.trim_change_log(cursor)
+                sqlite_conn.commit()
+            finally:
+                sqlite_conn.close()
+
+            self.invalidate_analytics_cache()
+            return {
+                "status": "success",
+                "message": "Changes synced to Databricks successfully!",
+                "synced_records": synced,
+                "watermark": watermark,
+                "databricks_ready": True
+            }
+
         except Exception as e:
             return {
                 "status": "error",
-                "message": f"Sync failed: {str(e)}",
+                "message": f"Sync failed: {str(e)} (will resume from last watermark)",
                 "synced_records": 0
             }
-    
-    def _ensure_databricks_schema(self, cursor):
-        """Create Databricks schema and tables for visualization"""
-        # Create schema
-        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS `{self.schema}`")
-        cursor.execute(f"USE `{self.schema}`")
-        
-        # Create transactions table optimized for analytics
-        cursor.execute(f"""
-        CREATE TABLE IF NOT EXISTS `{self.schema}`.`transactions` (
-            statement_id STRING,
-            ref_number STRING,
-            transaction_date DATE,
-            post_date DATE,
-            description STRING,
-            amount DECIMAL(18,2),
-            location STRING,
-            created_at TIMESTAMP DEFAULT current_timestamp()
-        ) USING DELTA
-        TBLPROPERTIES (
-            delta.autoOptimize.optimizeWrite = true,
-            delta.autoOptimize.autoCompact = true
-        )
-        """)
-        
-        # Create statements table
-        cursor.execute(f"""
-        CREATE TABLE IF NOT EXISTS `{self.schema}`.`statements` (
-            statement_id STRING PRIMARY KEY,
-            user_id STRING,
-            bank_name STRING,
-            card_type STRING,
-            period_start DATE,
-            period_end DATE,
-            statement_date DATE,
-            account_number STRING,
-            ending_balance DECIMAL(18,2),
-            minimum_payment DECIMAL(18,2),
-            payment_due_date DATE,
-            customer_name STRING,
-            raw_json STRING,
-            inserted_at TIMESTAMP
-        ) USING DELTA
-        """)
-    
-    def get_advanced_analytics(self) -> Dict[str, Any]:
-        """Get advanced analytics from Databricks for visualization"""
+
+    def _ship_statements(self, cur, sqlite_cursor, statement_ids: List[str], synced: Dict[str, int]) -> None:
+        """Write the stored JSON of these statements, SYNC_BATCH_STATEMENTS per MERGE"""
+        for start in range(0, len(statement_ids), SYNC_BATCH_STATEMENTS):
+            chunk = statement_ids[start:start + SYNC_BATCH_STATEMENTS]
+            sqlite_cursor.execute(
+                f"SELECT user_id, raw_json FROM statements WHERE statement_id IN ({', '.join('?' for _ in chunk)})",
+                chunk
+            )
+            items = [(json.loads(row["raw_json"]), row["user_id"]) for row in sqlite_cursor.fetchall()]
+            if not items:
+                continue
+            result = dbxLoader.write_statements(cur, items)
+            tx_changes = result["changes"].get("transactions", {})
+            synced["statements"] += len(result["statement_ids"])
+            synced["transactions"] += tx_changes.get("inserted", 0) + tx_changes.get("updated", 0)
+            synced["deleted"] += tx_changes.get("deleted", 0)
+
+    def _analytics_queries(self) -> Dict[str, str]:
+        """The advanced analytics queries, keyed by result name"""
+        return {
+            "spending_patterns": compile_metric("monthly_category_spending", DATABRICKS, self.schema),
+            "time_patterns": compile_metric("weekday_hour_spending", DATABRICKS, self.schema),
+            "location_analysis": compile_metric("top_locations", DATABRICKS, self.schema),
+        }
+
+    def _run_analytics_query(self, query: str) -> pa.Table:
+        """Run one query on its own pooled connection and fetch it as Arrow"""
+        with get_warehouse(self.host, self.http_path, self.token).connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(query)
+                return cur.fetchall_arrow()
+            finally:
+                cur.close()
+
+    def get_advanced_analytics(self, refresh: bool = False, as_arrow: bool = False) -> Dict[str, Any]:
+        """
+        Get advanced analytics from Databricks for visualization.
+
+        The queries run concurrently, so latency is that of the slowest one. The
+        combined result is cached for ANALYTICS_CACHE_TTL seconds and dropped
+        whenever a sync completes. Results stay Arrow tables until the caller
+        asks for JSON-ready records (as_arrow=False).
+        """
+        result = self._get_analytics_tables(refresh)
+        if as_arrow or result["status"] != "success":
+            return result
+        return {**result, "analytics": {name: arrow_to_records(table)
+                                        for name, table in result["analytics"].items()}}
+
+    def _get_analytics_tables(self, refresh: bool) -> Dict[str, Any]:
+        with self._analytics_lock:
+            cached = self._analytics_cache
+            if cached and not refresh and cached[0] > time.monotonic():
+                return {**cached[1], "cached": True}
+            generation = self._analytics_generation
+
         try:
-            with sql.connect(
-                server_hostname=self.host,
-                http_path=self.http_path,
-                access_token=self.token
-            ) as conn:
-                cur = conn.cursor()
-                
-                # Advanced spending patterns analysis
-                cur.execute(f"""
-                SELECT 
-                    DATE_FORMAT(transaction_date, 'yyyy-MM') as month,
-                    CASE 
-                        WHEN UPPER(description) LIKE '%PRESTO%' OR UPPER(description) LIKE '%METROLINX%' THEN 'Transportation'
-                        WHEN UPPER(description) LIKE '%SOBEYS%' OR UPPER(description) LIKE '%FOOD%' OR UPPER(description) LIKE '%WALMART%' THEN 'Groceries'
-                        WHEN UPPER(description) LIKE '%MCDONALD%' OR UPPER(description) LIKE '%RESTAURANT%' OR UPPER(description) LIKE '%UBER%' THEN 'Dining'
-                        WHEN UPPER(description) LIKE '%SPOTIFY%' OR UPPER(description) LIKE '%NETFLIX%' THEN 'Entertainment'
-                        ELSE 'Other'
-                    END as category,
-                    COUNT(*) as transaction_count,
-                    SUM(ABS(amount)) as total_amount,
-                    AVG(ABS(amount)) as avg_amount,
-                    MIN(ABS(amount)) as min_amount,
-                    MAX(ABS(amount)) as max_amount
-                FROM `{self.schema}`.`transactions`
-                WHERE amount < 0
-                GROUP BY 1, 2
-                ORDER BY month DESC, total_amount DESC
-                """)
-                spending_patterns = cur.fetchall()
-                
-                # Weekly spending trends
-                cur.execute(f"""
-                SELECT 
-                    DATE_FORMAT(transaction_date, 'EEEE') as day_of_week,
-                    HOUR(COALESCE(post_date, transaction_date)) as hour_of_day,
-                    COUNT(*) as transaction_count,
-                    SUM(ABS(amount)) as total_spent
-                FROM `{self.schema}`.`transactions`
-                WHERE amount < 0
-                GROUP BY 1, 2
-                ORDER BY 
-                    CASE day_of_week 
-                        WHEN 'Monday' THEN 1 WHEN 'Tuesday' THEN 2 WHEN 'Wednesday' THEN 3 
-                        WHEN 'Thursday' THEN 4 WHEN 'Friday' THEN 5 WHEN 'Saturday' THEN 6 
-                        WHEN 'Sunday' THEN 7 
-                    END,
-                    hour_of_day
-                """)
-                time_patterns = cur.fetchall()
-                
-                # Location-based spending
-                cur.execute(f"""
-                SELECT 
-                    COALESCE(location, 'Unknown') as location,
-                    COUNT(*) as visits,
-                    SUM(ABS(amount)) as total_spent,
-                    AVG(ABS(amount)) as avg_per_visit
-                FROM `{self.schema}`.`transactions`
-                WHERE amount < 0 AND location IS NOT NULL
-                GROUP BY location
-                ORDER BY total_spent DESC
-                LIMIT 10
-                """)
-                location_analysis = cur.fetchall()
-                
-                return {
-                    "status": "success",
-                    "analytics": {
-                        "spending_patterns": [dict(zip([col[0] for col in cur.description], row)) for row in spending_patterns],
-                        "time_patterns": [dict(zip([col[0] for col in cur.description], row)) for row in time_patterns],
-                        "location_analysis": [dict(zip([col[0] for col in cur.description], row)) for row in location_analysis]
-                    },
-                    "powered_by": "Databricks Analytics Engine"
-                }
-                
+            futures = {name: _analytics_executor.submit(self._run_analytics_query, query)
+                       for name, query in self._analytics_queries().items()}
+            result = {
+                "status": "success",
+                "analytics": {name: future.result() for name, future in futures.items()},
+                "powered_by": "Databricks Analytics Engine"
+            }
         except Exception as e:
             return {
                 "status": "error",
                 "message": f"Analytics failed: {str(e)}",
                 "analytics": {}
             }
+
+        with self._analytics_lock:
+            # A sync that finished while we were querying makes this result stale
+            if generation == self._analytics_generation:
+                self._analytics_cache = (time.monotonic() + ANALYTICS_CACHE_TTL, result)
+        return {**result, "cached": False}
+
+    def invalidate_analytics_cache(self) -> None:
+        with self._analytics_lock:
+            self._analytics_cache = None
+            self._analytics_generation += 1
     
     def generate_databricks_dashboard_url(self) -> str:
         """Generate URL for Databricks dashboard (for demo purposes)"""
@@ -297,73 +262,18 @@ class DatabricksVisualizer:
     
     def get_demo_queries(self) -> List[Dict[str, str]]:
         """Get demo SQL queries to showcase Databricks capabilities"""
+        demos = [
+            ("running_spend", "Complex aggregations with window functions"),
+            ("category_percentiles", "Statistical analysis with percentiles"),
+            ("weekly_features", "Prepare data for ML forecasting models"),
+        ]
         return [
             {
-                "title": "💰 Advanced Spending Analysis",
-                "description": "Complex aggregations with window functions",
-                "query": f"""
-                SELECT 
-                    transaction_date,
-                    description,
-                    amount,
-                    SUM(ABS(amount)) OVER (
-                        ORDER BY transaction_date 
-                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
-                    ) as running_total,
-                    LAG(ABS(amount), 1) OVER (ORDER BY transaction_date) as prev_amount,
-                    CASE 
-                        WHEN ABS(amount) > AVG(ABS(amount)) OVER () THEN 'Above Average'
-                        ELSE 'Below Average'
-                    END as spending_category
-                FROM `{self.schema}`.`transactions`
-                WHERE amount < 0
-                ORDER BY transaction_date DESC
-                """
-            },
-            {
-                "title": "📊 Category Performance with ML Insights",
-                "description": "Statistical analysis with percentiles",
-                "query": f"""
-                SELECT 
-                    category,
-                    COUNT(*) as transactions,
-                    SUM(total_amount) as total_spent,
-                    PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY total_amount) as median_spend,
-                    PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY total_amount) as p95_spend,
-                    STDDEV(total_amount) as spending_volatility
-                FROM (
-                    SELECT 
-                        CASE 
-                            WHEN UPPER(description) LIKE '%PRESTO%' THEN 'Transportation'
-                            WHEN UPPER(description) LIKE '%SOBEYS%' THEN 'Groceries'
-                            WHEN UPPER(description) LIKE '%MCDONALD%' THEN 'Dining'
-                            ELSE 'Other'
-                        END as category,
-                        ABS(amount) as total_amount
-                    FROM `{self.schema}`.`transactions`
-                    WHERE amount < 0
-                ) t
-                GROUP BY category
-                ORDER BY total_spent DESC
-                """
-            },
-            {
-                "title": "🕒 Time Series Forecasting Data",
-                "description": "Prepare data for ML forecasting models",
-                "query": f"""
-                SELECT 
-                    DATE_TRUNC('week', transaction_date) as week_start,
-                    COUNT(*) as weekly_transactions,
-                    SUM(ABS(amount)) as weekly_spending,
-                    AVG(ABS(amount)) as avg_transaction_size,
-                    COUNT(DISTINCT DATE(transaction_date)) as active_days,
-                    SUM(ABS(amount)) / COUNT(DISTINCT DATE(transaction_date)) as daily_avg_spending
-                FROM `{self.schema}`.`transactions`
-                WHERE amount < 0
-                GROUP BY DATE_TRUNC('week', transaction_date)
-                ORDER BY week_start
-                """
+                "title": METRICS[name].title,
+                "description": description,
+                "query": compile_metric(name, DATABRICKS, self.schema)
             }
+            for name, description in demos
         ]
 
 # Global instance
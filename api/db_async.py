@@ -0,0 +1,75 @@
+"""
+Async SQLite access layer
+Exposes the sqlite_db functions as coroutines that run on a dedicated, sized
+thread pool, so `async def` endpoints never block the event loop on a query.
+sqlite3 releases the GIL while a statement executes, and every call opens its
+own connection, so queries from different requests genuinely overlap.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import sqlite_db
+import subscriptions
+
+# Sized for SQLite: WAL allows many concurrent readers but a single writer
+DB_THREADS = int(os.getenv("DB_THREADS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="sqlite")
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking database function on the DB thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def shutdown() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+async def init_database() -> None:
+    await run_db(sqlite_db.init_database)
+
+async def upload_statement_to_sqlite(statement: Dict[str, Any], user_id: str) -> str:
+    return await run_db(sqlite_db.upload_statement_to_sqlite, statement, user_id)
+
+async def ingest_statement(statement: Dict[str, Any], user_id: str,
+                           outbox_kinds: Iterable[str] = ()) -> Dict[str, Any]:
+    return await run_db(sqlite_db.ingest_statement, statement, user_id, outbox_kinds)
+
+async def get_dashboard_data(user_id: Optional[str] = None, start: Optional[str] = None,
+                             end: Optional[str] = None) -> Dict[str, Any]:
+    return await run_db(sqlite_db.get_dashboard_data, user_id, start, end)
+
+async def get_alerts(user_id: Optional[str] = None, scope: Optional[str] = None,
+                     limit: int = 50, before_id: Optional[int] = None) -> Dict[str, Any]:
+    return await run_db(sqlite_db.get_alerts, user_id, scope, limit, before_id)
+
+async def get_category_performance(user_ids: Optional[List[str]] = None,
+                                   categories: Optional[List[str]] = None) -> Dict[str, Any]:
+    return await run_db(sqlite_db.get_category_performance, user_ids, categories)
+
+async def get_subscriptions(user_id: Optional[str] = None) -> Dict[str, Any]:
+    return await run_db(subscriptions.get_subscriptions, user_id)
+
+async def get_trends(user_id: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                     granularity: str = "month") -> Dict[str, Any]:
+    return await run_db(sqlite_db.get_trends, user_id, start, end, granularity)
+
+async def get_all_transactions() -> Dict[str, Any]:
+    return await run_db(sqlite_db.get_all_transactions)
+
+async def search_transactions(query: str, start: Optional[str] = None, end: Optional[str] = None,
+                              min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                              limit: int = 25, offset: int = 0) -> Dict[str, Any]:
+    return await run_db(sqlite_db.search_transactions, query, start, end,
+                        min_amount, max_amount, limit, offset)
+
+async def get_duplicate_report(user_id: Optional[str] = None) -> Dict[str, Any]:
+    return await run_db(sqlite_db.get_duplicate_report, user_id)
+
+async def rebuild_dedup_index() -> Dict[str, int]:
+    result = await run_db(sqlite_db.rebuild_dedup_index)
+    import analytics_engine
+    analytics_engine.invalidate()  # duplicate markers changed without a statement ingest
+    return result
@@ -1,9 +1,10 @@
 # dbx_loader.py
-from databricks import sql
 from decimal import Decimal, ROUND_HALF_UP
 import hashlib, json, os
-from typing import Any, Dict, Iterable, Tuple, Optional
+from typing import Any, Dict, Iterable, List, Tuple, Optional
 from dotenv import load_dotenv
+from warehouse import get_warehouse
+from sqlite_db import duplicate_markers, transaction_fingerprints, promotion_fingerprints, disclosure_fingerprints
 
 load_dotenv()
 
@@ -77,18 +78,21 @@ def _ensure_schema(cur) -> None:
     cur.execute(f"""
     CREATE TABLE IF NOT EXISTS {_qname("transactions")} (
       statement_id STRING,
+      fingerprint STRING,
       ref_number STRING,
       transaction_date DATE,
       post_date DATE,
       description STRING,
       amount DECIMAL(18,2),
-      location STRING
+      location STRING,
+      duplicate_of STRING
     ) USING DELTA
     """)
 
     cur.execute(f"""
     CREATE TABLE IF NOT EXISTS {_qname("promotions")} (
       statement_id STRING,
+      fingerprint STRING,
       description STRING,
       rate STRING,
       ending_balance DECIMAL(18,2),
@@ -99,26 +103,53 @@ def _ensure_schema(cur) -> None:
     cur.execute(f"""
     CREATE TABLE IF NOT EXISTS {_qname("disclosures")} (
       statement_id STRING,
+      fingerprint STRING,
       disclosure STRING
     ) USING DELTA
     """)
 
-def _build_tx_rows(stmt_id: str, txs: Iterable[Dict[str, Any]]) -> Iterable[Tuple]:
-    for t in txs or []:
+    # Tables created before fingerprints existed need the column added
+    for table in ("transactions", "promotions", "disclosures"):
+        try:
+            cur.execute(f"ALTER TABLE {_qname(table)} ADD COLUMNS (fingerprint STRING)")
+        except Exception:
+            pass  # column already exists
+    # Canonical row (statement_id|fingerprint) of purchases repeated by an overlapping statement
+    try:
+        cur.execute(f"ALTER TABLE {_qname('transactions')} ADD COLUMNS (duplicate_of STRING)")
+    except Exception:
+        pass  # column already exists
+
+    # statements tables created by the old visualization sync have only some columns
+    cur.execute(f"SELECT * FROM {_qname('statements')} LIMIT 0")
+    existing = {col[0].lower() for col in cur.description}
+    for column, decl in STATEMENT_COLUMN_TYPES.items():
+        if column not in existing:
+            cur.execute(f"ALTER TABLE {_qname('statements')} ADD COLUMNS ({column} {decl})")
+
+def _build_tx_rows(stmt_id: str, txs: Iterable[Dict[str, Any]],
+                   duplicates: Optional[Dict[str, str]] = None) -> Iterable[Tuple]:
+    txs = list(txs or [])
+    duplicates = duplicates or {}
+    for fp, t in zip(transaction_fingerprints(txs), txs):
         yield (
             stmt_id,
+            fp,
             t.get("ref_number"),
             t.get("transaction_date"),
             t.get("post_date"),
             t.get("description"),
             _dec(t.get("amount")),
             t.get("location"),
+            duplicates.get(fp),
         )
 
 def _build_promo_rows(stmt_id: str, promos: Iterable[Dict[str, Any]]) -> Iterable[Tuple]:
-    for p in promos or []:
+    promos = list(promos or [])
+    for fp, p in zip(promotion_fingerprints(promos), promos):
         yield (
             stmt_id,
+            fp,
             p.get("description"),
             p.get("rate"),
             _dec(p.get("ending_balance")),
@@ -126,27 +157,93 @@ def _build_promo_rows(stmt_id: str, promos: Iterable[Dict[str, Any]]) -> Iterabl
         )
 
 def _build_disclosure_rows(stmt_id: str, disclosures: Iterable[str]) -> Iterable[Tuple]:
-    for d in disclosures or []:
-        yield (stmt_id, d)
+    disclosures = list(disclosures or [])
+    for fp, d in zip(disclosure_fingerprints(disclosures), disclosures):
+        yield (stmt_id, fp, d)
 
-def upload_statement_to_databricks(statement: Dict[str, Any], user_id: str,
-                                   server_hostname: str = HOST,
-                                   http_path: str = HTTP_PATH,
-                                   access_token: str = TOKEN) -> str:
+def _merge_child_rows(cur, table: str, statement_ids: List[str], columns: List[str],
+                      casts: Dict[str, str], rows: List[Tuple]) -> Dict[str, int]:
     """
-    Ingest one credit-card statement JSON + user_id into Databricks SQL Warehouse.
-    Returns the deterministic statement_id.
+    Diff-based upsert of child rows keyed on (statement_id, fingerprint), for any
+    number of statements in one MERGE. Only new rows are inserted, rows whose
+    non-key columns changed are updated, and rows of these statements no longer
+    present are deleted - unchanged rows are not rewritten.
     """
-    statement_id = _mk_statement_id(statement, user_id)
+    if not rows:
+        # Every statement in the batch is now empty: nothing to merge, only rows to drop
+        cur.execute(
+            f"DELETE FROM {_qname(table)} WHERE statement_id IN ({', '.join('?' for _ in statement_ids)})",
+            tuple(statement_ids)
+        )
+        result = cur.fetchone() if cur.description else None
+        return {"inserted": 0, "updated": 0, "deleted": int(result[0]) if result else 0}
+
+    value_cols = [c for c in columns if c not in ("statement_id", "fingerprint")]
+    row_sql = "(" + ", ".join(
+        f"CAST(? AS {casts[c]})" if c in casts else "?" for c in columns
+    ) + ")"
+    changed = " OR ".join(f"NOT (t.{c} <=> s.{c})" for c in value_cols)
+
+    cur.execute(f"""
+    MERGE INTO {_qname(table)} AS t
+    USING (
+      SELECT * FROM VALUES {", ".join(row_sql for _ in rows)} AS s({", ".join(columns)})
+    ) s
+    ON t.statement_id = s.statement_id AND t.fingerprint = s.fingerprint
+    WHEN MATCHED AND ({changed}) THEN UPDATE SET {", ".join(f"{c} = s.{c}" for c in value_cols)}
+    WHEN NOT MATCHED THEN INSERT ({", ".join(columns)}) VALUES ({", ".join(f"s.{c}" for c in columns)})
+    WHEN NOT MATCHED BY SOURCE AND t.statement_id IN ({", ".join("?" for _ in statement_ids)}) THEN DELETE
+    """, tuple(v for r in rows for v in r) + tuple(statement_ids))
+
+    # Delta returns one row: num_affected_rows, num_updated_rows, num_deleted_rows, num_inserted_rows
+    counts = {"inserted": 0, "updated": 0, "deleted": 0}
+    try:
+        result = cur.fetchone()
+        if result is not None:
+            metrics = dict(zip([col[0] for col in cur.description], result))
+            counts = {
+                "inserted": int(metrics.get("num_inserted_rows") or 0),
+                "updated": int(metrics.get("num_updated_rows") or 0),
+                "deleted": int(metrics.get("num_deleted_rows") or 0),
+            }
+    except Exception:
+        pass
+    return counts
+
+STATEMENT_COLUMNS = [
+    "statement_id", "user_id", "bank_name", "card_type", "period_start", "period_end",
+    "statement_date", "account_number", "page_current", "page_total",
+    "subtotal_credits", "subtotal_debits", "interest_charges", "cash_advances",
+    "purchases", "ending_balance", "minimum_payment", "payment_due_date",
+    "customer_name", "customer_address", "customer_email", "contact_support_json", "raw_json",
+]
+
+STATEMENT_COLUMN_TYPES = {
+    "page_current": "INT", "page_total": "INT",
+    "subtotal_credits": "DECIMAL(18,2)", "subtotal_debits": "DECIMAL(18,2)",
+    "interest_charges": "DECIMAL(18,2)", "cash_advances": "DECIMAL(18,2)",
+    "purchases": "DECIMAL(18,2)", "customer_address": "STRING",
+    "customer_email": "STRING", "contact_support_json": "STRING",
+}
+
+STATEMENT_CASTS = {
+    "page_current": "INT", "page_total": "INT",
+    "subtotal_credits": "DECIMAL(18,2)", "subtotal_debits": "DECIMAL(18,2)",
+    "interest_charges": "DECIMAL(18,2)", "cash_advances": "DECIMAL(18,2)",
+    "purchases": "DECIMAL(18,2)", "ending_balance": "DECIMAL(18,2)",
+    "minimum_payment": "DECIMAL(18,2)",
+}
+
+def _build_statement_row(statement: Dict[str, Any], user_id: str) -> Tuple:
+    """Flatten the statement JSON into a tuple ordered like STATEMENT_COLUMNS"""
     md = statement.get("statement_metadata", {}) or {}
     cust = statement.get("customer_info", {}) or {}
     totals = statement.get("totals", {}) or {}
     contact_support_json = json.dumps(statement.get("contact_support_info") or statement.get("contact_info") or {}, ensure_ascii=False)
     raw_json = json.dumps(statement, ensure_ascii=False)
 
-    # Flatten main columns
     row = {
-        "statement_id": statement_id,
+        "statement_id": _mk_statement_id(statement, user_id),
         "user_id": user_id,
         "bank_name": md.get("bank_name"),
         "card_type": md.get("card_type"),
@@ -170,102 +267,91 @@ def upload_statement_to_databricks(statement: Dict[str, Any], user_id: str,
         "contact_support_json": contact_support_json,
         "raw_json": raw_json,
     }
+    return tuple(row[c] for c in STATEMENT_COLUMNS)
 
-    with sql.connect(server_hostname=server_hostname, http_path=http_path, access_token=access_token) as conn:
+def _merge_statements(cur, rows: List[Tuple]) -> None:
+    """Upsert statements rows (MERGE for idempotency), many statements per statement"""
+    row_sql = "(" + ", ".join(
+        f"CAST(? AS {STATEMENT_CASTS[c]})" if c in STATEMENT_CASTS else "?" for c in STATEMENT_COLUMNS
+    ) + ")"
+    cur.execute(f"""
+    MERGE INTO {_qname("statements")} AS t
+    USING (
+      SELECT *, current_timestamp() AS inserted_at FROM VALUES {", ".join(row_sql for _ in rows)}
+        AS v({", ".join(STATEMENT_COLUMNS)})
+    ) s
+    ON t.statement_id = s.statement_id
+    WHEN MATCHED THEN UPDATE SET
+      {", ".join(f"{c} = s.{c}" for c in STATEMENT_COLUMNS[1:])},
+      inserted_at = s.inserted_at
+    WHEN NOT MATCHED THEN INSERT *
+    """, tuple(v for r in rows for v in r))
+
+def write_statements(cur, items: List[Tuple[Dict[str, Any], str]],
+                     duplicates: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, Any]:
+    """
+    Write a batch of (statement, user_id) pairs with one MERGE per table, so
+    shipping N statements costs four warehouse round trips instead of 4N.
+    If the same statement appears more than once, the last copy wins.
+    Transactions carry SQLite's duplicate markers (sqlite_db.duplicate_markers,
+    read when not given), so both stores count overlapping statements once.
+    """
+    latest: Dict[str, Tuple[Dict[str, Any], str]] = {}
+    for statement, user_id in items:
+        latest[_mk_statement_id(statement, user_id)] = (statement, user_id)
+
+    _merge_statements(cur, [_build_statement_row(stmt, uid) for stmt, uid in latest.values()])
+
+    # Child tables: diff against stored rows by fingerprint. A statement whose
+    # list is now empty still takes part, so its stored rows are deleted.
+    statement_ids = list(latest)
+    if duplicates is None:
+        duplicates = duplicate_markers(statement_ids)
+    tx_rows, promo_rows, disc_rows = [], [], []
+    for statement_id, (statement, _) in latest.items():
+        tx_rows += _build_tx_rows(statement_id, statement.get("transactions"), duplicates.get(statement_id))
+        promo_rows += _build_promo_rows(statement_id, statement.get("promotions"))
+        disc_rows += _build_disclosure_rows(statement_id, statement.get("disclosures"))
+
+    changes = {
+        "transactions": _merge_child_rows(
+            cur, "transactions", statement_ids,
+            ["statement_id", "fingerprint", "ref_number", "transaction_date", "post_date",
+             "description", "amount", "location", "duplicate_of"],
+            {"transaction_date": "DATE", "post_date": "DATE", "amount": "DECIMAL(18,2)"},
+            tx_rows
+        ),
+        "promotions": _merge_child_rows(
+            cur, "promotions", statement_ids,
+            ["statement_id", "fingerprint", "description", "rate", "ending_balance", "expiry"],
+            {"ending_balance": "DECIMAL(18,2)"},
+            promo_rows
+        ),
+        "disclosures": _merge_child_rows(
+            cur, "disclosures", statement_ids,
+            ["statement_id", "fingerprint", "disclosure"], {}, disc_rows
+        ),
+    }
+
+    # Optional: curate files with OPTIMIZE/ZORDER for better read perf on statement_id/date
+    # cur.execute(f"OPTIMIZE {_qname('transactions')} ZORDER BY (statement_id, transaction_date)")
+
+    return {"statement_ids": list(latest), "changes": changes}
+
+def upload_statement_to_databricks(statement: Dict[str, Any], user_id: str,
+                                   server_hostname: str = HOST,
+                                   http_path: str = HTTP_PATH,
+                                   access_token: str = TOKEN) -> str:
+    """
+    Ingest one credit-card statement JSON + user_id into Databricks SQL Warehouse.
+    Returns the deterministic statement_id.
+    """
+    warehouse = get_warehouse(server_hostname, http_path, access_token)
+    with warehouse.connection() as conn:
         cur = conn.cursor()
-        _ensure_schema(cur)
-
-        # Upsert the statements row (MERGE for idempotency)
-        merge_sql = f"""
-        MERGE INTO {_qname("statements")} AS t
-        USING (
-          SELECT
-            ? AS statement_id, ? AS user_id, ? AS bank_name, ? AS card_type,
-            ? AS period_start, ? AS period_end, ? AS statement_date, ? AS account_number,
-            CAST(? AS INT) AS page_current, CAST(? AS INT) AS page_total,
-            CAST(? AS DECIMAL(18,2)) AS subtotal_credits,
-            CAST(? AS DECIMAL(18,2)) AS subtotal_debits,
-            CAST(? AS DECIMAL(18,2)) AS interest_charges,
-            CAST(? AS DECIMAL(18,2)) AS cash_advances,
-            CAST(? AS DECIMAL(18,2)) AS purchases,
-            CAST(? AS DECIMAL(18,2)) AS ending_balance,
-            CAST(? AS DECIMAL(18,2)) AS minimum_payment,
-            ? AS payment_due_date,
-            ? AS customer_name, ? AS customer_address, ? AS customer_email,
-            ? AS contact_support_json,
-            ? AS raw_json,
-            current_timestamp() AS inserted_at
-        ) s
-        ON t.statement_id = s.statement_id
-        WHEN MATCHED THEN UPDATE SET
-          user_id = s.user_id,
-          bank_name = s.bank_name,
-          card_type = s.card_type,
-          period_start = s.period_start,
-          period_end = s.period_end,
-          statement_date = s.statement_date,
-          account_number = s.account_number,
-          page_current = s.page_current,
-          page_total = s.page_total,
-          subtotal_credits = s.subtotal_credits,
-          subtotal_debits  = s.subtotal_debits,
-          interest_charges = s.interest_charges,
-          cash_advances    = s.cash_advances,
-          purchases        = s.purchases,
-          ending_balance   = s.ending_balance,
-          minimum_payment  = s.minimum_payment,
-          payment_due_date = s.payment_due_date,
-          customer_name    = s.customer_name,
-          customer_address = s.customer_address,
-          customer_email   = s.customer_email,
-          contact_support_json = s.contact_support_json,
-          raw_json = s.raw_json,
-          inserted_at = s.inserted_at
-        WHEN NOT MATCHED THEN INSERT *
-        """
-        cur.execute(merge_sql, (
-            row["statement_id"], row["user_id"], row["bank_name"], row["card_type"],
-            row["period_start"], row["period_end"], row["statement_date"], row["account_number"],
-            row["page_current"], row["page_total"],
-            row["subtotal_credits"], row["subtotal_debits"], row["interest_charges"],
-            row["cash_advances"], row["purchases"], row["ending_balance"],
-            row["minimum_payment"], row["payment_due_date"],
-            row["customer_name"], row["customer_address"], row["customer_email"],
-            row["contact_support_json"], row["raw_json"]
-        ))
-
-        # Child tables: replace existing rows for this statement_id for simplicity + speed
-        tx_rows = list(_build_tx_rows(statement_id, statement.get("transactions")))
-        promo_rows = list(_build_promo_rows(statement_id, statement.get("promotions")))
-        disc_rows = list(_build_disclosure_rows(statement_id, statement.get("disclosures")))
-
-        if tx_rows:
-            cur.execute(f"DELETE FROM {_qname('transactions')} WHERE statement_id = ?", (statement_id,))
-            cur.executemany(
-                f"INSERT INTO {_qname('transactions')} "
-                "(statement_id, ref_number, transaction_date, post_date, description, amount, location) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?)",
-                tx_rows
-            )
-
-        if promo_rows:
-            cur.execute(f"DELETE FROM {_qname('promotions')} WHERE statement_id = ?", (statement_id,))
-            cur.executemany(
-                f"INSERT INTO {_qname('promotions')} "
-                "(statement_id, description, rate, ending_balance, expiry) "
-                "VALUES (?, ?, ?, ?, ?)",
-                promo_rows
-            )
-
-        if disc_rows:
-            cur.execute(f"DELETE FROM {_qname('disclosures')} WHERE statement_id = ?", (statement_id,))
-            cur.executemany(
-                f"INSERT INTO {_qname('disclosures')} (statement_id, disclosure) VALUES (?, ?)",
-                disc_rows
-            )
-
-        # Optional: curate files with OPTIMIZE/ZORDER for better read perf on statement_id/date
-        # cur.execute(f"OPTIMIZE {_qname('transactions')} ZORDER BY (statement_id, transaction_date)")
+        warehouse.run_once("dbxLoader.schema", _ensure_schema, cur)
+        result = write_statements(cur, [(statement, user_id)])
+        print(f"✅ Databricks child rows merged for {result['statement_ids'][0]}: {result['changes']}")
 
         # Autocommit is on, but calling commit() is harmless
         try:
@@ -275,4 +361,4 @@ def upload_statement_to_databricks(statement: Dict[str, Any], user_id: str,
 
         cur.close()
 
-    return statement_id
+    return result["statement_ids"][0]
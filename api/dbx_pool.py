@@ -0,0 +1,309 @@
+"""
+Pooled Databricks SQL connections
+Every warehouse caller used to open its own sql.connect(), paying TLS and
+session setup on each call. ConnectionPool keeps up to max_size sessions
+alive, evicts ones idle past idle_timeout, and checks liveness with a
+`SELECT 1` bounded by a thread-based timeout (signal.SIGALRM only works on
+the main thread, which request handlers and background workers are not).
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABRICKS_HOST = os.getenv("DATABRICKS_HOST", "dbc-4583e2a1-3d51.cloud.databricks.com")
+DATABRICKS_HTTP_PATH = os.getenv("DATABRICKS_HTTP_PATH", "/sql/1.0/warehouses/24e8ffcb0690a53c")
+DATABRICKS_TOKEN = os.getenv("DATABRICKS_TOKEN", "REPLACE_ME")
+
+POOL_MAX_SIZE = int(os.getenv("DATABRICKS_POOL_SIZE", "4"))
+POOL_IDLE_TIMEOUT = float(os.getenv("DATABRICKS_POOL_IDLE_TIMEOUT", "300"))
+POOL_CHECK_AFTER = float(os.getenv("DATABRICKS_POOL_CHECK_AFTER", "30"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("DATABRICKS_POOL_ACQUIRE_TIMEOUT", "30"))
+POOL_CONNECT_TIMEOUT = float(os.getenv("DATABRICKS_POOL_CONNECT_TIMEOUT", "20"))
+POOL_CHECK_TIMEOUT = float(os.getenv("DATABRICKS_POOL_CHECK_TIMEOUT", "5"))
+# Pings that overran their timeout but are still running; past this many,
+# suspect connections are replaced without pinging so connects keep a worker
+POOL_MAX_HUNG_PINGS = int(os.getenv("DATABRICKS_POOL_MAX_HUNG_PINGS", "2"))
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be acquired or opened in time."""
+
+# Connects and liveness checks run here so they can be abandoned after a timeout
+_io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="dbx-pool-io")
+
+# Pings abandoned after their timeout that have not returned yet
+_hung_pings = 0
+_hung_lock = threading.Lock()
+
+def _ping_returned(_future) -> None:
+    global _hung_pings
+    with _hung_lock:
+        _hung_pings -= 1
+
+def run_with_timeout(fn: Callable[[], Any], timeout: float) -> Any:
+    """Run fn on a pool I/O thread and raise PoolTimeout if it overruns"""
+    future = _io_executor.submit(fn)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()  # only succeeds if it never started
+        raise PoolTimeout(f"Databricks call timed out after {timeout:.0f}s")
+
+def _percentiles(samples: Deque[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+class ConnectionPool:
+    """Bounded pool of DB-API connections with idle eviction and liveness checks"""
+
+    def __init__(self, connect: Callable[[], Any], max_size: int = POOL_MAX_SIZE,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT, check_after: float = POOL_CHECK_AFTER,
+                 acquire_timeout: float = POOL_ACQUIRE_TIMEOUT,
+                 connect_timeout: float = POOL_CONNECT_TIMEOUT,
+                 check_timeout: float = POOL_CHECK_TIMEOUT):
+        self._connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.acquire_timeout = acquire_timeout
+        self.connect_timeout = connect_timeout
+        self.check_timeout = check_timeout
+
+        self._lock = threading.Condition()
+        self._idle: List[Tuple[Any, float, bool]] = []  # (conn, released_at, suspect)
+        self._size = 0
+        self._once_done: Dict[str, bool] = {}
+        self._once_lock = threading.Lock()
+
+        self._wait_samples: Deque[float] = deque(maxlen=1000)
+        self._connect_samples: Deque[float] = deque(maxlen=1000)
+        self._counters = {"created": 0, "reused": 0, "evicted_idle": 0,
+                          "failed_checks": 0, "connect_errors": 0, "timeouts": 0}
+
+    # --------------------------
+    # Acquire / release
+    # --------------------------
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        conn = self._acquire()
+        failed = False
+        try:
+            yield conn
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._release(conn, suspect=failed)
+
+    def _acquire(self) -> Any:
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        while True:
+            conn, suspect, create = None, False, False
+            with self._lock:
+                self._evict_idle_locked()
+                if self._idle:
+                    conn, released_at, suspect = self._idle.pop()  # LIFO keeps hot sessions hot
+                    suspect = suspect or (time.monotonic() - released_at) > self.check_after
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeout(f"No Databricks connection free within {self.acquire_timeout:.0f}s")
+                    self._lock.wait(remaining)
+                    continue
+
+            if create:
+                self._record("wait", time.monotonic() - start)
+                return self._open()
+
+            if suspect and not self._check(conn):
+                continue
+
+            self._count("reused")
+            self._record("wait", time.monotonic() - start)
+            return conn
+
+    def _release(self, conn: Any, suspect: bool = False) -> None:
+        with self._lock:
+            self._idle.append((conn, time.monotonic(), suspect))
+            self._lock.notify()
+
+    def _open(self) -> Any:
+        start = time.monotonic()
+        future = _io_executor.submit(self._connect)
+        try:
+            conn = future.result(timeout=self.connect_timeout)
+        except FutureTimeout:
+            # Close the session if the connect eventually succeeds
+            future.add_done_callback(lambda f: f.exception() is None and _close_quietly(f.result()))
+            self._count("connect_errors")
+            self._release_slot()
+            raise PoolTimeout(f"Databricks connect timed out after {self.connect_timeout:.0f}s")
+        except Exception:
+            self._count("connect_errors")
+            self._release_slot()
+            raise
+        self._record("connect", time.monotonic() - start)
+        self._count("created")
+        return conn
+
+    def _check(self, conn: Any) -> bool:
+        """
+        Ping a connection that is out of the idle list. A dead one gives up its
+        slot; one whose ping overran is closed only once the ping returns, so
+        it is never handed out (or closed) while the ping still uses it.
+        """
+        def ping():
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+                cur.fetchall()
+            finally:
+                cur.close()
+
+        global _hung_pings
+        with _hung_lock:
+            too_many_hung = _hung_pings >= POOL_MAX_HUNG_PINGS
+        if too_many_hung:
+            # Earlier pings still hold I/O workers; don't queue another behind them
+            self._count("failed_checks")
+            self._discard(conn)
+            return False
+        future = _io_executor.submit(ping)
+        try:
+            future.result(timeout=self.check_timeout)
+            return True
+        except FutureTimeout:
+            if future.cancel():
+                _close_quietly(conn)
+            else:
+                with _hung_lock:
+                    _hung_pings += 1
+                future.add_done_callback(_ping_returned)
+                future.add_done_callback(lambda f: _close_quietly(conn))
+            self._count("failed_checks")
+            self._release_slot()
+            return False
+        except Exception:
+            self._count("failed_checks")
+            self._discard(conn)
+            return False
+
+    def _discard(self, conn: Any) -> None:
+        _close_quietly(conn)
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _record(self, sample: str, seconds: float) -> None:
+        with self._lock:
+            (self._wait_samples if sample == "wait" else self._connect_samples).append(seconds)
+
+    def _evict_idle_locked(self) -> None:
+        now = time.monotonic()
+        keep = []
+        for conn, released_at, suspect in self._idle:
+            if now - released_at > self.idle_timeout:
+                _close_quietly(conn)
+                self._size -= 1
+                self._counters["evicted_idle"] += 1
+            else:
+                keep.append((conn, released_at, suspect))
+        self._idle = keep
+
+    # --------------------------
+    # Helpers
+    # --------------------------
+    def run_once(self, key: str, fn: Callable[..., Any], *args) -> None:
+        """Run setup such as schema DDL once per process for this pool"""
+        if self._once_done.get(key):
+            return
+        with self._once_lock:
+            if not self._once_done.get(key):
+                fn(*args)
+                self._once_done[key] = True
+
+    def check(self) -> bool:
+        """Acquire a connection and verify it answers SELECT 1"""
+        conn = self._acquire()
+        if not self._check(conn):
+            return False
+        self._release(conn)
+        return True
+
+    def close_all(self) -> None:
+        with self._lock:
+            for conn, _, _ in self._idle:
+                _close_quietly(conn)
+                self._size -= 1
+            self._idle = []
+            self._lock.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            idle = len(self._idle)
+            size = self._size
+            counters = dict(self._counters)
+            wait = deque(self._wait_samples)
+            connect = deque(self._connect_samples)
+        return {
+            "max_size": self.max_size,
+            "open": size,
+            "idle": idle,
+            "in_use": size - idle,
+            **counters,
+            "wait": _percentiles(wait),
+            "connect": _percentiles(connect),
+        }
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+_pools: Dict[Tuple[str, str, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(server_hostname: str = DATABRICKS_HOST, http_path: str = DATABRICKS_HTTP_PATH,
+             access_token: str = DATABRICKS_TOKEN) -> ConnectionPool:
+    """Process-wide pool per warehouse endpoint"""
+    key = (server_hostname, http_path, access_token)
+    with _pools_lock:
+        if key not in _pools:
+            from databricks import sql
+            _pools[key] = ConnectionPool(
+                lambda: sql.connect(server_hostname=server_hostname, http_path=http_path,
+                                    access_token=access_token)
+            )
+        return _pools[key]
+
+def close_all_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
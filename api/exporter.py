@@ -0,0 +1,248 @@
+"""
+Columnar export of SQLite finance data
+Streams transactions and statements out as Hive-partitioned Parquet
+(user_id=.../month=...) or as an Arrow IPC stream, in bounded-memory chunks.
+Parquet exports are incremental: each export follows change_log from its own
+watermark and rewrites the part files of the statements that changed.
+"""
+import glob
+import io
+import os
+import shutil
+from typing import Any, Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import sqlite_db
+from sqlite_db import get_db_connection
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(os.path.dirname(__file__), "exports"))
+CHUNK_ROWS = 50_000
+
+# Column layout per exported table. Dates stay ISO strings as stored in SQLite.
+TRANSACTION_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("statement_id", pa.string()),
+    ("user_id", pa.string()),
+    ("month", pa.string()),
+    ("ref_number", pa.string()),
+    ("transaction_date", pa.string()),
+    ("post_date", pa.string()),
+    ("description", pa.string()),
+    ("amount", pa.float64()),
+    ("location", pa.string()),
+    ("duplicate_of", pa.int64()),
+])
+
+STATEMENT_SCHEMA = pa.schema([
+    ("statement_id", pa.string()),
+    ("user_id", pa.string()),
+    ("month", pa.string()),
+    ("bank_name", pa.string()),
+    ("card_type", pa.string()),
+    ("period_start", pa.string()),
+    ("period_end", pa.string()),
+    ("statement_date", pa.string()),
+    ("account_number", pa.string()),
+    ("subtotal_credits", pa.float64()),
+    ("subtotal_debits", pa.float64()),
+    ("interest_charges", pa.float64()),
+    ("purchases", pa.float64()),
+    ("ending_balance", pa.float64()),
+    ("minimum_payment", pa.float64()),
+    ("payment_due_date", pa.string()),
+    ("inserted_at", pa.string()),
+])
+
+# rowid is selected as _rowid to order chunks and drive the IPC cursor; it is not exported
+_QUERIES = {
+    "transactions": (TRANSACTION_SCHEMA, "t.id", """
+        SELECT t.id AS _rowid, t.id, t.statement_id, s.user_id,
+               COALESCE(substr(t.transaction_date, 1, 7), 'unknown') AS month,
+               t.ref_number, t.transaction_date, t.post_date, t.description,
+               t.amount, t.location, t.duplicate_of
+        FROM transactions t
+        JOIN statements s ON s.statement_id = t.statement_id
+        WHERE {where}
+    """),
+    "statements": (STATEMENT_SCHEMA, "s.rowid", """
+        SELECT s.rowid AS _rowid, s.statement_id, s.user_id,
+               COALESCE(substr(s.statement_date, 1, 7), 'unknown') AS month,
+               s.bank_name, s.card_type, s.period_start, s.period_end, s.statement_date,
+               s.account_number, s.subtotal_credits, s.subtotal_debits, s.interest_charges,
+               s.purchases, s.ending_balance, s.minimum_payment, s.payment_due_date, s.inserted_at
+        FROM statements s
+        WHERE {where}
+    """),
+}
+
+# Statements re-exported per query during an incremental run
+STATEMENTS_PER_QUERY = 500
+
+def _iter_chunks(table: str, where: str, params: List[Any],
+                 order_by: str, chunk_rows: int) -> Iterator[pa.Table]:
+    """Yield arrow chunks of the rows matching where, never holding more than chunk_rows rows"""
+    schema, _, sql = _QUERIES[table]
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql.format(where=where) + f" ORDER BY {order_by}", params)
+        names = [col[0] for col in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            by_name = dict(zip(names, zip(*rows)))
+            yield pa.Table.from_arrays(
+                [pa.array(by_name[field.name], type=field.type) for field in schema],
+                schema=schema
+            )
+    finally:
+        conn.close()
+
+def _part_path(export_dir: str, table: str, user_id: str, month: str, statement_id: str) -> str:
+    return os.path.join(export_dir, table, f"user_id={user_id}", f"month={month}", f"part-{statement_id}.parquet")
+
+def _write_statement_parts(table: str, export_dir: str, where: str, params: List[Any],
+                           chunk_rows: int) -> Dict[str, List[str]]:
+    """
+    Write one part file per (statement, partition) for the matching rows and
+    return the paths written per statement. Rows stream sorted by statement and
+    month, so one ParquetWriter is open at a time; each file is written under a
+    temporary name and renamed into place once complete.
+    """
+    written: Dict[str, List[str]] = {}
+    writer = None
+    current = None  # (statement_id, final path, temporary path)
+
+    def finish() -> None:
+        nonlocal writer
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(current[2], current[1])
+
+    try:
+        for chunk in _iter_chunks(table, where, params, "s.statement_id, month, _rowid", chunk_rows):
+            keys = list(zip(chunk.column("statement_id").to_pylist(), chunk.column("user_id").to_pylist(),
+                            chunk.column("month").to_pylist()))
+            start = 0
+            # Chunk is sorted, so each (statement, partition) is one contiguous slice
+            for i in range(1, len(keys) + 1):
+                if i < len(keys) and keys[i] == keys[start]:
+                    continue
+                statement_id, user_id, month = keys[start]
+                path = _part_path(export_dir, table, user_id, month, statement_id)
+                if current is None or current[1] != path:
+                    finish()
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    current = (statement_id, path, path + ".tmp")
+                    writer = pq.ParquetWriter(current[2], chunk.schema, compression="zstd")
+                    written.setdefault(statement_id, []).append(path)
+                writer.write_table(chunk.slice(start, i - start))
+                start = i
+        finish()
+    finally:
+        if writer is not None:
+            writer.close()
+            os.remove(current[2])
+    return written
+
+def export_table_to_parquet(table: str, export_dir: str = EXPORT_DIR, export_name: str = "default",
+                            incremental: bool = True, chunk_rows: int = CHUNK_ROWS) -> Dict[str, Any]:
+    """
+    Write <export_dir>/<table>/user_id=<u>/month=<m>/part-<statement_id>.parquet.
+    Incremental runs read the statements changed since this export's change_log
+    watermark and overwrite their part files, deleting parts the statement no
+    longer has, so rows removed by a re-upload disappear from the export too.
+    The first run, or one whose watermark was trimmed from the log, exports
+    everything.
+    """
+    target = f"export:{export_name}:{table}"
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        watermark, full = sqlite_db.change_log_watermark(cursor, target)
+        head = sqlite_db.change_log_head(cursor)
+        full = full or not incremental
+        statement_ids: List[str] = []
+        if not full:
+            cursor.execute("SELECT table_name, row_key, op FROM change_log WHERE seq > ? AND seq <= ? ORDER BY seq",
+                           (watermark, head))
+            statement_ids = sqlite_db.changed_statement_ids(cursor, cursor.fetchall())
+    finally:
+        conn.close()
+
+    written: Dict[str, List[str]] = {}
+    if full:
+        shutil.rmtree(os.path.join(export_dir, table), ignore_errors=True)
+        written = _write_statement_parts(table, export_dir, "1 = 1", [], chunk_rows)
+    for start in range(0, len(statement_ids), STATEMENTS_PER_QUERY):
+        chunk = statement_ids[start:start + STATEMENTS_PER_QUERY]
+        written.update(_write_statement_parts(
+            table, export_dir, f"s.statement_id IN ({', '.join('?' for _ in chunk)})", chunk, chunk_rows
+        ))
+        # Parts a re-upload emptied or moved to another month, and deleted statements
+        for statement_id in chunk:
+            keep = set(written.get(statement_id, []))
+            pattern = _part_path(export_dir, table, "*", "*", statement_id)
+            for path in glob.glob(pattern):
+                if path not in keep:
+                    os.remove(path)
+
+    # Only advance the watermark once every part file is in place
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        sqlite_db.save_watermark(cursor, target, head)
+        sqlite_db.trim_change_log(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+
+    files = sum(len(paths) for paths in written.values())
+    print(f"✅ Exported {len(written)} {table} statements into {files} part files")
+    return {"table": table, "full": full, "statements": len(written), "files": files, "watermark": head}
+
+def export_to_parquet(export_dir: str = EXPORT_DIR, export_name: str = "default",
+                      incremental: bool = True) -> Dict[str, Any]:
+    """Export transactions and statements to partitioned Parquet"""
+    return {
+        "status": "success",
+        "export_dir": export_dir,
+        "tables": [
+            export_table_to_parquet(table, export_dir, export_name, incremental)
+            for table in ("transactions", "statements")
+        ],
+    }
+
+def iter_arrow_ipc(table: str = "transactions", since_rowid: int = 0,
+                   user_id: Optional[str] = None, chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """Stream a table as Arrow IPC stream bytes, one record batch per chunk"""
+    schema = _QUERIES[table][0]
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    yield drain()  # schema message
+    rowid = _QUERIES[table][1]
+    where, params = f"{rowid} > ?", [since_rowid]
+    if user_id:
+        where += " AND s.user_id = ?"
+        params.append(user_id)
+    for chunk in _iter_chunks(table, where, params, "_rowid", chunk_rows):
+        for batch in chunk.to_batches():
+            writer.write_batch(batch)
+        yield drain()
+    writer.close()
+    yield drain()  # end-of-stream marker
+
+if __name__ == "__main__":
+    import sys
+    print(export_to_parquet(incremental="--full" not in sys.argv))
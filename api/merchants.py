@@ -0,0 +1,220 @@
+"""
+Merchant dictionary
+Maps raw card descriptions ("UBER* TRIP", "UBER CANADA/UBEREATS",
+"UBER *EATS PENDING") to one canonical merchant id, so spending can be
+grouped on a small integer instead of free text.
+
+Resolution of a description:
+  1. alias LRU (normalized description -> merchant id), then the aliases table
+  2. the description's core name (reference codes, store numbers and noise
+     words removed) looked up exactly in merchants
+  3. fuzzy match of the core name through the trigram inverted index
+     (merchant_trigrams): Dice similarity between names that start alike,
+     or one name being the leading words of the other ("UBER" / "UBER EATS")
+  4. otherwise a new merchant
+
+Every function takes a cursor, so ingest assigns merchant ids inside the
+statement's transaction. Backfill existing rows with:
+    python merchants.py --backfill
+"""
+import argparse
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+MERCHANT_CACHE_SIZE = int(os.getenv("MERCHANT_CACHE_SIZE", "50000"))
+MERCHANT_MATCH_THRESHOLD = float(os.getenv("MERCHANT_MATCH_THRESHOLD", "0.7"))
+MERCHANT_BACKFILL_BATCH = int(os.getenv("MERCHANT_BACKFILL_BATCH", "5000"))
+# Candidates (by shared trigrams) scored per fuzzy lookup
+MERCHANT_CANDIDATES = 20
+# Core names use at most this many words
+CORE_WORDS = 3
+
+# Words that never tell merchants apart
+NOISE_WORDS = frozenset({
+    "THE", "INC", "LTD", "CO", "COM", "WWW", "CA", "CANADA", "ON", "QC", "BC", "AB",
+    "PENDING", "TRIP", "PURCHASE", "POS", "ACT", "SQ", "TST", "PAYPAL",
+})
+
+def normalize_description(description: Optional[str]) -> str:
+    """Upper-case and strip punctuation so "Sobeys #934" and "SOBEYS  #934 " compare equal"""
+    return " ".join(re.sub(r"[^A-Z0-9]+", " ", (description or "").upper()).split())
+
+@lru_cache(maxsize=MERCHANT_CACHE_SIZE)
+def core_name(description: Optional[str]) -> str:
+    """
+    Merchant part of a description: apostrophes joined ("HARVEY'S" -> HARVEYS),
+    words containing digits (store numbers, reference codes) and noise words
+    dropped, first CORE_WORDS words kept
+    """
+    tokens = normalize_description((description or "").replace("'", "")).split()
+    words = [t for t in tokens if len(t) > 1 and t not in NOISE_WORDS and not any(c.isdigit() for c in t)]
+    return " ".join(words[:CORE_WORDS]) or " ".join(tokens[:1])
+
+def trigrams(name: str) -> FrozenSet[str]:
+    """Word-padded character trigrams ("UBER" -> " UB", "UBE", "BER", "ER ")"""
+    grams = set()
+    for word in name.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+def _leading_words(short: str, long: str) -> bool:
+    """short is the first word(s) of long, and specific enough to stand for it"""
+    short_words, long_words = short.split(), long.split()
+    return len(short) >= 4 and long_words[:len(short_words)] == short_words
+
+# --------------------------
+# Alias LRU
+# --------------------------
+_alias_cache: "OrderedDict[str, int]" = OrderedDict()
+_alias_lock = threading.Lock()
+
+def _cached_alias(alias: str) -> Optional[int]:
+    with _alias_lock:
+        merchant_id = _alias_cache.get(alias)
+        if merchant_id is not None:
+            _alias_cache.move_to_end(alias)
+        return merchant_id
+
+def _cache_alias(alias: str, merchant_id: int) -> None:
+    with _alias_lock:
+        _alias_cache[alias] = merchant_id
+        _alias_cache.move_to_end(alias)
+        while len(_alias_cache) > MERCHANT_CACHE_SIZE:
+            _alias_cache.popitem(last=False)
+
+def cache_clear() -> None:
+    """Forget memoized aliases (e.g. after the merchant tables were rebuilt)"""
+    with _alias_lock:
+        _alias_cache.clear()
+
+def cache_info() -> Dict[str, int]:
+    return {"aliases": len(_alias_cache), "max_size": MERCHANT_CACHE_SIZE}
+
+class MerchantResolver:
+    """
+    Resolves descriptions to merchant ids on one cursor. Aliases created by
+    this resolver are only memoized once their transaction is committed
+    (a later lookup finds them in the aliases table), so a rolled-back
+    ingest never leaves ids in the LRU that do not exist.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.created: Dict[str, int] = {}
+
+    def resolve(self, description: Optional[str]) -> Optional[int]:
+        alias = normalize_description(description)
+        if not alias:
+            return None
+        merchant_id = self.created.get(alias) or _cached_alias(alias)
+        if merchant_id is not None:
+            return merchant_id
+
+        self.cursor.execute("SELECT merchant_id FROM merchant_aliases WHERE alias = ?", (alias,))
+        row = self.cursor.fetchone()
+        if row is not None:
+            _cache_alias(alias, row[0])
+            return row[0]
+
+        merchant_id = self._match_or_create(core_name(description))
+        self.cursor.execute("INSERT INTO merchant_aliases (alias, merchant_id) VALUES (?, ?)", (alias, merchant_id))
+        self.created[alias] = merchant_id
+        return merchant_id
+
+    def resolve_many(self, descriptions: List[Optional[str]]) -> List[Optional[int]]:
+        return [self.resolve(d) for d in descriptions]
+
+    def _match_or_create(self, name: str) -> int:
+        self.cursor.execute("SELECT merchant_id FROM merchants WHERE name = ?", (name,))
+        row = self.cursor.fetchone()
+        if row is not None:
+            return row[0]
+
+        grams = trigrams(name)
+        best: Optional[Tuple[float, int, str]] = None
+        if grams:
+            self.cursor.execute(f"""
+            SELECT m.merchant_id, m.name, m.trigram_count, COUNT(*) AS shared
+            FROM merchant_trigrams g
+            JOIN merchants m ON m.merchant_id = g.merchant_id
+            WHERE g.trigram IN (SELECT value FROM json_each(?))
+            GROUP BY m.merchant_id
+            ORDER BY shared DESC
+            LIMIT {MERCHANT_CANDIDATES}
+            """, (json.dumps(sorted(grams)),))
+            for merchant_id, candidate, count, shared in self.cursor.fetchall():
+                # "UNIV OF GUELPH" and "CITY OF GUELPH" share most trigrams but not the brand
+                score = 2 * shared / (len(grams) + count) if candidate[:3] == name[:3] else 0.0
+                if _leading_words(name, candidate) or _leading_words(candidate, name):
+                    score = max(score, 1.0)
+                if score >= MERCHANT_MATCH_THRESHOLD and (best is None or score > best[0]):
+                    best = (score, merchant_id, candidate)
+
+        if best is not None:
+            merchant_id, candidate = best[1], best[2]
+            # Keep the shortest spelling as the display name ("UBER", not "UBER UBEREATS")
+            if _leading_words(name, candidate):
+                self._index(merchant_id, name, rename=True)
+            return merchant_id
+
+        self.cursor.execute("INSERT INTO merchants (name, trigram_count) VALUES (?, ?)", (name, len(grams)))
+        merchant_id = self.cursor.lastrowid
+        self._index(merchant_id, name)
+        return merchant_id
+
+    def _index(self, merchant_id: int, name: str, rename: bool = False) -> None:
+        grams = trigrams(name)
+        if rename:
+            self.cursor.execute("UPDATE merchants SET name = ?, trigram_count = ? WHERE merchant_id = ?",
+                                (name, len(grams), merchant_id))
+            self.cursor.execute("DELETE FROM merchant_trigrams WHERE merchant_id = ?", (merchant_id,))
+        self.cursor.executemany("INSERT INTO merchant_trigrams (trigram, merchant_id) VALUES (?, ?)",
+                                [(g, merchant_id) for g in grams])
+
+def backfill(conn, batch_size: int = MERCHANT_BACKFILL_BATCH) -> Dict[str, Any]:
+    """
+    Assign merchant ids to transactions that have none, batch_size rows per
+    commit (keyset paging on id, so each batch is an index range scan)
+    """
+    cursor = conn.cursor()
+    resolver = MerchantResolver(cursor)
+    last_id, updated = 0, 0
+    while True:
+        cursor.execute(
+            "SELECT id, description FROM transactions WHERE merchant_id IS NULL AND id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany("UPDATE transactions SET merchant_id = ? WHERE id = ?",
+                           [(resolver.resolve(row[1]), row[0]) for row in rows])
+        conn.commit()
+        resolver.created.clear()
+        updated += len(rows)
+        last_id = rows[-1][0]
+    cursor.execute("SELECT COUNT(*) FROM merchants")
+    return {"transactions_updated": updated, "merchants": cursor.fetchone()[0]}
+
+def merchant_names(cursor, merchant_ids: List[int]) -> Dict[int, str]:
+    cursor.execute("SELECT merchant_id, name FROM merchants WHERE merchant_id IN (SELECT value FROM json_each(?))",
+                   (json.dumps(sorted({int(i) for i in merchant_ids})),))
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merchant dictionary maintenance")
+    parser.add_argument("--backfill", action="store_true", help="assign merchant ids to rows that have none")
+    args = parser.parse_args()
+    if args.backfill:
+        from sqlite_db import get_db_connection
+        connection = get_db_connection()
+        try:
+            print(f"✅ Merchant backfill done: {backfill(connection)}")
+        finally:
+            connection.close()
@@ -0,0 +1,253 @@
+"""
+Outbox shipper - background delivery of ingested statements to Databricks
+Uploads only append to the SQLite outbox (in the same transaction as the
+statement itself), so the user-facing request never waits on the warehouse.
+A single background thread drains the outbox in batches over one warehouse
+connection and marks entries delivered. When a batch fails its entries are
+retried one at a time, so a bad payload only backs off itself; an entry that
+keeps failing is dead-lettered after OUTBOX_MAX_ATTEMPTS. Delivered entries
+are pruned after OUTBOX_RETENTION_HOURS.
+"""
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlite_db import get_db_connection
+
+DATABRICKS_KIND = "databricks_statement"
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "30"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "1800"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "168"))
+
+def _claim_batch(kind: str, limit: int) -> List[Dict[str, Any]]:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT id, payload, attempts FROM outbox
+        WHERE kind = ? AND delivered_at IS NULL AND dead_at IS NULL AND next_attempt_at <= ?
+        ORDER BY attempts, id
+        LIMIT ?
+        """, (kind, datetime.now().isoformat(), limit))
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def _mark_delivered(ids: List[int]) -> None:
+    conn = get_db_connection()
+    try:
+        now = datetime.now().isoformat()
+        conn.executemany(
+            "UPDATE outbox SET delivered_at = ?, attempts = attempts + 1, last_error = NULL WHERE id = ?",
+            [(now, i) for i in ids]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def _backoff(attempts: int) -> float:
+    """Exponential backoff with jitter for an entry that has failed attempts times"""
+    return min(OUTBOX_BACKOFF_BASE * (2 ** attempts), OUTBOX_BACKOFF_MAX) * random.uniform(0.8, 1.2)
+
+def _mark_failed(entry: Dict[str, Any], error: str) -> float:
+    """
+    Count a failed attempt and schedule a retry with backoff, or dead-letter
+    the entry once it reaches OUTBOX_MAX_ATTEMPTS; returns the retry delay.
+    """
+    conn = get_db_connection()
+    try:
+        now = datetime.now()
+        delay = _backoff(entry["attempts"])
+        dead = entry["attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS
+        conn.execute(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?, dead_at = ? WHERE id = ?",
+            ((now + timedelta(seconds=delay)).isoformat(), error[:1000],
+             now.isoformat() if dead else None, entry["id"])
+        )
+        conn.commit()
+        if dead:
+            print(f"❌ Outbox entry {entry['id']} dead-lettered after {entry['attempts'] + 1} attempts: {error}")
+        return delay
+    finally:
+        conn.close()
+
+def _defer(entries: List[Dict[str, Any]], delay: float) -> None:
+    """Push entries back without counting an attempt (they were never tried on their own)"""
+    if not entries:
+        return
+    conn = get_db_connection()
+    try:
+        conn.executemany(
+            "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+            [((datetime.now() + timedelta(seconds=delay)).isoformat(), entry["id"]) for entry in entries]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def _prune_delivered(kind: str, retention_hours: float = OUTBOX_RETENTION_HOURS) -> int:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM outbox WHERE kind = ? AND delivered_at IS NOT NULL AND delivered_at < ?",
+            (kind, (datetime.now() - timedelta(hours=retention_hours)).isoformat())
+        )
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def requeue_dead_letters(kind: str) -> int:
+    """Give dead-lettered entries a fresh set of attempts, e.g. after fixing the cause"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        UPDATE outbox SET dead_at = NULL, attempts = 0, next_attempt_at = ?
+        WHERE kind = ? AND dead_at IS NOT NULL AND delivered_at IS NULL
+        """, (datetime.now().isoformat(), kind))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def get_outbox_status() -> Dict[str, Any]:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT kind,
+               SUM(CASE WHEN delivered_at IS NULL AND dead_at IS NULL THEN 1 ELSE 0 END) AS pending,
+               SUM(CASE WHEN delivered_at IS NULL AND dead_at IS NULL AND attempts > 0 THEN 1 ELSE 0 END) AS retrying,
+               SUM(CASE WHEN dead_at IS NOT NULL AND delivered_at IS NULL THEN 1 ELSE 0 END) AS dead,
+               SUM(CASE WHEN delivered_at IS NOT NULL THEN 1 ELSE 0 END) AS delivered,
+               MIN(CASE WHEN delivered_at IS NULL AND dead_at IS NULL THEN created_at END) AS oldest_pending
+        FROM outbox
+        GROUP BY kind
+        """)
+        return {row["kind"]: dict(row) for row in cursor.fetchall()}
+    finally:
+        conn.close()
+
+def ship_databricks_batch(entries: List[Dict[str, Any]]) -> None:
+    """Deliver a batch of statements to the warehouse over a single connection"""
+    import dbxLoader
+    from warehouse import get_warehouse
+
+    items = []
+    for entry in entries:
+        payload = json.loads(entry["payload"])
+        items.append((payload["statement"], payload["user_id"]))
+
+    warehouse = get_warehouse(dbxLoader.HOST, dbxLoader.HTTP_PATH, dbxLoader.TOKEN)
+    with warehouse.connection() as conn:
+        cur = conn.cursor()
+        # The CREATE CATALOG/SCHEMA/TABLE DDL is slow; run it once per process, not per batch
+        warehouse.run_once("dbxLoader.schema", dbxLoader._ensure_schema, cur)
+        result = dbxLoader.write_statements(cur, items)
+        cur.close()
+    # Uploads reach the warehouse here rather than through sync_sqlite_to_databricks
+    from databricks_viz import databricks_viz
+    databricks_viz.invalidate_analytics_cache()
+    print(f"✅ Outbox shipped {len(result['statement_ids'])} statements to Databricks: {result['changes']}")
+
+class OutboxShipper:
+    """Background thread that drains one outbox kind with a ship(entries) callback"""
+
+    def __init__(self, kind: str = DATABRICKS_KIND,
+                 ship: Callable[[List[Dict[str, Any]]], None] = ship_databricks_batch,
+                 batch_size: int = OUTBOX_BATCH_SIZE, poll_seconds: float = OUTBOX_POLL_SECONDS):
+        self.kind = kind
+        self.ship = ship
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"outbox-{self.kind}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def notify(self) -> None:
+        """Ask the shipper to look at the outbox now instead of at the next poll"""
+        self._wake.set()
+
+    def run_once(self) -> int:
+        """Ship every due entry; returns the number delivered"""
+        delivered = 0
+        while not self._stop.is_set():
+            entries = _claim_batch(self.kind, self.batch_size)
+            if not entries:
+                break
+            try:
+                self.ship(entries)
+            except Exception as e:
+                if len(entries) == 1:
+                    delay = _mark_failed(entries[0], str(e))
+                    print(f"⚠️ Outbox delivery failed, retrying in {delay:.0f}s: {e}")
+                    break
+                print(f"⚠️ Outbox batch of {len(entries)} entries failed, shipping them one at a time: {e}")
+                shipped, reachable = self._ship_each(entries)
+                delivered += shipped
+                if not reachable:
+                    break
+                continue
+            _mark_delivered([entry["id"] for entry in entries])
+            delivered += len(entries)
+        _prune_delivered(self.kind)
+        return delivered
+
+    def _ship_each(self, entries: List[Dict[str, Any]]) -> Tuple[int, bool]:
+        """
+        Ship entries individually so only the ones that fail on their own are
+        charged an attempt. If the first two fail and nothing got through, the
+        destination itself is probably down: the rest are deferred uncharged.
+        Returns (delivered, reachable).
+        """
+        delivered = failures = 0
+        for i, entry in enumerate(entries):
+            if self._stop.is_set():
+                break
+            try:
+                self.ship([entry])
+            except Exception as e:
+                delay = _mark_failed(entry, str(e))
+                failures += 1
+                if delivered == 0 and failures >= 2:
+                    _defer(entries[i + 1:], delay)
+                    print(f"⚠️ Outbox delivery failing for every entry, retrying in {delay:.0f}s: {e}")
+                    return delivered, False
+                continue
+            _mark_delivered([entry["id"]])
+            delivered += 1
+        return delivered, True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Outbox shipper error: {e}")
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            # Let a burst of uploads accumulate into one batch
+            time.sleep(0.5)
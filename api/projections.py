@@ -0,0 +1,219 @@
+"""
+Monte Carlo savings projections
+Simulates PROJECTION_PATHS paths of monthly portfolio returns per risk profile
+as one NumPy array and reports percentile bands for what monthly contributions
+(plus an optional starting balance) grow to.
+
+Monthly gross returns are lognormal with the portfolio's volatility and an
+arithmetic mean of 1 + annual_return / 12, so the mean path matches the
+closed-form annuity the house analysis has always shown.
+
+Returns only depend on (portfolio type, horizon), never on the user, so each
+pair is simulated once and cached: per path, the growth factors of $1
+contributed monthly and of $1 invested up front at each year's checkpoint.
+The (paths, months) return matrix is only needed for that fold and is not
+kept, so a cached pair costs paths x (years + 1) floats, not paths x months. A
+projection is then a multiply-add over the cached factors and one
+percentile pass - a couple of milliseconds once the pair is cached.
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+PROJECTION_PATHS = int(os.getenv("PROJECTION_PATHS", "10000"))
+PROJECTION_SEED = int(os.getenv("PROJECTION_SEED", "2024"))
+# Simulations kept in memory, one per (portfolio type, horizon)
+PROJECTION_CACHE_SIZE = int(os.getenv("PROJECTION_CACHE_SIZE", "16"))
+PROJECTION_MAX_MONTHS = 600
+PERCENTILES = (10, 50, 90)
+# House analysis estimates card spending as this share of income
+CREDIT_CARD_SHARE = 0.15
+# Cells one scenario grid request may evaluate
+SCENARIO_MAX_CELLS = int(os.getenv("SCENARIO_MAX_CELLS", "100000"))
+
+# portfolio type -> (expected annual return, annual volatility)
+PORTFOLIOS: Dict[str, Tuple[float, float]] = {
+    "aggressive_growth": (0.12, 0.18),
+    "growth": (0.10, 0.15),
+    "balanced": (0.08, 0.10),
+    "conservative": (0.06, 0.06),
+    "income": (0.04, 0.04),
+}
+
+# risk tolerance (as sent by the investments page) -> portfolio type
+RISK_PROFILES: Dict[str, str] = {
+    "very-aggressive": "aggressive_growth",
+    "aggressive": "growth",
+    "moderate": "balanced",
+    "conservative": "conservative",
+    "very-conservative": "income",
+}
+DEFAULT_RISK = "moderate"
+
+def portfolio_for(risk_tolerance: str) -> Tuple[str, float, float]:
+    """(portfolio type, expected annual return, annual volatility); unknown tolerances are moderate"""
+    portfolio_type = RISK_PROFILES.get(risk_tolerance, RISK_PROFILES[DEFAULT_RISK])
+    return (portfolio_type,) + PORTFOLIOS[portfolio_type]
+
+@dataclass(frozen=True)
+class Simulation:
+    portfolio_type: str
+    months: int
+    annuity: np.ndarray      # (paths, years + 1) value of $1/month after 0, 12, 24 ... months (last: `months`)
+    lump: np.ndarray         # (paths, years + 1) value of $1 invested at month 0, same checkpoints
+    checkpoints: np.ndarray  # months at each checkpoint column
+
+def _checkpoints(months: int) -> np.ndarray:
+    return np.unique(np.append(np.arange(0, months + 1, 12), months))
+
+def simulate(portfolio_type: str, months: int, paths: int = PROJECTION_PATHS) -> Simulation:
+    """Draw the return matrix and fold it into per-path growth factors (the matrix itself is dropped)"""
+    annual_return, volatility = PORTFOLIOS[portfolio_type]
+    sigma = volatility / np.sqrt(12)
+    mu = np.log1p(annual_return / 12) - sigma * sigma / 2
+    # Seeded per profile and horizon, so every worker serves identical bands
+    rng = np.random.default_rng([PROJECTION_SEED, months, sorted(PORTFOLIOS).index(portfolio_type)])
+    returns = np.exp(rng.normal(mu, sigma, size=(paths, months))).astype(np.float32)
+
+    checkpoints = _checkpoints(months)
+    annuity = np.zeros((paths, len(checkpoints)))
+    lump = np.ones((paths, len(checkpoints)))
+    value = np.zeros(paths)
+    growth = np.ones(paths)
+    column = 1
+    # Contributions land at the end of each month, as in FV = PMT * ((1 + r)^n - 1) / r
+    for month in range(months):
+        value = value * returns[:, month] + 1
+        growth = growth * returns[:, month]
+        if month + 1 == checkpoints[column]:
+            annuity[:, column] = value
+            lump[:, column] = growth
+            column += 1
+    return Simulation(portfolio_type, months, annuity, lump, checkpoints)
+
+_cache: "OrderedDict[Tuple[str, int], Simulation]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def get_simulation(portfolio_type: str, months: int) -> Simulation:
+    """Cached simulation for a portfolio type and horizon (simulated on first use)"""
+    if portfolio_type not in PORTFOLIOS:
+        raise ValueError(f"Unknown portfolio type: {portfolio_type}")
+    if not 1 <= months <= PROJECTION_MAX_MONTHS:
+        raise ValueError(f"Horizon must be between 1 and {PROJECTION_MAX_MONTHS} months")
+    key = (portfolio_type, months)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+    simulation = simulate(portfolio_type, months)
+    with _cache_lock:
+        _cache[key] = simulation
+        _cache.move_to_end(key)
+        while len(_cache) > PROJECTION_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return simulation
+
+def warm(months: Iterable[int] = (60,)) -> None:
+    """Pre-generate every portfolio's simulation for the given horizons"""
+    for horizon in months:
+        for portfolio_type in PORTFOLIOS:
+            get_simulation(portfolio_type, horizon)
+
+def _bands(bands: np.ndarray) -> Dict[str, float]:
+    return {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, bands)}
+
+def project(risk_tolerance: str, monthly_contribution: float, months: int,
+            initial: float = 0.0, target: float = 0.0) -> Dict[str, Any]:
+    """
+    Percentile bands of the balance after `months` (and at each year along
+    the way) for a monthly contribution and starting balance; with a target,
+    also the share of paths that reach it
+    """
+    portfolio_type, annual_return, volatility = portfolio_for(risk_tolerance)
+    simulation = get_simulation(portfolio_type, months)
+    values = monthly_contribution * simulation.annuity + initial * simulation.lump
+    final = values[:, -1]
+    # (len(PERCENTILES), checkpoints) in one partition pass
+    bands = np.percentile(values, PERCENTILES, axis=0)
+    result = {
+        "portfolio_type": portfolio_type,
+        "expected_annual_return": annual_return,
+        "annual_volatility": volatility,
+        "paths": len(final),
+        "months": months,
+        **_bands(bands[:, -1]),
+        "mean": round(float(final.mean()), 2),
+        "by_year": [
+            {"month": int(month), **_bands(bands[:, i])}
+            for i, month in enumerate(simulation.checkpoints) if month
+        ],
+    }
+    if target > 0:
+        result["target"] = target
+        result["probability_of_target"] = round(float(np.mean(final >= target)), 4)
+    return result
+
+# --------------------------
+# Scenario grid
+# --------------------------
+def expand_range(start: float, stop: float, step: float) -> List[float]:
+    """start, start + step, ... up to and including stop"""
+    if step <= 0:
+        raise ValueError("step must be positive")
+    if stop < start:
+        raise ValueError("stop must not be below start")
+    count = int(np.floor((stop - start) / step + 1e-9)) + 1
+    if count > SCENARIO_MAX_CELLS:
+        raise ValueError(f"Range has {count} values, more than {SCENARIO_MAX_CELLS}")
+    return [round(start + i * step, 10) for i in range(count)]
+
+def scenario_grid(incomes: Sequence[float], rents: Sequence[float], savings_cuts: Sequence[float],
+                  horizons: Sequence[int], risk_tolerances: Sequence[str], target: float) -> Dict[str, Any]:
+    """
+    Every (income, rent, savings cut, horizon, risk tolerance) combination in
+    one broadcast computation, with the house analysis' assumptions (card
+    spending at CREDIT_CARD_SHARE of income, monthly compounding at the
+    portfolio's expected return). Arrays have the axes in that order.
+    """
+    unknown = sorted(set(risk_tolerances) - set(RISK_PROFILES))
+    if unknown:
+        raise ValueError(f"Unknown risk tolerance: {', '.join(unknown)}")
+    if any(h < 1 or h > PROJECTION_MAX_MONTHS for h in horizons):
+        raise ValueError(f"Horizons must be between 1 and {PROJECTION_MAX_MONTHS} months")
+    shape = (len(incomes), len(rents), len(savings_cuts), len(horizons), len(risk_tolerances))
+    cells = int(np.prod(shape))
+    if cells == 0:
+        raise ValueError("Every axis needs at least one value")
+    if cells > SCENARIO_MAX_CELLS:
+        raise ValueError(f"Grid has {cells} scenarios, more than {SCENARIO_MAX_CELLS}")
+
+    income = np.asarray(incomes, dtype=np.float64)[:, None, None, None, None]
+    rent = np.asarray(rents, dtype=np.float64)[None, :, None, None, None]
+    cut = np.asarray(savings_cuts, dtype=np.float64)[None, None, :, None, None]
+    horizon = np.asarray(horizons, dtype=np.float64)[None, None, None, :, None]
+    rate = np.array([PORTFOLIOS[RISK_PROFILES[r]][0] / 12 for r in risk_tolerances])[None, None, None, None, :]
+
+    savings = np.maximum(income * (1 - CREDIT_CARD_SHARE) - rent + cut, 0)
+    # (1 + r)^n - 1) / r, with its r -> 0 limit n
+    growth = np.where(rate > 0, np.expm1(horizon * np.log1p(rate)) / np.where(rate > 0, rate, 1), horizon)
+    projected = np.broadcast_to(savings * growth, shape)
+
+    # Solve PMT * ((1 + r)^n - 1) / r = target for n; -1 where nothing is saved
+    with np.errstate(divide="ignore", invalid="ignore"):
+        exact = np.where(rate > 0, np.log1p(target * rate / savings) / np.log1p(rate), target / savings)
+    months = np.where(savings > 0, np.ceil(exact - 1e-9), -1) if target > 0 else np.zeros_like(savings)
+    months = np.broadcast_to(months, shape).astype(np.int32)
+
+    return {
+        "shape": list(shape),
+        "cells": cells,
+        "monthly_savings": np.round(np.broadcast_to(savings, shape), 2),
+        "projected_value": np.round(projected, 2),
+        "months_to_target": months,
+        "reaches_target_in_horizon": (months >= 0) & (months <= np.broadcast_to(horizon, shape)),
+    }
@@ -0,0 +1,413 @@
+"""
+RBC InvestEase integration for the house analysis
+The InvestEasyAPI wrapper is blocking (requests), so every call runs on a
+small dedicated thread pool instead of the event loop. A house analysis makes
+each call once - create the client, then its portfolio (the create response
+already carries the portfolio's value; get_portfolio is only asked when it
+does not) - while the endpoint's local work runs concurrently.
+
+The whole exchange has a time budget (RBC_TIME_BUDGET seconds). Past it the
+caller gets RBCBudgetExceeded and falls back to computed estimates; the
+abandoned calls finish in the background and the throwaway client is still
+deleted. Cleanup is never on the response path: callers hand delete_client
+to FastAPI's BackgroundTasks.
+
+Most analyses never create anything: ClientPool keeps sandbox clients that
+already hold one portfolio of each type. A user keeps the client they leased
+last time; the portfolio is brought to the requested amount with a single
+transfer_to_portfolio or withdraw_from_portfolio (none when it already holds
+it), and the value shown is the one RBC reports back - from that response,
+or get_portfolio when it does not carry one. A background thread keeps
+RBC_POOL_SIZE idle clients ready, never more, and the pool deletes its
+clients on shutdown. Only when the pool is empty does a request
+fall back to a throwaway client.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+from rbcAPIWrapper import CircuitOpenError
+
+RBC_TIME_BUDGET = float(os.getenv("RBC_TIME_BUDGET", "3"))
+RBC_THREADS = int(os.getenv("RBC_THREADS", "4"))
+# Idle pre-provisioned clients to keep ready, and users whose client stays bound to them
+RBC_POOL_SIZE = int(os.getenv("RBC_POOL_SIZE", "4"))
+RBC_POOL_MAX_USERS = int(os.getenv("RBC_POOL_MAX_USERS", "64"))
+# Sandbox cash each pooled client starts with (portfolio top-ups are transferred from it)
+RBC_POOL_CASH = float(os.getenv("RBC_POOL_CASH", "10000000"))
+RBC_POOL_SEED_AMOUNT = 100.0
+RBC_POOL_EMAIL = "pool@moneytalks.invalid"
+
+# risk tolerance -> InvestEase portfolio type
+RBC_PORTFOLIO_TYPES: Dict[str, str] = {
+    "very-conservative": "conservative",
+    "conservative": "conservative",
+    "moderate": "balanced",
+    "aggressive": "growth",
+    "very-aggressive": "growth",
+}
+
+_executor = ThreadPoolExecutor(max_workers=RBC_THREADS, thread_name_prefix="rbc")
+
+class RBCBudgetExceeded(Exception):
+    """Raised when RBC did not answer within the request's time budget."""
+
+def rbc_portfolio_type(risk_tolerance: str) -> str:
+    return RBC_PORTFOLIO_TYPES.get(risk_tolerance, "balanced")
+
+def delete_client(api, client_id: str) -> None:
+    """Remove a throwaway client (meant for BackgroundTasks / done callbacks)"""
+    try:
+        api.delete_client(client_id)
+        print(f"✅ RBC cleanup completed for client {client_id}")
+    except Exception as cleanup_error:
+        print(f"⚠️ RBC cleanup warning: {cleanup_error}")
+
+def _provision(api, name: str, email: str, portfolio_type: str, amount: float) -> Dict[str, Any]:
+    """Client -> portfolio -> value, each call made once (these depend on each other)"""
+    started = time.time()
+    client = api.create_client(name=name, email=email, cash=amount)
+    result: Dict[str, Any] = {"client_id": client["id"]}
+    try:
+        portfolio = api.create_portfolio(client_id=client["id"], portfolio_type=portfolio_type,
+                                         initial_amount=amount)
+        if "current_value" not in portfolio:
+            portfolio = {**portfolio, **api.get_portfolio(portfolio["id"])}
+    except Exception as e:
+        # The client exists; surface it so the caller still cleans it up
+        result["error"] = e
+        return result
+    result.update({
+        "portfolio_id": portfolio["id"],
+        "current_value": portfolio.get("current_value", amount),
+        "seconds": round(time.time() - started, 2),
+    })
+    return result
+
+def _cleanup_when_done(api, future: "Future[Dict[str, Any]]") -> None:
+    """Delete the client of a provisioning run the request stopped waiting for"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    delete_client(api, future.result()["client_id"])
+
+async def create_portfolio(api, name: str, email: str, portfolio_type: str, amount: float,
+                           budget: float = RBC_TIME_BUDGET) -> Dict[str, Any]:
+    """
+    Create a throwaway client holding one portfolio of `amount`. Returns
+    {client_id, portfolio_id, current_value, seconds}; the caller schedules
+    delete_client(api, client_id). Raises RBCBudgetExceeded after `budget`
+    seconds (the client is then cleaned up once it exists) and re-raises
+    RBC errors (after the same cleanup when the client was created).
+    """
+    loop = asyncio.get_running_loop()
+    future = _executor.submit(_provision, api, name, email, portfolio_type, amount)
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(future, loop=loop), budget)
+    except asyncio.TimeoutError:
+        future.add_done_callback(functools.partial(_cleanup_when_done, api))
+        raise RBCBudgetExceeded(f"RBC API did not answer within {budget:.1f}s")
+    if "error" in result:
+        _executor.submit(delete_client, api, result["client_id"])
+        raise result["error"]
+    return result
+
+# --------------------------
+# Client pool
+# --------------------------
+@dataclass
+class PooledClient:
+    client_id: str
+    cash: float
+    # portfolio type -> {"id", "current_value"}
+    portfolios: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+def _portfolio_value(response: Any, default: Optional[float]) -> Optional[float]:
+    """current_value of a portfolio response (transfers may nest the portfolio)"""
+    if isinstance(response, dict):
+        if "current_value" in response:
+            return float(response["current_value"])
+        if isinstance(response.get("portfolio"), dict):
+            return _portfolio_value(response["portfolio"], default)
+    return default
+
+class ClientPool:
+    """
+    Pre-provisioned sandbox clients. lease() hands out a client exclusively -
+    the user's own when they have one, else an idle one - and release() binds
+    it to that user (the least recent user's client goes back to idle past
+    max_users).
+    """
+
+    def __init__(self, api, size: int = RBC_POOL_SIZE, max_users: int = RBC_POOL_MAX_USERS,
+                 cash: float = RBC_POOL_CASH):
+        self.api = api
+        self.size = size
+        self.max_users = max_users
+        self.cash = cash
+        self._lock = threading.Lock()
+        self._idle: Deque[PooledClient] = deque()
+        self._users: "OrderedDict[str, PooledClient]" = OrderedDict()
+        self._owned: Dict[str, PooledClient] = {}
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {"leases": 0, "user_hits": 0, "misses": 0, "provisioned": 0,
+                          "provision_errors": 0, "resets": 0, "reset_calls": 0, "discarded": 0, "surplus": 0,
+                          "reaped": 0}
+
+    # -----------------------------
+    # Provisioning
+    # -----------------------------
+    def _provision(self) -> PooledClient:
+        client = self.api.create_client(name=f"pool-{uuid.uuid4().hex[:12]}", email=RBC_POOL_EMAIL,
+                                        cash=self.cash)
+        pooled = PooledClient(client_id=client["id"], cash=self.cash)
+        try:
+            for portfolio_type in sorted(set(RBC_PORTFOLIO_TYPES.values())):
+                portfolio = self.api.create_portfolio(client_id=pooled.client_id, portfolio_type=portfolio_type,
+                                                      initial_amount=RBC_POOL_SEED_AMOUNT)
+                pooled.portfolios[portfolio_type] = {
+                    "id": portfolio["id"],
+                    "current_value": _portfolio_value(portfolio, RBC_POOL_SEED_AMOUNT),
+                }
+                pooled.cash -= RBC_POOL_SEED_AMOUNT
+        except Exception:
+            delete_client(self.api, pooled.client_id)
+            raise
+        return pooled
+
+    def _replenish(self) -> None:
+        """Background loop: top the idle clients back up to `size`"""
+        backoff = 1.0
+        while not self._stopping:
+            with self._lock:
+                missing = self.size - len(self._idle)
+            if missing <= 0:
+                self._wake.wait(30)
+                self._wake.clear()
+                continue
+            try:
+                pooled = self._provision()
+            except Exception as e:
+                with self._lock:
+                    self._counters["provision_errors"] += 1
+                print(f"⚠️ RBC pool provisioning failed (retrying in {backoff:.0f}s): {e}")
+                self._wake.wait(backoff)
+                self._wake.clear()
+                backoff = min(backoff * 2, 300.0)
+                continue
+            backoff = 1.0
+            with self._lock:
+                self._counters["provisioned"] += 1
+                if self._stopping:
+                    stale = [pooled]
+                else:
+                    # release() may have refilled the idle queue while this client was provisioned
+                    self._owned[pooled.client_id] = pooled
+                    stale = self._to_idle([pooled])
+            self._delete(stale)
+
+    def _to_idle(self, clients) -> List[PooledClient]:
+        """Append to the idle queue up to `size` (caller holds the lock); returns the surplus, no longer owned"""
+        surplus = []
+        for pooled in clients:
+            if len(self._idle) < self.size:
+                self._idle.append(pooled)
+            else:
+                self._owned.pop(pooled.client_id, None)
+                self._counters["surplus"] += 1
+                surplus.append(pooled)
+        return surplus
+
+    def _delete(self, clients: List[PooledClient]) -> None:
+        for pooled in clients:
+            delete_client(self.api, pooled.client_id)
+
+    def start(self) -> None:
+        if self.size <= 0 or self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._replenish, name="rbc-pool", daemon=True)
+        self._thread.start()
+        print(f"✅ RBC client pool started (target {self.size} idle clients)")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop replenishing and delete every client the pool owns (leased ones when they come back)"""
+        with self._lock:
+            self._stopping = True
+            reap = [c for c in self._owned.values() if c in self._idle or c in self._users.values()]
+            self._idle.clear()
+            self._users.clear()
+            for pooled in reap:
+                del self._owned[pooled.client_id]
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if reap:
+            with ThreadPoolExecutor(max_workers=min(RBC_THREADS, len(reap)), thread_name_prefix="rbc-reap") as pool:
+                list(pool.map(lambda c: delete_client(self.api, c.client_id), reap))
+        with self._lock:
+            self._counters["reaped"] += len(reap)
+
+    # -----------------------------
+    # Leasing
+    # -----------------------------
+    def lease(self, user_key: str) -> Optional[PooledClient]:
+        """The user's client, else an idle one; None when the pool is empty"""
+        with self._lock:
+            if self._stopping:
+                return None
+            self._counters["leases"] += 1
+            pooled = self._users.pop(user_key, None)
+            if pooled is not None:
+                self._counters["user_hits"] += 1
+            elif self._idle:
+                pooled = self._idle.popleft()
+            else:
+                self._counters["misses"] += 1
+        # Replace what just left the idle queue
+        self._wake.set()
+        return pooled
+
+    def release(self, pooled: PooledClient, user_key: str) -> None:
+        """Bind a leased client to its user for their next analysis"""
+        with self._lock:
+            if self._stopping:
+                self._owned.pop(pooled.client_id, None)
+                self._counters["reaped"] += 1
+                surplus = [pooled]
+            else:
+                previous = self._users.pop(user_key, None)
+                self._users[user_key] = pooled
+                unbound = [previous] if previous is not None else []
+                while len(self._users) > self.max_users:
+                    unbound.append(self._users.popitem(last=False)[1])
+                surplus = self._to_idle(unbound)
+        self._delete(surplus)
+
+    def discard(self, pooled: PooledClient) -> None:
+        """Drop a client whose state is unknown (a reset failed or was abandoned)"""
+        with self._lock:
+            self._owned.pop(pooled.client_id, None)
+            self._counters["discarded"] += 1
+        self._wake.set()
+        delete_client(self.api, pooled.client_id)
+
+    def reset(self, pooled: PooledClient, portfolio_type: str, amount: float) -> Dict[str, Any]:
+        """
+        Bring the client's portfolio of this type to `amount`: one transfer or
+        withdrawal, none when it already holds it (a deposit first only if the
+        client's cash runs out). current_value is what RBC reports afterwards.
+        """
+        started = time.time()
+        calls = 0
+        portfolio = pooled.portfolios.get(portfolio_type)
+        if portfolio is None:
+            created = self.api.create_portfolio(client_id=pooled.client_id, portfolio_type=portfolio_type,
+                                                initial_amount=amount)
+            calls += 1
+            portfolio = {"id": created["id"], "current_value": _portfolio_value(created, None)}
+            pooled.portfolios[portfolio_type] = portfolio
+            pooled.cash -= amount
+        else:
+            if portfolio["current_value"] is None:
+                # A previous read-back failed; learn where the portfolio stands first
+                portfolio["current_value"] = self._read_value(portfolio["id"])
+                calls += 1
+            difference = round(amount - portfolio["current_value"], 2)
+            response = None
+            if difference > 0:
+                if difference > pooled.cash:
+                    self.api.deposit_to_client(pooled.client_id, difference - pooled.cash + self.cash)
+                    calls += 1
+                    pooled.cash += difference - pooled.cash + self.cash
+                response = self.api.transfer_to_portfolio(portfolio["id"], difference)
+                calls += 1
+            elif difference < 0:
+                response = self.api.withdraw_from_portfolio(portfolio["id"], -difference)
+                calls += 1
+            pooled.cash -= difference
+            if response is not None:
+                portfolio["current_value"] = _portfolio_value(response, None)
+        if portfolio["current_value"] is None:
+            # RBC's write answer did not carry the new value; read it back
+            portfolio["current_value"] = self._read_value(portfolio["id"])
+            calls += 1
+        with self._lock:
+            self._counters["resets"] += 1
+            self._counters["reset_calls"] += calls
+        return {
+            "client_id": pooled.client_id,
+            "portfolio_id": portfolio["id"],
+            "current_value": portfolio["current_value"],
+            "calls": calls,
+            "seconds": round(time.time() - started, 2),
+        }
+
+    def _read_value(self, portfolio_id: str) -> float:
+        """The portfolio's value as RBC reports it (writes invalidate the wrapper's cached read)"""
+        value = _portfolio_value(self.api.get_portfolio(portfolio_id), None)
+        if value is None:
+            raise ValueError(f"RBC portfolio {portfolio_id} has no current_value")
+        return value
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            idle, bound = len(self._idle), len(self._users)
+            owned = len(self._owned)
+        return {
+            **counters,
+            "idle": idle,
+            "bound_to_users": bound,
+            "leased": owned - idle - bound,
+            "target_idle": self.size,
+            "avg_calls_per_reset": round(counters["reset_calls"] / counters["resets"], 2) if counters["resets"] else 0.0,
+        }
+
+def _release_when_done(pool: ClientPool, pooled: PooledClient, user_key: str, future: "Future[Dict[str, Any]]") -> None:
+    """Return a client whose reset the request stopped waiting for"""
+    if future.cancelled() or future.exception() is not None:
+        pool.discard(pooled)
+    else:
+        pool.release(pooled, user_key)
+
+async def pooled_portfolio(pool: ClientPool, user_key: str, portfolio_type: str, amount: float,
+                           name: str, email: str, budget: float = RBC_TIME_BUDGET) -> Dict[str, Any]:
+    """
+    A portfolio of `amount` from the pool (at most one RBC call), or from a
+    throwaway client when the pool is empty. The result's "pooled" is False
+    in that case, and the caller schedules delete_client for it. Same budget
+    and errors as create_portfolio.
+    """
+    pooled = pool.lease(user_key)
+    if pooled is None:
+        result = await create_portfolio(pool.api, name, email, portfolio_type, amount, budget)
+        return {**result, "pooled": False}
+    loop = asyncio.get_running_loop()
+    future = _executor.submit(pool.reset, pooled, portfolio_type, amount)
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(future, loop=loop), budget)
+    except asyncio.TimeoutError:
+        future.add_done_callback(functools.partial(_release_when_done, pool, pooled, user_key))
+        raise RBCBudgetExceeded(f"RBC API did not answer within {budget:.1f}s")
+    except CircuitOpenError:
+        # Rejected calls change nothing at RBC; a value left unknown is read back on the next reset
+        pool.release(pooled, user_key)
+        raise
+    except Exception:
+        _executor.submit(pool.discard, pooled)
+        raise
+    pool.release(pooled, user_key)
+    return {**result, "pooled": True}
+
+def shutdown() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
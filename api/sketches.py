@@ -0,0 +1,322 @@
+"""
+Mergeable spending sketches
+Keeps, per user and category, a small summary of every canonical purchase:
+    moments     - count, sum and sum of squares (total, mean, volatility)
+    t-digest    - amount distribution (median, p95 within a fraction of a percent)
+    HyperLogLog - distinct merchants and distinct locations
+
+All three merge losslessly, so one user, a cohort or everyone is answered by
+merging a handful of stored rows instead of scanning transactions - the
+"Category Performance" numbers (PERCENTILE_CONT / STDDEV, Databricks only
+until now) become a local lookup.
+
+Sketches are updated at ingest on the statement's cursor. Added purchases are
+folded in; digests and HLLs cannot forget a value, so when a purchase is
+removed or changed the affected user's sketches are rebuilt from their rows.
+"""
+import hashlib
+import math
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# t-digest compression: more centroids, tighter quantiles (about 2 * compression at most)
+SKETCH_COMPRESSION = float(os.getenv("SKETCH_COMPRESSION", "100"))
+# HyperLogLog registers = 2 ** precision (10 -> 1 KiB, about 3% standard error)
+SKETCH_HLL_PRECISION = int(os.getenv("SKETCH_HLL_PRECISION", "10"))
+
+# (statement_id, transaction_date, merchant_id, category, amount, location) of one canonical purchase
+SpendRow = Tuple[str, Optional[str], int, str, float, Optional[str]]
+
+# --------------------------
+# t-digest
+# --------------------------
+class TDigest:
+    """Merging t-digest (k1 scale function) over float amounts"""
+
+    def __init__(self, means: Optional[np.ndarray] = None, weights: Optional[np.ndarray] = None,
+                 compression: float = SKETCH_COMPRESSION):
+        self.means = np.zeros(0) if means is None else means
+        self.weights = np.zeros(0) if weights is None else weights
+        self.compression = compression
+        self._buffer: List[float] = []
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum()) + len(self._buffer)
+
+    def add(self, value: float) -> None:
+        self._buffer.append(float(value))
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, other: "TDigest") -> None:
+        other._compress()
+        self._compress(other.means, other.weights)
+
+    def _k_to_q(self, k: float) -> float:
+        return (math.sin(min(max(k * 2 * math.pi / self.compression, -math.pi / 2), math.pi / 2)) + 1) / 2
+
+    def _q_to_k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(min(max(2 * q - 1, -1.0), 1.0))
+
+    def _compress(self, extra_means: Optional[np.ndarray] = None, extra_weights: Optional[np.ndarray] = None) -> None:
+        means = [self.means, np.array(self._buffer)]
+        weights = [self.weights, np.ones(len(self._buffer))]
+        if extra_means is not None:
+            means.append(extra_means)
+            weights.append(extra_weights)
+        means, weights = np.concatenate(means), np.concatenate(weights)
+        self._buffer = []
+        if len(means) == 0:
+            return
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+
+        out_means, out_weights = [], []
+        cur_mean, cur_weight, so_far = means[0], weights[0], 0.0
+        q_limit = self._k_to_q(self._q_to_k(0.0) + 1)
+        for mean, weight in zip(means[1:], weights[1:]):
+            if (so_far + cur_weight + weight) / total <= q_limit:
+                cur_weight += weight
+                cur_mean += (mean - cur_mean) * weight / cur_weight
+            else:
+                out_means.append(cur_mean)
+                out_weights.append(cur_weight)
+                so_far += cur_weight
+                q_limit = self._k_to_q(self._q_to_k(so_far / total) + 1)
+                cur_mean, cur_weight = mean, weight
+        out_means.append(cur_mean)
+        out_weights.append(cur_weight)
+        self.means, self.weights = np.array(out_means), np.array(out_weights)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Quantile interpolated between centroid centres (edge centroids hold single values)"""
+        self._compress()
+        if len(self.means) == 0:
+            return None
+        if len(self.means) == 1:
+            return float(self.means[0])
+        # Rank of each centroid's centre, on PERCENTILE_CONT's 0..n-1 scale, so
+        # single-value centroids (every value, for small sets) give the exact answer
+        centres = np.cumsum(self.weights) - self.weights / 2 - 0.5
+        target = q * (self.weights.sum() - 1)
+        return float(np.interp(target, centres, self.means))
+
+    def to_bytes(self) -> bytes:
+        self._compress()
+        return np.concatenate([self.means, self.weights]).astype("<f8").tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "TDigest":
+        values = np.frombuffer(blob, dtype="<f8")
+        half = len(values) // 2
+        return cls(values[:half].copy(), values[half:].copy())
+
+# --------------------------
+# HyperLogLog
+# --------------------------
+class HyperLogLog:
+    """Distinct counter over strings; registers merge with an element-wise max"""
+
+    def __init__(self, registers: Optional[np.ndarray] = None, precision: int = SKETCH_HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    def add(self, item: str) -> None:
+        # Stable across processes, unlike hash()
+        h = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big")
+        index = h >> (64 - self.precision)
+        rest = (h << self.precision) & 0xFFFFFFFFFFFFFFFF
+        rank = 64 - rest.bit_length() + 1 if rest else 64 - self.precision + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Small-range correction: linear counting while registers are still empty
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "HyperLogLog":
+        registers = np.frombuffer(blob, dtype=np.uint8).copy()
+        return cls(registers, precision=int(len(registers)).bit_length() - 1)
+
+# --------------------------
+# Per-category sketch
+# --------------------------
+class CategorySketch:
+    """Moments, amount digest and merchant/location HLLs of one set of purchases"""
+
+    def __init__(self, n: int = 0, total: float = 0.0, sum_sq: float = 0.0, digest: Optional[TDigest] = None,
+                 merchants: Optional[HyperLogLog] = None, locations: Optional[HyperLogLog] = None):
+        self.n, self.total, self.sum_sq = n, total, sum_sq
+        self.digest = digest or TDigest()
+        self.merchants = merchants or HyperLogLog()
+        self.locations = locations or HyperLogLog()
+
+    def add(self, row: SpendRow) -> None:
+        amount = row[4]
+        self.n += 1
+        self.total += amount
+        self.sum_sq += amount * amount
+        self.digest.add(amount)
+        if row[2]:
+            self.merchants.add(str(row[2]))
+        location = " ".join((row[5] or "").upper().split())
+        if location:
+            self.locations.add(location)
+
+    def merge(self, other: "CategorySketch") -> None:
+        self.n += other.n
+        self.total += other.total
+        self.sum_sq += other.sum_sq
+        self.digest.merge(other.digest)
+        self.merchants.merge(other.merchants)
+        self.locations.merge(other.locations)
+
+    def summary(self) -> Dict[str, Any]:
+        """Same figures as the category_percentiles metric, plus distinct counts"""
+        variance = (self.sum_sq - self.total * self.total / self.n) / (self.n - 1) if self.n > 1 else None
+        return {
+            "transactions": self.n,
+            "total_spent": round(self.total, 2),
+            "avg_spend": round(self.total / self.n, 2) if self.n else 0.0,
+            "median_spend": _round(self.digest.quantile(0.5)),
+            "p95_spend": _round(self.digest.quantile(0.95)),
+            # Sample standard deviation, like STDDEV
+            "spending_volatility": _round(math.sqrt(max(variance, 0.0)) if variance is not None else None),
+            "distinct_merchants": self.merchants.count(),
+            "distinct_locations": self.locations.count(),
+        }
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+# --------------------------
+# Storage
+# --------------------------
+def ensure_tables(cursor) -> bool:
+    """Create the sketch table; True when it is new and needs a backfill"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'spend_sketches'")
+    created = cursor.fetchone() is None
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS spend_sketches (
+        user_id TEXT NOT NULL,
+        category TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        total REAL NOT NULL,
+        sum_sq REAL NOT NULL,
+        digest BLOB NOT NULL,
+        merchants BLOB NOT NULL,
+        locations BLOB NOT NULL,
+        PRIMARY KEY (user_id, category)
+    ) WITHOUT ROWID
+    """)
+    return created
+
+def _load(cursor, user_ids: Optional[List[str]] = None,
+          categories: Optional[List[str]] = None) -> List[Tuple[str, str, CategorySketch]]:
+    filters, params = [], []
+    for column, values in (("user_id", user_ids), ("category", categories)):
+        if values is not None:
+            filters.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    cursor.execute(f"SELECT user_id, category, n, total, sum_sq, digest, merchants, locations "
+                   f"FROM spend_sketches {where}", params)
+    return [
+        (row[0], row[1], CategorySketch(row[2], row[3], row[4], TDigest.from_bytes(row[5]),
+                                        HyperLogLog.from_bytes(row[6]), HyperLogLog.from_bytes(row[7])))
+        for row in cursor.fetchall()
+    ]
+
+def _save(cursor, user_id: str, sketches: Dict[str, CategorySketch]) -> None:
+    cursor.executemany("""
+    INSERT OR REPLACE INTO spend_sketches (user_id, category, n, total, sum_sq, digest, merchants, locations)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (user_id, category, s.n, s.total, s.sum_sq, s.digest.to_bytes(), s.merchants.to_bytes(),
+         s.locations.to_bytes())
+        for category, s in sketches.items()
+    ])
+
+def _build(rows: Iterable[SpendRow]) -> Dict[str, CategorySketch]:
+    sketches: Dict[str, CategorySketch] = {}
+    for row in rows:
+        sketches.setdefault(row[3], CategorySketch()).add(row)
+    return sketches
+
+def record_changes(cursor, user_id: str, before: Dict[str, SpendRow], after: Dict[str, SpendRow]) -> bool:
+    """
+    Fold purchases the upload added into the user's sketches (before/after
+    snapshots keyed by dedup key). Returns False (and writes nothing) when a
+    purchase was removed or changed: the caller then rebuilds the user with
+    rebuild_user().
+    """
+    if any(after.get(key) != row for key, row in before.items()):
+        return False
+    added = [row for key, row in after.items() if key not in before]
+    if not added:
+        return True
+    additions = _build(added)
+    stored = {category: sketch for _, category, sketch in _load(cursor, [user_id], list(additions))}
+    for category, sketch in additions.items():
+        if category in stored:
+            stored[category].merge(sketch)
+        else:
+            stored[category] = sketch
+    _save(cursor, user_id, stored)
+    return True
+
+def rebuild_user(cursor, user_id: str, rows: Iterable[SpendRow]) -> None:
+    """Replace one user's sketches with ones built from all of their purchases"""
+    cursor.execute("DELETE FROM spend_sketches WHERE user_id = ?", (user_id,))
+    _save(cursor, user_id, _build(rows))
+
+def rebuild(cursor, rows: Iterable[Tuple[str, SpendRow]]) -> None:
+    """Recompute every user's sketches from (user_id, row) pairs"""
+    cursor.execute("DELETE FROM spend_sketches")
+    by_user: Dict[str, List[SpendRow]] = {}
+    for user_id, row in rows:
+        by_user.setdefault(user_id, []).append(row)
+    for user_id, user_rows in by_user.items():
+        _save(cursor, user_id, _build(user_rows))
+
+def category_performance(cursor, user_ids: Optional[List[str]] = None,
+                         categories: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Per-category spending statistics for one user, a cohort (several user
+    ids) or everyone (None), merged from the stored sketches
+    """
+    merged: Dict[str, CategorySketch] = {}
+    overall = CategorySketch()
+    users = set()
+    for user_id, category, sketch in _load(cursor, user_ids, categories):
+        users.add(user_id)
+        overall.merge(sketch)
+        if category in merged:
+            merged[category].merge(sketch)
+        else:
+            merged[category] = sketch
+    return {
+        "users": len(users),
+        "categories": sorted(
+            ({"category": category, **sketch.summary()} for category, sketch in merged.items()),
+            key=lambda c: c["total_spent"], reverse=True
+        ),
+        "overall": overall.summary() if overall.n else None,
+    }
@@ -5,14 +5,24 @@ Simple, fast, and reliable local database solution
 import sqlite3
 import json
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from decimal import Decimal
 import hashlib
+import re
 from datetime import datetime
 
+from analytics_sql import daily_rollup_sql, required_sqlite_indexes, categorize, is_internal
+import anomalies
+import sketches
+from merchants import MerchantResolver, normalize_description, backfill as backfill_merchants
+
 # Database file path
 DB_PATH = os.path.join(os.path.dirname(__file__), "finance.db")
 
+# change_log rows kept for consumers that fall behind; older rows are trimmed
+# and those consumers resync from a snapshot
+CHANGE_LOG_MAX_ROWS = int(os.getenv("CHANGE_LOG_MAX_ROWS", "100000"))
+
 def get_db_connection():
     """Get SQLite database connection"""
     conn = sqlite3.connect(DB_PATH)
@@ -23,6 +33,9 @@ def init_database():
     """Initialize the database with required tables"""
     conn = get_db_connection()
     cursor = conn.cursor()
+
+    # WAL lets dashboard reads run concurrently with an ingest write
+    cursor.execute("PRAGMA journal_mode=WAL")
     
     # Create statements table
     cursor.execute("""
@@ -91,11 +104,408 @@ def init_database():
         FOREIGN KEY (statement_id) REFERENCES statements (statement_id)
     )
     """)
-    
+
+    # Row fingerprints used by the differential child-row upsert
+    for table in ("transactions", "promotions", "disclosures"):
+        _ensure_column(cursor, table, "fingerprint", "TEXT")
+        cursor.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_statement_fingerprint
+        ON {table} (statement_id, fingerprint)
+        """)
+
+    # Cross-statement duplicate detection: every transaction carries a normalized
+    # dedup_key, and the index maps each key to the first (canonical) row seen
+    _ensure_column(cursor, "transactions", "dedup_key", "TEXT")
+    _ensure_column(cursor, "transactions", "duplicate_of", "INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_dedup_key ON transactions (dedup_key)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS transaction_dedup (
+        dedup_key TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        account_number TEXT,
+        transaction_id INTEGER NOT NULL,
+        statement_id TEXT NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transaction_dedup_statement ON transaction_dedup (statement_id)")
+
+    # Merchant dictionary: canonical merchants, the raw descriptions seen for
+    # each, and the trigram inverted index used to match new ones (see merchants.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS merchants (
+        merchant_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        trigram_count INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS merchant_aliases (
+        alias TEXT PRIMARY KEY,
+        merchant_id INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS merchant_trigrams (
+        trigram TEXT NOT NULL,
+        merchant_id INTEGER NOT NULL,
+        PRIMARY KEY (trigram, merchant_id)
+    ) WITHOUT ROWID
+    """)
+    # Category learned for merchants the keyword rules leave in Other, and the
+    # embedding rows (one float32 matrix file per model) it was learned from (see categorizer.py)
+    _ensure_column(cursor, "merchants", "category", "TEXT")
+    _ensure_column(cursor, "merchants", "category_source", "TEXT")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS embeddings (
+        model TEXT NOT NULL,
+        text TEXT NOT NULL,
+        row INTEGER NOT NULL,
+        dim INTEGER NOT NULL,
+        PRIMARY KEY (model, text)
+    ) WITHOUT ROWID
+    """)
+    merchant_ids_added = _ensure_column(cursor, "transactions", "merchant_id", "INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_merchant ON transactions (merchant_id)")
+    if merchant_ids_added:
+        conn.commit()
+        backfill_merchants(conn)
+
+    # Indexes the analytics metrics declare they rely on (see analytics_sql.py)
+    for ddl in required_sqlite_indexes():
+        cursor.execute(ddl)
+
+    # Per-user daily category totals behind the date-range dashboard (see analytics_engine.DailyIndex)
+    _ensure_daily_spend(cursor)
+
+    # Running per-merchant/category stats and the alerts scored against them (see anomalies.py);
+    # merchant stats are keyed by merchant id, so they are recomputed once ids are assigned
+    if anomalies.ensure_tables(cursor) or merchant_ids_added:
+        _rebuild_spend_stats(cursor)
+    # Mergeable per-category percentile/distinct-count sketches (see sketches.py)
+    if sketches.ensure_tables(cursor) or merchant_ids_added:
+        _rebuild_sketches(cursor)
+
+    # Full-text search over description/location, kept in sync with transactions by triggers
+    _ensure_transactions_fts(cursor)
+
+    # Change log read by the incremental Databricks sync
+    _ensure_change_log(cursor)
+
+    # Durable outbox for deliveries to external systems (see outbox.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP NOT NULL,
+        delivered_at TIMESTAMP,
+        last_error TEXT
+    )
+    """)
+    _ensure_column(cursor, "outbox", "entity_key", "TEXT")  # a newer entry for the same key supersedes
+    _ensure_column(cursor, "outbox", "dead_at", "TIMESTAMP")  # dead-lettered after OUTBOX_MAX_ATTEMPTS
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_outbox_pending
+    ON outbox (kind, next_attempt_at) WHERE delivered_at IS NULL
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_outbox_entity
+    ON outbox (kind, entity_key) WHERE delivered_at IS NULL
+    """)
+
+    # Recurring charges found by the subscriptions.py batch job, and batch job watermarks
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        user_id TEXT NOT NULL,
+        merchant TEXT NOT NULL,
+        merchant_id INTEGER,
+        category TEXT NOT NULL,
+        cadence TEXT NOT NULL,
+        period_days INTEGER NOT NULL,
+        amount DECIMAL(18,2) NOT NULL,
+        monthly_cost DECIMAL(18,2) NOT NULL,
+        charges INTEGER NOT NULL,
+        first_charge DATE NOT NULL,
+        last_charge DATE NOT NULL,
+        next_expected DATE NOT NULL,
+        active INTEGER NOT NULL,
+        updated_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, merchant)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS job_state (
+        job TEXT PRIMARY KEY,
+        watermark TEXT NOT NULL,
+        ran_at TIMESTAMP NOT NULL
+    )
+    """)
+    _ensure_column(cursor, "subscriptions", "merchant_id", "INTEGER")
+    # Per-user scans (dashboard columns, subscription detection, incremental job runs)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_statements_user ON statements (user_id, inserted_at)")
+
     conn.commit()
     conn.close()
     print(f"✅ Database initialized at {DB_PATH}")
 
+def _ensure_column(cursor, table: str, column: str, decl: str) -> bool:
+    """Add a column to an existing table if an older database file lacks it; True when added"""
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        return True
+    return False
+
+def _ensure_daily_spend(cursor) -> None:
+    """Create the daily rollup table, backfilling it when an older database lacks it"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_spend'")
+    created = cursor.fetchone() is None
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS daily_spend (
+        user_id TEXT NOT NULL,
+        day DATE NOT NULL,
+        category TEXT NOT NULL,
+        transactions INTEGER NOT NULL,
+        spend_count INTEGER NOT NULL,
+        spend_cents INTEGER NOT NULL,
+        credit_cents INTEGER NOT NULL,
+        PRIMARY KEY (user_id, day, category)
+    )
+    """)
+    if created:
+        _refresh_daily_spend(cursor)
+
+def _refresh_daily_spend(cursor, user_id: Optional[str] = None, days: Optional[Iterable[str]] = None) -> None:
+    """
+    Recompute daily_spend rows from transactions: every row when user_id is
+    None, otherwise only the given days of one user. An ingest passes the days
+    its statement touched, so the rollup stays O(rows on those days).
+    """
+    if user_id is None:
+        cursor.execute("DELETE FROM daily_spend")
+        cursor.execute(daily_rollup_sql())
+        return
+    days = json.dumps(sorted({str(d)[:10] for d in days or () if d}))
+    cursor.execute("DELETE FROM daily_spend WHERE user_id = ? AND day IN (SELECT value FROM json_each(?))",
+                   (user_id, days))
+    cursor.execute(daily_rollup_sql(by_user=True, by_days=True), (user_id, days))
+
+def _transaction_days(cursor, statement_id: str) -> List[str]:
+    cursor.execute("SELECT DISTINCT date(transaction_date) FROM transactions WHERE statement_id = ?", (statement_id,))
+    return [row[0] for row in cursor.fetchall() if row[0]]
+
+def _spend_row(row) -> Optional[anomalies.SpendRow]:
+    """A transaction as anomalies.SpendRow, or None when it is not a purchase"""
+    amount = float(row["amount"] or 0)
+    if amount <= 0 or is_internal(row["description"]):
+        return None
+    return (row["statement_id"], row["transaction_date"], row["merchant_id"] or 0,
+            categorize(row["description"], row["merchant_category"]), amount, row["location"])
+
+def _spend_snapshot(cursor, dedup_keys: Iterable[str]) -> anomalies.SpendSnapshot:
+    """
+    Canonical purchases carrying any of the given dedup keys, keyed by dedup
+    key (unique among canonical rows), so a purchase a re-upload deletes and
+    re-inserts under a new id compares equal to itself
+    """
+    cursor.execute("""
+    SELECT t.id, t.dedup_key, t.statement_id, t.transaction_date, t.description, t.amount, t.merchant_id,
+           t.location, m.category AS merchant_category
+    FROM transactions t LEFT JOIN merchants m ON m.merchant_id = t.merchant_id
+    WHERE t.duplicate_of IS NULL AND t.dedup_key IN (SELECT value FROM json_each(?))
+    """, (json.dumps(sorted(set(dedup_keys))),))
+    spends = {row["dedup_key"]: (row["id"], _spend_row(row)) for row in cursor.fetchall()}
+    return {key: spend for key, spend in spends.items() if spend[1] is not None}
+
+def _spend_rows(cursor, user_id: Optional[str] = None) -> List[tuple]:
+    """(user_id, transaction id, SpendRow) of every canonical purchase (of one user), in date order"""
+    user_filter = " AND s.user_id = ?" if user_id is not None else ""
+    cursor.execute(f"""
+    SELECT s.user_id, t.id, t.statement_id, t.transaction_date, t.description, t.amount, t.merchant_id,
+           t.location, m.category AS merchant_category
+    FROM transactions t
+    JOIN statements s ON s.statement_id = t.statement_id
+    LEFT JOIN merchants m ON m.merchant_id = t.merchant_id
+    WHERE t.duplicate_of IS NULL{user_filter}
+    ORDER BY t.transaction_date, t.id
+    """, (user_id,) if user_id is not None else ())
+    rows = [(row["user_id"], row["id"], _spend_row(row)) for row in cursor.fetchall()]
+    return [row for row in rows if row[2] is not None]
+
+def _rebuild_spend_stats(cursor) -> None:
+    anomalies.rebuild(cursor, _spend_rows(cursor))
+
+def _rebuild_sketches(cursor, user_id: Optional[str] = None) -> None:
+    """Recompute the per-category sketches of one user (every user when None)"""
+    if user_id is None:
+        sketches.rebuild(cursor, [(row[0], row[2]) for row in _spend_rows(cursor)])
+    else:
+        sketches.rebuild_user(cursor, user_id, [row[2] for row in _spend_rows(cursor, user_id)])
+
+def _ensure_transactions_fts(cursor) -> None:
+    """
+    Create the external-content FTS5 index over transactions. The index stores
+    only tokens (the text stays in transactions) and prefix indexes for 1-3
+    characters keep type-ahead prefix queries off the slow full-term scan.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions_fts'")
+    created = cursor.fetchone() is None
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+        description, location,
+        content='transactions', content_rowid='id',
+        tokenize='unicode61', prefix='1 2 3'
+    )
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_ai AFTER INSERT ON transactions BEGIN
+        INSERT INTO transactions_fts (rowid, description, location)
+        VALUES (new.id, new.description, new.location);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_ad AFTER DELETE ON transactions BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, description, location)
+        VALUES ('delete', old.id, old.description, old.location);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_au AFTER UPDATE OF description, location ON transactions BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, description, location)
+        VALUES ('delete', old.id, old.description, old.location);
+        INSERT INTO transactions_fts (rowid, description, location)
+        VALUES (new.id, new.description, new.location);
+    END
+    """)
+    if created:
+        # Index rows that existed before the FTS table did
+        cursor.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+
+def _ensure_change_log(cursor) -> None:
+    """
+    Triggers append every insert/update/delete of statements and transactions
+    to change_log, giving downstream syncs a high-water mark (seq) to resume
+    from. Deletes record the remote key (statement_id|fingerprint) because the
+    row is gone by the time the sync runs. Each consumer keeps its watermark in
+    sync_state; one that has never synced, or whose watermark was trimmed away,
+    starts from a full snapshot instead (see change_log_watermark).
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_key TEXT NOT NULL,
+        op TEXT NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS transactions_log_ai AFTER INSERT ON transactions BEGIN
+        INSERT INTO change_log (table_name, row_key, op) VALUES ('transactions', new.id, 'upsert');
+    END
+    """)
+    # Dedup promotions rewrite duplicate_of on rows of other statements; databases
+    # created before that column was logged get the trigger replaced
+    cursor.execute("DROP TRIGGER IF EXISTS transactions_log_au")
+    cursor.execute("""
+    CREATE TRIGGER transactions_log_au
+    AFTER UPDATE OF ref_number, transaction_date, post_date, description, amount, location, fingerprint,
+        duplicate_of
+    ON transactions BEGIN
+        INSERT INTO change_log (table_name, row_key, op) VALUES ('transactions', new.id, 'upsert');
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS transactions_log_ad AFTER DELETE ON transactions BEGIN
+        INSERT INTO change_log (table_name, row_key, op)
+        VALUES ('transactions', old.statement_id || '|' || COALESCE(old.fingerprint, 'legacy-' || old.id), 'delete');
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS statements_log_ai AFTER INSERT ON statements BEGIN
+        INSERT INTO change_log (table_name, row_key, op) VALUES ('statements', new.statement_id, 'upsert');
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS statements_log_au AFTER UPDATE ON statements BEGIN
+        INSERT INTO change_log (table_name, row_key, op) VALUES ('statements', new.statement_id, 'upsert');
+    END
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sync_state (
+        target TEXT PRIMARY KEY,
+        last_seq INTEGER NOT NULL,
+        synced_at TIMESTAMP
+    )
+    """)
+
+def change_log_head(cursor) -> int:
+    """Highest seq ever assigned, including rows already trimmed"""
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def change_log_watermark(cursor, target: str) -> Tuple[int, bool]:
+    """
+    (last_seq, full) for a change_log consumer. full is True when the consumer
+    has never synced or the log was trimmed past its watermark, so it has to
+    start from a snapshot of the current rows rather than replay the log.
+    """
+    cursor.execute("SELECT last_seq FROM sync_state WHERE target = ?", (target,))
+    row = cursor.fetchone()
+    if row is None:
+        return 0, True
+    cursor.execute("SELECT MIN(seq) FROM change_log")
+    oldest = cursor.fetchone()[0]
+    trimmed_through = oldest - 1 if oldest is not None else change_log_head(cursor)
+    return row[0], row[0] < trimmed_through
+
+def save_watermark(cursor, target: str, seq: int) -> None:
+    cursor.execute("""
+    INSERT INTO sync_state (target, last_seq, synced_at) VALUES (?, ?, ?)
+    ON CONFLICT (target) DO UPDATE SET last_seq = excluded.last_seq, synced_at = excluded.synced_at
+    """, (target, seq, datetime.now().isoformat()))
+
+def changed_statement_ids(cursor, changes: Iterable[Any], chunk_size: int = 500) -> List[str]:
+    """
+    Statements touched by change_log rows, in first-seen order. Consumers
+    re-ship whole statements, so a delete and a re-insert of one fingerprint
+    never reach them as two separate operations.
+    """
+    statement_ids: Dict[str, None] = {}
+    tx_ids = []
+    for change in changes:
+        if change["table_name"] == "statements":
+            statement_ids[change["row_key"]] = None
+        elif change["op"] == "delete":
+            statement_ids[change["row_key"].split("|", 1)[0]] = None
+        else:
+            tx_ids.append(int(change["row_key"]))
+    for start in range(0, len(tx_ids), chunk_size):
+        chunk = tx_ids[start:start + chunk_size]
+        # Rows deleted since were logged with their statement_id
+        cursor.execute(
+            f"SELECT DISTINCT statement_id FROM transactions WHERE id IN ({', '.join('?' for _ in chunk)})",
+            chunk
+        )
+        statement_ids.update((row[0], None) for row in cursor.fetchall())
+    return list(statement_ids)
+
+def trim_change_log(cursor) -> int:
+    """
+    Delete log rows every consumer has synced past, and beyond that the oldest
+    rows over CHANGE_LOG_MAX_ROWS (consumers that far behind resync from a
+    snapshot). Returns the number of rows deleted.
+    """
+    cursor.execute("SELECT MIN(last_seq) FROM sync_state")
+    cutoff = cursor.fetchone()[0]
+    if cutoff is None:
+        cutoff = change_log_head(cursor)  # no consumers: nobody will read the log
+    cutoff = max(cutoff, change_log_head(cursor) - CHANGE_LOG_MAX_ROWS)
+    cursor.execute("DELETE FROM change_log WHERE seq <= ?", (cutoff,))
+    return cursor.rowcount
+
 def _make_statement_id(statement: Dict[str, Any], user_id: str) -> str:
     """Generate unique statement ID"""
     md = statement.get("statement_metadata", {})
@@ -106,29 +516,374 @@ def _make_statement_id(statement: Dict[str, Any], user_id: str) -> str:
     key = f"{user_id}|{acct}|{start}|{end}|{sdate}"
     return hashlib.sha1(key.encode("utf-8")).hexdigest()
 
+def _fmt_amount(amount: Any) -> str:
+    """Canonical 2-decimal text for an amount so 12.5 and "12.50" hash the same"""
+    if amount is None or amount == "":
+        return ""
+    try:
+        return str(Decimal(str(amount)).quantize(Decimal("0.01")))
+    except Exception:
+        return str(amount)
+
+def _fingerprints(keys: Iterable[str]) -> List[str]:
+    """
+    Hash each key, suffixing an occurrence counter so identical rows within
+    one statement (two $2.10 coffees on the same day) stay distinct.
+    """
+    seen: Dict[str, int] = {}
+    result = []
+    for key in keys:
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        result.append(hashlib.sha1(f"{key}#{n}".encode("utf-8")).hexdigest())
+    return result
+
+def transaction_fingerprints(transactions: Iterable[Dict[str, Any]]) -> List[str]:
+    """Stable per-transaction fingerprints (ref_number, dates, amount, description)"""
+    return _fingerprints(
+        "|".join([
+            str(tx.get("ref_number") or ""),
+            str(tx.get("transaction_date") or ""),
+            str(tx.get("post_date") or ""),
+            _fmt_amount(tx.get("amount")),
+            (tx.get("description") or "").strip(),
+        ])
+        for tx in transactions or []
+    )
+
+def promotion_fingerprints(promotions: Iterable[Dict[str, Any]]) -> List[str]:
+    """Promotions have no natural key, so every field is part of the fingerprint"""
+    return _fingerprints(
+        "|".join([
+            str(p.get("description") or ""), str(p.get("rate") or ""),
+            _fmt_amount(p.get("ending_balance")), str(p.get("expiry") or ""),
+        ])
+        for p in promotions or []
+    )
+
+def disclosure_fingerprints(disclosures: Iterable[str]) -> List[str]:
+    return _fingerprints(str(d or "") for d in disclosures or [])
+
+def transaction_dedup_keys(transactions: Iterable[Dict[str, Any]], user_id: str,
+                           account_number: Optional[str]) -> List[str]:
+    """
+    Keys that identify the same purchase across overlapping statements (e.g. a
+    monthly and a quarterly export). Ref numbers and post dates differ between
+    exports, so only the user, account, transaction date, amount and normalized
+    description are used; the occurrence counter keeps genuine repeats apart.
+    """
+    return _fingerprints(
+        "|".join([
+            user_id, account_number or "",
+            str(tx.get("transaction_date") or ""),
+            _fmt_amount(tx.get("amount")),
+            normalize_description(tx.get("description")),
+        ])
+        for tx in transactions or []
+    )
+
+def _register_duplicates(cursor, statement_id: str, user_id: str, account_number: Optional[str]) -> None:
+    """
+    Update the dedup index for one statement's transactions. Each row costs one
+    primary-key probe, so this stays O(rows in statement) however many rows the
+    user already has - no pairwise comparison.
+    """
+    # Canonical rows from this statement that the diff removed, or kept under a
+    # different key (an occurrence counter shifted): promote the next copy of the
+    # purchase (if any), in the same statement order rebuild_dedup_index uses
+    cursor.execute("""
+    SELECT d.dedup_key FROM transaction_dedup d
+    LEFT JOIN transactions t ON t.id = d.transaction_id
+    WHERE d.statement_id = ? AND (t.id IS NULL OR t.dedup_key IS NOT d.dedup_key)
+    """, (statement_id,))
+    for (dedup_key,) in cursor.fetchall():
+        cursor.execute("""
+        SELECT t.id, t.statement_id FROM transactions t
+        JOIN statements s ON s.statement_id = t.statement_id
+        WHERE t.dedup_key = ?
+        ORDER BY s.inserted_at, s.rowid, t.id
+        LIMIT 1
+        """, (dedup_key,))
+        replacement = cursor.fetchone()
+        if replacement is None:
+            cursor.execute("DELETE FROM transaction_dedup WHERE dedup_key = ?", (dedup_key,))
+            continue
+        cursor.execute(
+            "UPDATE transaction_dedup SET transaction_id = ?, statement_id = ? WHERE dedup_key = ?",
+            (replacement["id"], replacement["statement_id"], dedup_key)
+        )
+        cursor.execute(
+            "UPDATE transactions SET duplicate_of = CASE WHEN id = ? THEN NULL ELSE ? END WHERE dedup_key = ?",
+            (replacement["id"], replacement["id"], dedup_key)
+        )
+
+    # First sighting of a key makes the row canonical; later sightings point at it
+    cursor.execute("""
+    INSERT OR IGNORE INTO transaction_dedup (dedup_key, user_id, account_number, transaction_id, statement_id)
+    SELECT dedup_key, ?, ?, id, statement_id FROM transactions
+    WHERE statement_id = ? AND dedup_key IS NOT NULL
+    ORDER BY id
+    """, (user_id, account_number, statement_id))
+    cursor.execute("""
+    WITH resolved AS (
+        SELECT t.id, NULLIF(d.transaction_id, t.id) AS canonical_id
+        FROM transactions t LEFT JOIN transaction_dedup d ON d.dedup_key = t.dedup_key
+        WHERE t.statement_id = ?
+    )
+    UPDATE transactions
+    SET duplicate_of = (SELECT canonical_id FROM resolved WHERE resolved.id = transactions.id)
+    WHERE id IN (
+        SELECT r.id FROM resolved r JOIN transactions t ON t.id = r.id
+        WHERE t.duplicate_of IS NOT r.canonical_id
+    )
+    """, (statement_id,))
+
+def rebuild_dedup_index() -> Dict[str, int]:
+    """
+    Backfill dedup keys and the dedup index for rows ingested before duplicate
+    detection existed. Statements are processed oldest first so the earliest
+    upload stays canonical.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM transaction_dedup")
+        cursor.execute("SELECT statement_id, user_id, account_number FROM statements ORDER BY inserted_at, rowid")
+        statements = cursor.fetchall()
+        for stmt in statements:
+            cursor.execute(
+                "SELECT id, transaction_date, amount, description FROM transactions WHERE statement_id = ? ORDER BY id",
+                (stmt["statement_id"],)
+            )
+            rows = cursor.fetchall()
+            keys = transaction_dedup_keys([dict(r) for r in rows], stmt["user_id"], stmt["account_number"])
+            cursor.executemany(
+                "UPDATE transactions SET dedup_key = ? WHERE id = ?",
+                [(key, row["id"]) for key, row in zip(keys, rows)]
+            )
+            _register_duplicates(cursor, stmt["statement_id"], stmt["user_id"], stmt["account_number"])
+        _refresh_daily_spend(cursor)
+        _rebuild_spend_stats(cursor)
+        conn.commit()
+        cursor.execute("SELECT COUNT(*) FROM transactions WHERE duplicate_of IS NOT NULL")
+        return {"statements": len(statements), "duplicates": cursor.fetchone()[0]}
+    finally:
+        conn.close()
+
+def get_duplicate_report(user_id: Optional[str] = None) -> Dict[str, Any]:
+    """Summarize transactions flagged as duplicates of a row in an earlier statement"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        user_filter = "AND s.user_id = ?" if user_id else ""
+        params = (user_id,) if user_id else ()
+
+        cursor.execute(f"""
+        SELECT t.statement_id, c.statement_id AS duplicate_of_statement,
+               COUNT(*) AS duplicate_count, COALESCE(SUM(t.amount), 0) AS duplicate_amount
+        FROM transactions t
+        JOIN transactions c ON c.id = t.duplicate_of
+        JOIN statements s ON s.statement_id = t.statement_id
+        WHERE t.duplicate_of IS NOT NULL {user_filter}
+        GROUP BY t.statement_id, c.statement_id
+        ORDER BY duplicate_count DESC
+        """, params)
+        overlaps = cursor.fetchall()
+
+        cursor.execute(f"""
+        SELECT t.id, t.statement_id, t.transaction_date, t.description, t.amount, t.duplicate_of
+        FROM transactions t
+        JOIN statements s ON s.statement_id = t.statement_id
+        WHERE t.duplicate_of IS NOT NULL {user_filter}
+        ORDER BY t.transaction_date DESC
+        LIMIT 50
+        """, params)
+        samples = cursor.fetchall()
+
+        return {
+            "duplicate_count": sum(row["duplicate_count"] for row in overlaps),
+            "duplicate_amount": float(sum(row["duplicate_amount"] for row in overlaps)),
+            "overlapping_statements": [
+                {
+                    "statement_id": row["statement_id"],
+                    "duplicate_of_statement": row["duplicate_of_statement"],
+                    "duplicate_count": row["duplicate_count"],
+                    "duplicate_amount": float(row["duplicate_amount"]),
+                }
+                for row in overlaps
+            ],
+            "duplicates": [
+                {
+                    "id": row["id"],
+                    "statement_id": row["statement_id"],
+                    "date": row["transaction_date"],
+                    "description": row["description"],
+                    "amount": float(row["amount"]) if row["amount"] else 0,
+                    "duplicate_of": row["duplicate_of"],
+                }
+                for row in samples
+            ],
+        }
+    finally:
+        conn.close()
+
+def duplicate_markers(statement_ids: List[str]) -> Dict[str, Dict[str, str]]:
+    """
+    statement_id -> {fingerprint: canonical row's remote key} for the duplicate
+    rows of these statements. Local ids mean nothing in the warehouse, so
+    duplicates point at their canonical row as statement_id|fingerprint.
+    """
+    markers: Dict[str, Dict[str, str]] = {}
+    if not statement_ids:
+        return markers
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("""
+        SELECT t.statement_id, t.fingerprint, c.statement_id || '|' || c.fingerprint AS canonical
+        FROM transactions t
+        JOIN transactions c ON c.id = t.duplicate_of
+        WHERE t.statement_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(list(statement_ids)),)).fetchall()
+    finally:
+        conn.close()
+    for row in rows:
+        markers.setdefault(row["statement_id"], {})[row["fingerprint"]] = row["canonical"]
+    return markers
+
+def _diff_child_rows(cursor, table: str, statement_id: str,
+                     rows: List[Dict[str, Any]], value_cols: List[str]) -> Dict[str, int]:
+    """
+    Reconcile the child rows stored for a statement with the incoming ones.
+
+    Rows are matched on fingerprint: unseen fingerprints are inserted, matched
+    rows are updated only when a non-key column changed, and stored rows
+    missing from the new upload are deleted. Rows written before fingerprints
+    existed have a NULL fingerprint and are replaced once.
+    """
+    cursor.execute(
+        f"SELECT id, fingerprint, {', '.join(value_cols)} FROM {table} WHERE statement_id = ?",
+        (statement_id,)
+    )
+    existing = {}
+    stale_ids = []
+    for row in cursor.fetchall():
+        if row["fingerprint"] is None:
+            stale_ids.append(row["id"])
+        else:
+            existing[row["fingerprint"]] = row
+
+    to_insert, to_update = [], []
+    unchanged = 0
+    for r in rows:
+        old = existing.pop(r["fingerprint"], None)
+        if old is None:
+            to_insert.append(r)
+        elif any(_fmt_cell(old[c]) != _fmt_cell(r[c]) for c in value_cols):
+            to_update.append((*[r[c] for c in value_cols], old["id"]))
+        else:
+            unchanged += 1
+    to_delete = [(row["id"],) for row in existing.values()] + [(i,) for i in stale_ids]
+
+    if to_delete:
+        cursor.executemany(f"DELETE FROM {table} WHERE id = ?", to_delete)
+    if to_update:
+        cursor.executemany(
+            f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in value_cols)} WHERE id = ?",
+            to_update
+        )
+    if to_insert:
+        cols = ["statement_id", "fingerprint"] + value_cols
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})",
+            [(statement_id, r["fingerprint"], *[r[c] for c in value_cols]) for r in to_insert]
+        )
+
+    return {
+        "inserted": len(to_insert),
+        "updated": len(to_update),
+        "deleted": len(to_delete),
+        "unchanged": unchanged,
+    }
+
+def _fmt_cell(value: Any) -> str:
+    """Compare stored and incoming cells as text (SQLite may hand back 12.5 for "12.50")"""
+    if isinstance(value, (int, float, Decimal)):
+        return _fmt_amount(value)
+    return "" if value is None else str(value)
+
+# statements columns an upload (re)writes, besides statement_id and inserted_at
+STATEMENT_COLUMNS = [
+    "user_id", "bank_name", "card_type", "period_start", "period_end",
+    "statement_date", "account_number", "page_current", "page_total",
+    "subtotal_credits", "subtotal_debits", "interest_charges", "cash_advances",
+    "purchases", "ending_balance", "minimum_payment", "payment_due_date",
+    "customer_name", "customer_address", "customer_email",
+    "contact_support_json", "raw_json",
+]
+
 def upload_statement_to_sqlite(statement: Dict[str, Any], user_id: str) -> str:
     """Upload statement data to SQLite database"""
+    return ingest_statement(statement, user_id)["statement_id"]
+
+def enqueue_outbox(cursor, kind: str, payload: Dict[str, Any], entity_key: Optional[str] = None) -> int:
+    """
+    Append a delivery to the outbox inside the caller's transaction. Undelivered
+    entries with the same entity_key are dropped, since entries are retried
+    independently and an older payload must not land after a newer one.
+    """
+    now = datetime.now().isoformat()
+    if entity_key is not None:
+        cursor.execute("DELETE FROM outbox WHERE kind = ? AND entity_key = ? AND delivered_at IS NULL",
+                       (kind, entity_key))
+    cursor.execute(
+        "INSERT INTO outbox (kind, payload, entity_key, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+        (kind, json.dumps(payload), entity_key, now, now)
+    )
+    return cursor.lastrowid
+
+def _enqueue_promoted(cursor, outbox_kinds: Iterable[str], statement_id: str, logged_before: int) -> None:
+    """Re-deliver other statements whose duplicate markers this ingest promoted or demoted"""
+    cursor.execute("SELECT table_name, row_key, op FROM change_log WHERE seq > ?", (logged_before,))
+    others = [sid for sid in changed_statement_ids(cursor, cursor.fetchall()) if sid != statement_id]
+    if not others:
+        return
+    cursor.execute(
+        "SELECT statement_id, user_id, raw_json FROM statements WHERE statement_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(others),)
+    )
+    for row in cursor.fetchall():
+        for kind in outbox_kinds:
+            enqueue_outbox(cursor, kind, {"statement": json.loads(row["raw_json"]), "user_id": row["user_id"]},
+                           row["statement_id"])
+
+def ingest_statement(statement: Dict[str, Any], user_id: str,
+                     outbox_kinds: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Upsert a statement and diff its child rows against what is already stored.
+    Returns the statement_id plus inserted/updated/deleted/unchanged counts per
+    child table, so re-uploading an unchanged statement touches no child rows.
+    Each outbox kind gets an outbox entry committed atomically with the statement.
+    """
     statement_id = _make_statement_id(statement, user_id)
-    
+
     conn = get_db_connection()
     cursor = conn.cursor()
-    
+
     try:
+        logged_before = change_log_head(cursor)
         # Extract data from statement
         md = statement.get("statement_metadata", {}) or {}
         cust = statement.get("customer_info", {}) or {}
         totals = statement.get("totals", {}) or {}
         
-        # Insert/update statement
-        cursor.execute("""
-        INSERT OR REPLACE INTO statements (
-            statement_id, user_id, bank_name, card_type, period_start, period_end,
-            statement_date, account_number, page_current, page_total,
-            subtotal_credits, subtotal_debits, interest_charges, cash_advances,
-            purchases, ending_balance, minimum_payment, payment_due_date,
-            customer_name, customer_address, customer_email,
-            contact_support_json, raw_json, inserted_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        # Insert/update statement; a re-upload keeps the original inserted_at (and
+        # rowid), which decide which copy of a duplicated purchase is canonical
+        cursor.execute(f"""
+        INSERT INTO statements (
+            statement_id, {", ".join(STATEMENT_COLUMNS)}, inserted_at
+        ) VALUES ({", ".join("?" for _ in STATEMENT_COLUMNS)}, ?, ?)
+        ON CONFLICT (statement_id) DO UPDATE SET
+            {", ".join(f"{c} = excluded.{c}" for c in STATEMENT_COLUMNS)}
         """, (
             statement_id, user_id, md.get("bank_name"), md.get("card_type"),
             (md.get("statement_period") or {}).get("start"),
@@ -144,44 +899,85 @@ def upload_statement_to_sqlite(statement: Dict[str, Any], user_id: str) -> str:
             json.dumps(statement), datetime.now().isoformat()
         ))
         
-        # Clear existing related data
-        cursor.execute("DELETE FROM transactions WHERE statement_id = ?", (statement_id,))
-        cursor.execute("DELETE FROM promotions WHERE statement_id = ?", (statement_id,))
-        cursor.execute("DELETE FROM disclosures WHERE statement_id = ?", (statement_id,))
-        
-        # Insert transactions
-        transactions = statement.get("transactions", [])
-        for tx in transactions:
-            cursor.execute("""
-            INSERT INTO transactions (statement_id, ref_number, transaction_date, post_date, description, amount, location)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                statement_id, tx.get("ref_number"), tx.get("transaction_date"),
-                tx.get("post_date"), tx.get("description"), tx.get("amount"), tx.get("location")
-            ))
-        
-        # Insert promotions
-        promotions = statement.get("promotions", [])
-        for promo in promotions:
-            cursor.execute("""
-            INSERT INTO promotions (statement_id, description, rate, ending_balance, expiry)
-            VALUES (?, ?, ?, ?, ?)
-            """, (
-                statement_id, promo.get("description"), promo.get("rate"),
-                promo.get("ending_balance"), promo.get("expiry")
-            ))
-        
-        # Insert disclosures
-        disclosures = statement.get("disclosures", [])
-        for disclosure in disclosures:
-            cursor.execute("""
-            INSERT INTO disclosures (statement_id, disclosure)
-            VALUES (?, ?)
-            """, (statement_id, disclosure))
-        
+        # Days whose rollup this upload can change: the stored rows' and the new rows'
+        touched_days = set(_transaction_days(cursor, statement_id))
+        cursor.execute("SELECT dedup_key FROM transactions WHERE statement_id = ? AND dedup_key IS NOT NULL",
+                       (statement_id,))
+        touched_keys = {row[0] for row in cursor.fetchall()}
+
+        # Reconcile child rows by fingerprint instead of delete-and-reinsert
+        transactions = statement.get("transactions", []) or []
+        merchant_ids = MerchantResolver(cursor).resolve_many([tx.get("description") for tx in transactions])
+        tx_rows = [
+            {
+                "fingerprint": fp, "ref_number": tx.get("ref_number"),
+                "transaction_date": tx.get("transaction_date"), "post_date": tx.get("post_date"),
+                "description": tx.get("description"), "amount": tx.get("amount"),
+                "location": tx.get("location"), "dedup_key": dedup_key, "merchant_id": merchant_id,
+            }
+            for fp, dedup_key, merchant_id, tx in zip(
+                transaction_fingerprints(transactions),
+                transaction_dedup_keys(transactions, user_id, md.get("account_number")),
+                merchant_ids,
+                transactions
+            )
+        ]
+
+        # Purchases this upload can add, remove or promote, before the diff runs
+        touched_keys.update(r["dedup_key"] for r in tx_rows)
+        spend_before = _spend_snapshot(cursor, touched_keys)
+
+        promotions = statement.get("promotions", []) or []
+        promo_rows = [
+            {
+                "fingerprint": fp, "description": promo.get("description"), "rate": promo.get("rate"),
+                "ending_balance": promo.get("ending_balance"), "expiry": promo.get("expiry"),
+            }
+            for fp, promo in zip(promotion_fingerprints(promotions), promotions)
+        ]
+
+        disclosures = statement.get("disclosures", []) or []
+        disc_rows = [
+            {"fingerprint": fp, "disclosure": disclosure}
+            for fp, disclosure in zip(disclosure_fingerprints(disclosures), disclosures)
+        ]
+
+        changes = {
+            "transactions": _diff_child_rows(
+                cursor, "transactions", statement_id, tx_rows,
+                ["ref_number", "transaction_date", "post_date", "description", "amount", "location",
+                 "dedup_key", "merchant_id"]
+            ),
+            "promotions": _diff_child_rows(
+                cursor, "promotions", statement_id, promo_rows,
+                ["description", "rate", "ending_balance", "expiry"]
+            ),
+            "disclosures": _diff_child_rows(
+                cursor, "disclosures", statement_id, disc_rows, ["disclosure"]
+            ),
+        }
+        _register_duplicates(cursor, statement_id, user_id, md.get("account_number"))
+        # Duplicate keys include the transaction date, so promoted copies fall on the same days
+        touched_days.update(_transaction_days(cursor, statement_id))
+        _refresh_daily_spend(cursor, user_id, touched_days)
+        spend_after = _spend_snapshot(cursor, touched_keys)
+        alerts = anomalies.record_changes(cursor, user_id, statement_id, spend_before, spend_after)
+        if not sketches.record_changes(cursor, user_id, {k: row for k, (_, row) in spend_before.items()},
+                                       {k: row for k, (_, row) in spend_after.items()}):
+            _rebuild_sketches(cursor, user_id)
+        outbox_kinds = tuple(outbox_kinds)
+        for kind in outbox_kinds:
+            enqueue_outbox(cursor, kind, {"statement": statement, "user_id": user_id}, statement_id)
+        if outbox_kinds:
+            _enqueue_promoted(cursor, outbox_kinds, statement_id, logged_before)
+        trim_change_log(cursor)
+
         conn.commit()
-        print(f"✅ Statement {statement_id} uploaded successfully")
-        return statement_id
+        tx_changes = changes["transactions"]
+        print(f"✅ Statement {statement_id} uploaded successfully "
+              f"(transactions: +{tx_changes['inserted']} ~{tx_changes['updated']} -{tx_changes['deleted']}, "
+              f"alerts: {len(alerts)})")
+        return {"statement_id": statement_id, "changes": changes, "alerts": alerts}
         
     except Exception as e:
         conn.rollback()
@@ -190,126 +986,128 @@ def upload_statement_to_sqlite(statement: Dict[str, Any], user_id: str) -> str:
     finally:
         conn.close()
 
-def get_dashboard_data() -> Dict[str, Any]:
-    """Get dashboard data from SQLite"""
+# Newest matching rows ranked per search (see search_transactions)
+SEARCH_CANDIDATES = 1000
+
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query where every term must match as a prefix"""
+    terms = re.findall(r"\w+", text or "")
+    return " ".join(f'"{term}"*' for term in terms)
+
+def search_transactions(query: str, start: Optional[str] = None, end: Optional[str] = None,
+                        min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                        limit: int = 25, offset: int = 0) -> Dict[str, Any]:
+    """
+    Full-text search over transaction descriptions and locations, ranked by
+    bm25 relevance. Scoring every match of a common prefix ("u*") is what makes
+    FTS slow on large tables, so only the newest SEARCH_CANDIDATES matching rows
+    (FTS5 streams these in rowid order) are ranked; the window grows to cover
+    offset + limit. When more rows matched than were ranked the response says
+    so with truncated=True and the number of rows ranked in candidates, so
+    callers know older matches were left out. Results are paged with
+    limit/offset; one extra row is fetched to report has_more without counting
+    every match.
+    """
+    match = _fts_query(query)
+    if not match:
+        return {"transactions": [], "limit": limit, "offset": offset, "has_more": False,
+                "truncated": False, "candidates": 0}
+
+    filters = ["transactions_fts MATCH ?", "UPPER(t.description) NOT LIKE '%SCOTIABANK%'", "t.duplicate_of IS NULL"]
+    params: List[Any] = [match]
+    if start:
+        filters.append("t.transaction_date >= ?")
+        params.append(start)
+    if end:
+        filters.append("t.transaction_date <= ?")
+        params.append(end)
+    if min_amount is not None:
+        filters.append("t.amount >= ?")
+        params.append(min_amount)
+    if max_amount is not None:
+        filters.append("t.amount <= ?")
+        params.append(max_amount)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    window = max(SEARCH_CANDIDATES, offset + limit + 1)
+    try:
+        # One row past the window tells whether older matches were left unranked
+        cursor.execute(f"""
+        SELECT * FROM (
+            SELECT *, COUNT(*) OVER () AS matched, ROW_NUMBER() OVER (ORDER BY id DESC) AS newest FROM (
+                SELECT t.id, t.statement_id, t.transaction_date, t.description, t.amount, t.location,
+                       transactions_fts.rank AS rank
+                FROM transactions_fts
+                JOIN transactions t ON t.id = transactions_fts.rowid
+                WHERE {" AND ".join(filters)}
+                ORDER BY transactions_fts.rowid DESC
+                LIMIT ?
+            )
+        )
+        WHERE newest <= ?
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+        """, (*params, window + 1, window, limit + 1, offset))
+        rows = cursor.fetchall()
+        matched = rows[0]["matched"] if rows else 0
+        return {
+            "transactions": [
+                {
+                    "id": row["id"],
+                    "statement_id": row["statement_id"],
+                    "date": row["transaction_date"],
+                    "description": row["description"],
+                    "amount": float(row["amount"]) if row["amount"] else 0,
+                    "location": row["location"] or "",
+                    "score": -float(row["rank"]),
+                }
+                for row in rows[:limit]
+            ],
+            "limit": limit,
+            "offset": offset,
+            "has_more": len(rows) > limit,
+            "truncated": matched > window,
+            "candidates": min(matched, window),
+        }
+    finally:
+        conn.close()
+
+def get_all_transactions() -> Dict[str, Any]:
+    """Get all transactions excluding Scotiabank internal transactions and cross-statement duplicates"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    
     try:
-        # Get spending overview
-        # Note: All transactions are stored as negative amounts (spending), exclude Scotiabank internal transactions
-        cursor.execute("""
-        SELECT 
-            COUNT(*) as total_transactions,
-            COALESCE(SUM(amount), 0) as total_spent,
-            0 as total_credits,
-            COALESCE(AVG(amount), 0) as avg_transaction
-        FROM transactions
-        WHERE UPPER(description) NOT LIKE '%SCOTIABANK%'
-        """)
-        overview = cursor.fetchone()
-        
-        # Get spending by category (all transactions are negative amounts = spending, exclude Scotiabank)
-        cursor.execute("""
-        SELECT 
-            CASE 
-                WHEN UPPER(description) LIKE '%PRESTO%' OR UPPER(description) LIKE '%METROLINX%' OR UPPER(description) LIKE '%GO TRANSIT%' 
-                     OR UPPER(description) LIKE '%HOPP%' OR UPPER(description) LIKE '%CITY OF GUELPH%' THEN 'Transportation'
-                WHEN UPPER(description) LIKE '%SOBEYS%' OR UPPER(description) LIKE '%FOOD BASICS%' OR UPPER(description) LIKE '%WAL-MART%' 
-                     OR UPPER(description) LIKE '%WALMART%' OR UPPER(description) LIKE '%DOLLARAMA%' OR UPPER(description) LIKE '%LCBO%' 
-                     OR UPPER(description) LIKE '%FROOTLAND%' THEN 'Shopping & Groceries'
-                WHEN UPPER(description) LIKE '%MCDONALD%' OR UPPER(description) LIKE '%HARVEY%' OR UPPER(description) LIKE '%CHIPOTLE%' 
-                     OR UPPER(description) LIKE '%THAI%' OR UPPER(description) LIKE '%UBER%' OR UPPER(description) LIKE '%RESTAURANT%'
-                     OR UPPER(description) LIKE '%AMANO%' OR UPPER(description) LIKE '%POULET%' THEN 'Food & Dining'
-                WHEN UPPER(description) LIKE '%SPOTIFY%' OR UPPER(description) LIKE '%NETFLIX%' OR UPPER(description) LIKE '%ENTERTAINMENT%' THEN 'Entertainment'
-                WHEN UPPER(description) LIKE '%UNIV%' OR UPPER(description) LIKE '%COLLEGE%' OR UPPER(description) LIKE '%SCHOOL%' 
-                     OR UPPER(description) LIKE '%ACT*UNIV%' THEN 'Education'
-                WHEN UPPER(description) LIKE '%H&M%' OR UPPER(description) LIKE '%HM CA%' OR UPPER(description) LIKE '%CLOTHING%' THEN 'Clothing'
-                WHEN UPPER(description) LIKE '%RENT%' OR UPPER(description) LIKE '%MORTGAGE%' OR UPPER(description) LIKE '%UTILITIES%' THEN 'Housing'
-                ELSE 'Other'
-            END as category,
-            COUNT(*) as transaction_count,
-            SUM(ABS(amount)) as total_amount
-        FROM transactions 
-        WHERE amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%'
-        GROUP BY 1
-        HAVING SUM(ABS(amount)) > 0
-        ORDER BY total_amount DESC
-        """)
-        categories = cursor.fetchall()
-        
-        # Get recent transactions (exclude Scotiabank internal transactions)
         cursor.execute("""
         SELECT transaction_date, description, amount, location
         FROM transactions 
-        WHERE UPPER(description) NOT LIKE '%SCOTIABANK%'
+        WHERE UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
         ORDER BY transaction_date DESC, post_date DESC
-        LIMIT 10
         """)
-        recent = cursor.fetchall()
-        
-        # Get monthly trend (exclude Scotiabank internal transactions)
-        cursor.execute("""
-        SELECT 
-            transaction_date,
-            SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as daily_spending,
-            COUNT(*) as transaction_count
-        FROM transactions 
-        WHERE amount < 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%'
-        GROUP BY transaction_date
-        ORDER BY transaction_date
-        """)
-        trend = cursor.fetchall()
-        
-        # Format the data
-        def get_category_icon(category: str) -> str:
-            icons = {
-                "Transportation": "Car", "Groceries": "ShoppingCart", "Dining": "Coffee",
-                "Entertainment": "Smartphone", "Education": "GraduationCap", "Housing": "Home", "Other": "DollarSign"
-            }
-            return icons.get(category, "DollarSign")
-        
-        def get_category_color(category: str) -> str:
-            colors = {
-                "Transportation": "bg-blue-500", "Groceries": "bg-green-500", "Dining": "bg-red-500",
-                "Entertainment": "bg-yellow-500", "Education": "bg-purple-500", "Housing": "bg-indigo-500", "Other": "bg-gray-500"
-            }
-            return colors.get(category, "bg-gray-500")
-        
+        transactions = cursor.fetchall()
         return {
-            "total_spent": float(overview["total_spent"]) if overview["total_spent"] else 0,
-            "total_credits": float(overview["total_credits"]) if overview["total_credits"] else 0,
-            "total_transactions": overview["total_transactions"] or 0,
-            "avg_transaction": float(overview["avg_transaction"]) if overview["avg_transaction"] else 0,
-            "spending_by_category": [
+            "transactions": [
                 {
-                    "category": row["category"],
-                    "transaction_count": row["transaction_count"],
-                    "total_amount": float(row["total_amount"]),
-                    "icon": get_category_icon(row["category"]),
-                    "color": get_category_color(row["category"])
+                    "date": trans[0],
+                    "description": trans[1],
+                    "amount": float(trans[2]) if trans[2] else 0.0,
+                    "location": trans[3] or ""
                 }
-                for row in categories
+                for trans in transactions
             ],
-            "recent_transactions": [
-                {
-                    "date": row["transaction_date"],
-                    "description": row["description"],
-                    "amount": float(row["amount"]) if row["amount"] else 0,
-                    "location": row["location"] or ""
-                }
-                for row in recent
-            ],
-            "monthly_trend": [
-                {
-                    "date": row["transaction_date"],
-                    "spending": float(row["daily_spending"]) if row["daily_spending"] else 0,
-                    "transactions": row["transaction_count"] or 0
-                }
-                for row in trend
-            ]
+            "total_count": len(transactions)
         }
-        
+    finally:
+        conn.close()
+
+def get_dashboard_data(user_id: Optional[str] = None, start: Optional[str] = None,
+                       end: Optional[str] = None) -> Dict[str, Any]:
+    """Get dashboard data for one user (every user when user_id is None), optionally for start..end only"""
+    try:
+        # One vectorized pass over cached columns instead of a query per metric
+        from analytics_engine import get_dashboard
+        return get_dashboard(user_id, start, end)
+
     except Exception as e:
         print(f"❌ Error getting dashboard data: {e}")
         # Return mock data if database fails
@@ -326,10 +1124,34 @@ def get_dashboard_data() -> Dict[str, Any]:
                 {"date": "2024-01-01", "spending": 2847.32, "transactions": 45}
             ]
         }
+
+def get_alerts(user_id: Optional[str] = None, scope: Optional[str] = None,
+               limit: int = 50, before_id: Optional[int] = None) -> Dict[str, Any]:
+    """Anomaly alerts raised while ingesting, newest first"""
+    conn = get_db_connection()
+    try:
+        alerts = anomalies.list_alerts(conn.cursor(), user_id, scope, limit, before_id)
+        return {"alerts": alerts, "limit": limit, "next_before_id": alerts[-1]["id"] if len(alerts) == limit else None}
     finally:
         conn.close()
 
+def get_category_performance(user_ids: Optional[List[str]] = None,
+                             categories: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Median/p95/volatility and distinct counts per category, merged from the sketches"""
+    conn = get_db_connection()
+    try:
+        return sketches.category_performance(conn.cursor(), user_ids, categories)
+    finally:
+        conn.close()
+
+def get_trends(user_id: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+               granularity: str = "month") -> Dict[str, Any]:
+    """Spending per day/week/month and category between start and end (see analytics_engine.get_trends)"""
+    from analytics_engine import get_trends as engine_trends
+    return engine_trends(user_id, start, end, granularity)
+
 # Initialize database on import
 if __name__ == "__main__":
     init_database()
+    print(f"✅ Dedup index rebuilt: {rebuild_dedup_index()}")
     print("✅ SQLite database setup complete!")
@@ -0,0 +1,280 @@
+"""
+Recurring subscription detector (offline batch job)
+Groups each user's purchases by merchant id (see merchants.py) and keeps the
+merchants that charge on a regular cadence (weekly ... yearly) for a stable
+amount, writing them to the subscriptions table with their monthly cost and
+next expected charge.
+
+Purchases are streamed ordered by user and processed one user at a time with
+NumPy (one lexsort, then per-merchant medians and spreads from the sorted
+runs), so memory is bounded by the largest single user rather than the table.
+Runs are incremental: only users whose statements changed since the job's
+change_log watermark (see sqlite_db) are re-scanned - re-uploads of an
+existing statement included - unless --full is given or the log was trimmed
+past the watermark.
+
+Run: python subscriptions.py [--full]
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from analytics_sql import categorize, is_internal
+import sqlite_db
+from sqlite_db import get_db_connection
+
+SUBSCRIPTION_FETCH_ROWS = int(os.getenv("SUBSCRIPTION_FETCH_ROWS", "10000"))
+SUBSCRIPTION_COMMIT_USERS = int(os.getenv("SUBSCRIPTION_COMMIT_USERS", "500"))
+# Charges a merchant needs before its cadence is trusted
+SUBSCRIPTION_MIN_CHARGES = int(os.getenv("SUBSCRIPTION_MIN_CHARGES", "3"))
+# Share of gaps / amounts that must sit near the merchant's median
+SUBSCRIPTION_REGULARITY = float(os.getenv("SUBSCRIPTION_REGULARITY", "0.75"))
+# change_log consumer name (sync_state.target)
+SUBSCRIPTION_TARGET = "subscriptions"
+
+# (cadence, shortest and longest median gap in days, charges per month)
+CADENCES = (
+    ("weekly", 6, 8, 30.4375 / 7),
+    ("biweekly", 13, 16, 30.4375 / 14),
+    ("monthly", 26, 35, 1.0),
+    ("quarterly", 84, 98, 1 / 3),
+    ("yearly", 350, 380, 1 / 12),
+)
+
+def _group_medians(values: np.ndarray, group: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Upper median of values per group (groups numbered 0..len(counts)-1, 0 when empty)"""
+    if len(values) == 0:
+        return np.zeros(len(counts), dtype=values.dtype)
+    ordered = values[np.lexsort((values, group))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    picks = np.minimum(starts + counts // 2, len(values) - 1)
+    return np.where(counts > 0, ordered[picks], 0)
+
+def detect(days: np.ndarray, cents: np.ndarray, merchants: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Recurring merchants among one user's purchases (day numbers, int64 cents
+    and merchant ids as parallel arrays). Returns one dict per subscription
+    with the merchant id under "merchant".
+    """
+    if len(days) == 0:
+        return []
+    order = np.lexsort((days, merchants))
+    days, cents, merchants = days[order], cents[order], merchants[order]
+
+    starts = np.flatnonzero(np.concatenate(([True], merchants[1:] != merchants[:-1])))
+    counts = np.diff(np.append(starts, len(days)))
+    group = np.repeat(np.arange(len(starts)), counts)
+
+    # Gaps between consecutive charges of the same merchant
+    same = merchants[1:] == merchants[:-1]
+    gaps = np.diff(days)[same]
+    gap_group = group[1:][same]
+    gap_counts = np.bincount(gap_group, minlength=len(starts))
+    median_gap = _group_medians(gaps, gap_group, gap_counts)
+    gap_tolerance = np.maximum(3, 0.15 * median_gap)
+    regular = np.bincount(gap_group, weights=np.abs(gaps - median_gap[gap_group]) <= gap_tolerance[gap_group],
+                          minlength=len(starts)) / np.maximum(gap_counts, 1)
+
+    # Amount stability: consecutive charges within 10% (or $1) of each other,
+    # so a one-off price increase does not break an otherwise steady series
+    steps = np.abs(np.diff(cents))[same]
+    step_ok = steps <= np.maximum(100, 0.1 * cents[:-1][same])
+    stable = np.bincount(gap_group, weights=step_ok, minlength=len(starts)) / np.maximum(gap_counts, 1)
+    last_day = days[np.append(starts[1:], len(days)) - 1]
+    last_cents = cents[np.append(starts[1:], len(days)) - 1]
+
+    candidates = (counts >= SUBSCRIPTION_MIN_CHARGES) & (regular >= SUBSCRIPTION_REGULARITY) \
+        & (stable >= SUBSCRIPTION_REGULARITY) & (last_cents > 0)
+    newest = int(days.max())
+
+    found = []
+    for g in np.flatnonzero(candidates):
+        cadence = next((c for c in CADENCES if c[1] <= median_gap[g] <= c[2]), None)
+        if cadence is None:
+            continue
+        period = int(median_gap[g])
+        found.append({
+            "merchant": int(merchants[starts[g]]),
+            "cadence": cadence[0],
+            "period_days": period,
+            # Current price: the latest charge
+            "amount": int(last_cents[g]) / 100,
+            "monthly_cost": round(int(last_cents[g]) * cadence[3]) / 100,
+            "charges": int(counts[g]),
+            "first_charge": int(days[starts[g]]),
+            "last_charge": int(last_day[g]),
+            "next_expected": int(last_day[g]) + period,
+            # Lapsed once a charge is overdue by more than the tolerance, measured
+            # against the user's newest purchase rather than today (uploads lag)
+            "active": newest - int(last_day[g]) <= period + int(gap_tolerance[g]),
+        })
+    return found
+
+def _iso(day: int) -> str:
+    return str(np.datetime64(day, "D"))
+
+_COLUMNS = ("user_id", "merchant", "merchant_id", "category", "cadence", "period_days", "amount", "monthly_cost",
+            "charges", "first_charge", "last_charge", "next_expected", "active", "updated_at")
+
+def _user_subscriptions(user_id: str, rows: List[tuple], now: str) -> List[tuple]:
+    """
+    Detect one user's subscriptions from (transaction_date, description,
+    amount, merchant_id, merchant name, merchant category) rows, grouped on
+    merchant id
+    """
+    rows = [r for r in rows if r[0] and not is_internal(r[1])]
+    if not rows:
+        return []
+    days = np.array([str(r[0])[:10] for r in rows], dtype="datetime64[D]").astype(np.int64)
+    cents = np.rint(np.array([float(r[2]) for r in rows]) * 100).astype(np.int64)
+    merchant_ids = np.array([r[3] for r in rows], dtype=np.int64)
+
+    # Name and category come from each merchant's latest charge
+    latest = {}
+    for row in sorted(rows, key=lambda r: str(r[0])):
+        latest[row[3]] = row
+
+    return [
+        (
+            user_id, latest[s["merchant"]][4], s["merchant"], categorize(latest[s["merchant"]][1], latest[s["merchant"]][5]),
+            s["cadence"], s["period_days"], s["amount"], s["monthly_cost"], s["charges"],
+            _iso(s["first_charge"]), _iso(s["last_charge"]), _iso(s["next_expected"]), int(s["active"]), now,
+        )
+        for s in detect(days, cents, merchant_ids)
+    ]
+
+def _stream_purchases(cursor, user_ids: Optional[List[str]]) -> Iterable[tuple]:
+    """Canonical purchases ordered by user, fetched SUBSCRIPTION_FETCH_ROWS at a time"""
+    user_filter = "AND s.user_id IN (SELECT value FROM json_each(?))" if user_ids is not None else ""
+    cursor.execute(f"""
+    SELECT s.user_id, t.transaction_date, t.description, t.amount, t.merchant_id, m.name, m.category
+    FROM transactions t
+    JOIN statements s ON s.statement_id = t.statement_id
+    JOIN merchants m ON m.merchant_id = t.merchant_id
+    WHERE t.duplicate_of IS NULL AND t.amount > 0 {user_filter}
+    ORDER BY s.user_id
+    """, (json.dumps(user_ids),) if user_ids is not None else ())
+    while True:
+        batch = cursor.fetchmany(SUBSCRIPTION_FETCH_ROWS)
+        if not batch:
+            return
+        yield from batch
+
+def run(full: bool = False) -> Dict[str, Any]:
+    """
+    Re-detect subscriptions for users whose statements changed since the last
+    run (every user when full is set) and advance the watermark.
+    """
+    started = time.time()
+    reader = get_db_connection()
+    writer = get_db_connection()
+    try:
+        wcur = writer.cursor()
+        rcur = reader.cursor()
+        watermark, trimmed = sqlite_db.change_log_watermark(rcur, SUBSCRIPTION_TARGET)
+        new_watermark = sqlite_db.change_log_head(rcur)
+
+        user_ids = None
+        if not (full or trimmed):
+            rcur.execute("SELECT table_name, row_key, op FROM change_log WHERE seq > ? AND seq <= ? ORDER BY seq",
+                         (watermark, new_watermark))
+            statement_ids = sqlite_db.changed_statement_ids(rcur, rcur.fetchall())
+            rcur.execute(
+                "SELECT DISTINCT user_id FROM statements WHERE statement_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(statement_ids),)
+            )
+            user_ids = [r[0] for r in rcur.fetchall()]
+
+        now = datetime.now().isoformat()
+        seen: Set[str] = set()
+        pending_users = 0
+        found = 0
+        current, rows = None, []
+
+        def flush_user() -> None:
+            nonlocal pending_users, found
+            subs = _user_subscriptions(current, rows, now)
+            wcur.execute("DELETE FROM subscriptions WHERE user_id = ?", (current,))
+            wcur.executemany(
+                f"INSERT INTO subscriptions ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})", subs
+            )
+            found += len(subs)
+            pending_users += 1
+            if pending_users >= SUBSCRIPTION_COMMIT_USERS:
+                writer.commit()
+                pending_users = 0
+
+        if user_ids is None or user_ids:
+            for user_id, *purchase in _stream_purchases(rcur, user_ids):
+                if user_id != current:
+                    if current is not None:
+                        flush_user()
+                    current, rows = user_id, []
+                    seen.add(user_id)
+                rows.append(tuple(purchase))
+            if current is not None:
+                flush_user()
+
+        # Users whose purchases are all gone keep no subscriptions
+        if user_ids is None:
+            wcur.execute("SELECT DISTINCT user_id FROM subscriptions")
+            stale = [r[0] for r in wcur.fetchall() if r[0] not in seen]
+        else:
+            stale = [u for u in user_ids if u not in seen]
+        wcur.executemany("DELETE FROM subscriptions WHERE user_id = ?", [(u,) for u in stale])
+
+        sqlite_db.save_watermark(wcur, SUBSCRIPTION_TARGET, new_watermark)
+        sqlite_db.trim_change_log(wcur)
+        writer.commit()
+        result = {
+            "mode": "full" if user_ids is None else "incremental",
+            "users_scanned": len(seen),
+            "subscriptions": found,
+            "watermark": new_watermark,
+            "seconds": round(time.time() - started, 2),
+        }
+        print(f"✅ Subscription detection done: {result}")
+        return result
+    finally:
+        reader.close()
+        writer.close()
+
+def get_subscriptions(user_id: Optional[str] = None) -> Dict[str, Any]:
+    """Detected subscriptions (active first, by monthly cost) and the active monthly total"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        query = """
+        SELECT user_id, merchant, merchant_id, category, cadence, period_days, amount, monthly_cost, charges,
+               first_charge, last_charge, next_expected, active
+        FROM subscriptions
+        """
+        params: tuple = ()
+        if user_id is not None:
+            query += " WHERE user_id = ?"
+            params = (user_id,)
+        cursor.execute(query + " ORDER BY active DESC, monthly_cost DESC", params)
+        subscriptions = [
+            {**dict(row), "amount": float(row["amount"]), "monthly_cost": float(row["monthly_cost"]),
+             "active": bool(row["active"])}
+            for row in cursor.fetchall()
+        ]
+        active = [s for s in subscriptions if s["active"]]
+        return {
+            "subscriptions": subscriptions,
+            "active_count": len(active),
+            "monthly_cost": round(sum(s["monthly_cost"] for s in active), 2),
+        }
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect recurring subscriptions")
+    parser.add_argument("--full", action="store_true", help="re-scan every user, not just changed statements")
+    args = parser.parse_args()
+    run(full=args.full)
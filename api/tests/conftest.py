@@ -0,0 +1,58 @@
+"""
+Shared fixtures. Tests run against a throwaway SQLite file and an in-memory
+DuckDB warehouse, never api/finance.db or Databricks.
+
+Run from the repository root: python -m pytest -q api/tests
+"""
+import copy
+import os
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(API_DIR))  # rbcAPIWrapper
+sys.path.insert(0, API_DIR)
+os.environ["WAREHOUSE_BACKEND"] = "duckdb"
+os.environ["WAREHOUSE_DUCKDB_PATH"] = ":memory:"
+
+import pytest
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """sqlite_db pointed at a fresh, initialized database file"""
+    import merchants
+    import sqlite_db
+    monkeypatch.setattr(sqlite_db, "DB_PATH", str(tmp_path / "finance.db"))
+    # Memoized aliases point at merchant ids of the previous test's database
+    merchants.cache_clear()
+    sqlite_db.init_database()
+    return sqlite_db
+
+@pytest.fixture
+def warehouse(monkeypatch):
+    """A private in-memory DuckDB warehouse returned by every get_warehouse() call"""
+    import warehouse as warehouse_module
+    instance = warehouse_module.DuckDBWarehouse(":memory:")
+    monkeypatch.setattr(warehouse_module, "get_warehouse", lambda *args, **kwargs: instance)
+    yield instance
+    instance.close()
+
+def make_statement(transactions, account="4111", statement_date="2024-03-31",
+                   promotions=(), disclosures=()):
+    """Statement JSON shaped like the extractor's output"""
+    return copy.deepcopy({
+        "statement_metadata": {
+            "bank_name": "Scotiabank",
+            "card_type": "Visa",
+            "account_number": account,
+            "statement_date": statement_date,
+            "statement_period": {"start": statement_date[:8] + "01", "end": statement_date},
+        },
+        "totals": {"ending_balance": 100.0},
+        "transactions": list(transactions),
+        "promotions": list(promotions),
+        "disclosures": list(disclosures),
+    })
+
+def tx(date, description, amount, location="Toronto, ON", ref=None):
+    return {"ref_number": ref, "transaction_date": date, "post_date": date,
+            "description": description, "amount": amount, "location": location}
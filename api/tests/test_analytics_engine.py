@@ -0,0 +1,124 @@
+"""Vectorized dashboard analytics, prefix-sum trends and their per-user cache (analytics_engine)"""
+from collections import OrderedDict
+
+import pytest
+
+from conftest import make_statement, tx
+
+MARCH = [
+    tx("2024-03-02", "SOBEYS #123", 45.10),
+    tx("2024-03-05", "NETFLIX.COM", 16.99, location=""),
+    tx("2024-03-09", "PAYMENT SCOTIABANK", -200.00),
+]
+
+@pytest.fixture
+def engine(db, monkeypatch):
+    import analytics_engine
+    monkeypatch.setattr(analytics_engine, "_cache", OrderedDict())
+    return analytics_engine
+
+def test_dashboard_totals_and_breakdowns(engine, db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    db.ingest_statement(make_statement([tx("2024-03-03", "SOBEYS #123", 99.00)]), "u2")
+    dashboard = engine.get_dashboard("u1")
+    assert dashboard["total_spent"] == pytest.approx(62.09)
+    assert dashboard["total_transactions"] == 2  # the card payment is an internal transfer
+    assert sorted(m["total_spent"] for m in dashboard["top_merchants"]) == [16.99, 45.10]
+    assert dashboard["total_credits"] == 0
+    assert [r["description"] for r in dashboard["recent_transactions"]] == ["NETFLIX.COM", "SOBEYS #123"]
+    assert [loc["location"] for loc in dashboard["top_locations"]] == ["Toronto, ON"]
+    assert sum(c["total_amount"] for c in dashboard["spending_by_category"]) == pytest.approx(62.09)
+
+def test_duplicates_from_overlapping_statements_count_once(engine, db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    db.ingest_statement(make_statement(MARCH[:1], statement_date="2024-03-30"), "u1")
+    assert engine.get_dashboard("u1")["total_spent"] == pytest.approx(62.09)
+
+def test_reupload_of_a_changed_statement_reloads_the_cache(engine, db):
+    db.ingest_statement(make_statement(MARCH[:1]), "u1")
+    assert engine.get_dashboard("u1")["total_spent"] == pytest.approx(45.10)
+    # Same statement (same id, inserted_at kept) with one more row
+    db.ingest_statement(make_statement(MARCH), "u1")
+    assert engine.get_dashboard("u1")["total_spent"] == pytest.approx(62.09)
+
+def test_unchanged_data_is_served_from_the_cache(engine, db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    assert engine.get_columns("u1") is engine.get_columns("u1")
+    engine.invalidate("u1")
+    first = engine.get_columns("u1")
+    db.ingest_statement(make_statement([tx("2024-04-01", "PRESTO", 3.30)], statement_date="2024-04-30"), "u2")
+    assert engine.get_columns("u1") is not first
+
+def test_range_dashboard_uses_the_index_and_filters_rows(engine, db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    ranged = engine.get_dashboard("u1", start="2024-03-04", end="2024-03-31")
+    assert ranged["total_spent"] == pytest.approx(16.99)
+    assert [r["description"] for r in ranged["recent_transactions"]] == ["NETFLIX.COM"]
+    assert [c["category"] for c in ranged["spending_by_category"]] == \
+        [c["category"] for c in engine.compute_dashboard(engine.get_columns("u1"), start=engine.parse_day("2024-03-04"))
+         ["spending_by_category"]]
+
+APRIL = [
+    tx("2024-04-01", "SOBEYS #123", 20.00),
+    tx("2024-04-15", "NETFLIX.COM", 16.99, location=""),
+    tx("2024-04-20", "REFUND SOBEYS #123", -5.00),
+]
+
+def _upload_two_months(db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    db.ingest_statement(make_statement(APRIL, statement_date="2024-04-30"), "u1")
+
+def test_monthly_trends_split_spend_by_period_and_category(engine, db):
+    _upload_two_months(db)
+    trends = db.get_trends("u1")
+    # Without a start the first bucket begins on the first transaction day
+    assert [p["period"] for p in trends["periods"]] == ["2024-03-02", "2024-04-01"]
+    assert [p["total_spent"] for p in trends["periods"]] == [62.09, 36.99]
+    assert trends["periods"][1]["total_credits"] == 5.00
+    assert trends["periods"][0]["by_category"] == {c["category"]: c["total_amount"] for c in
+                                                   engine.get_dashboard("u1", end="2024-03-31")["spending_by_category"]}
+    assert trends["summary"] == trends["all_time"]
+    assert trends["all_time"]["total_spent"] == pytest.approx(99.08)
+
+def test_partial_buckets_only_count_days_in_range(engine, db):
+    _upload_two_months(db)
+    trends = engine.get_trends("u1", start="2024-03-04", end="2024-04-14", granularity="week")
+    assert trends["periods"][0]["period"] == "2024-03-04"  # a Monday; 2024-03-02 falls outside
+    assert sum(p["total_spent"] for p in trends["periods"]) == pytest.approx(36.99)
+    assert trends["summary"]["total_spent"] == pytest.approx(36.99)
+    assert trends["all_time"]["total_spent"] == pytest.approx(99.08)
+    days = engine.get_trends("u1", start="2024-04-01", end="2024-04-01", granularity="day")["periods"]
+    assert [(p["period"], p["total_spent"]) for p in days] == [("2024-04-01", 20.00)]
+
+def test_ranges_outside_the_data_are_empty(engine, db):
+    _upload_two_months(db)
+    trends = engine.get_trends("u1", start="2025-01-01", end="2025-02-01")
+    assert trends["periods"] == [] and trends["summary"]["total_spent"] == 0
+    assert engine.get_trends("nobody")["periods"] == []
+    with pytest.raises(ValueError):
+        engine.get_trends("u1", granularity="year")
+
+@pytest.mark.parametrize("start, end", [
+    ("2024-03-01", "2024-03-31"), ("2024-03-05", "2024-04-15"), ("2024-04-02", None), (None, "2024-03-04"),
+])
+def test_prefix_sums_agree_with_the_rows(engine, db, start, end):
+    _upload_two_months(db)
+    ranged = engine.get_dashboard("u1", start=start, end=end)
+    rows = engine.compute_dashboard(engine.get_columns("u1"), start=engine.parse_day(start),
+                                    end=engine.parse_day(end))
+    for key in ("total_spent", "total_credits", "total_transactions"):
+        assert ranged[key] == pytest.approx(rows[key])
+    assert ranged["spending_by_category"] == rows["spending_by_category"]
+
+def test_ranges_follow_a_reupload(engine, db):
+    _upload_two_months(db)
+    assert engine.get_dashboard("u1", start="2024-04-01", end="2024-04-30")["total_spent"] == pytest.approx(36.99)
+    assert db.get_trends("u1", start="2024-04-01")["summary"]["total_spent"] == pytest.approx(36.99)
+    # The April statement again (same id) with the Netflix charge removed and a late charge added
+    db.ingest_statement(make_statement([APRIL[0], APRIL[2], tx("2024-04-28", "PRESTO", 3.30)],
+                                       statement_date="2024-04-30"), "u1")
+    assert engine.get_dashboard("u1", start="2024-04-01", end="2024-04-30")["total_spent"] == pytest.approx(23.30)
+    trends = db.get_trends("u1", start="2024-04-01", granularity="day")
+    assert trends["summary"]["total_spent"] == pytest.approx(23.30)
+    assert trends["periods"][-1]["period"] == "2024-04-28"
+    assert engine.get_dashboard("u1", start="2024-03-01", end="2024-03-31")["total_spent"] == pytest.approx(62.09)
@@ -0,0 +1,80 @@
+"""Shared metric definitions and the amount sign convention (analytics_sql.py)"""
+import os
+
+import pytest
+
+from analytics_sql import DATABRICKS, SQLITE, compile_metric, render_sql_file
+from conftest import make_statement, tx
+
+# Purchases positive, payments and refunds negative, card payments internal
+TRANSACTIONS = [
+    tx("2024-03-02", "SOBEYS #123", 45.10),
+    tx("2024-03-05", "NETFLIX.COM", 16.99),
+    tx("2024-03-06", "SOBEYS #123 REFUND", -10.00),
+    tx("2024-03-20", "PAYMENT - SCOTIABANK", -500.00),
+    tx("2024-03-21", "SCOTIABANK INTEREST", 3.00),
+]
+
+def _query(db, sql, params=()):
+    conn = db.get_db_connection()
+    try:
+        return conn.execute(sql, params).fetchone()
+    finally:
+        conn.close()
+
+def test_latest_statement_spend_counts_purchases_only(db):
+    db.ingest_statement(make_statement([tx("2024-02-02", "LCBO", 99.00)], statement_date="2024-02-29"), "u1")
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    (spend,) = _query(db, compile_metric("latest_statement_spend", SQLITE), ("u1",))
+    assert spend == pytest.approx(62.09)
+    assert _query(db, compile_metric("latest_statement_spend", SQLITE), ("nobody",))[0] == 0
+
+def test_spending_overview_separates_spend_and_credits(db):
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    row = _query(db, compile_metric("spending_overview", SQLITE))
+    assert row["total_spent"] == pytest.approx(62.09)
+    assert row["total_credits"] == pytest.approx(10.00)
+
+def test_warehouse_dialect_agrees_with_sqlite(db, warehouse):
+    import dbxLoader
+    statement = make_statement(TRANSACTIONS)
+    with warehouse.connection() as conn:
+        cur = conn.cursor()
+        dbxLoader._ensure_schema(cur)
+        dbxLoader.write_statements(cur, [(statement, "u1")])
+        cur.execute(compile_metric("latest_statement_spend", DATABRICKS), ("u1",))
+        assert float(cur.fetchone()[0]) == pytest.approx(62.09)
+
+def test_databricks_queries_file_is_generated_from_the_metrics():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                        "databricks_queries.sql")
+    with open(path) as f:
+        assert f.read() == render_sql_file()
+
+def test_both_dialects_skip_duplicates_shipped_through_the_outbox(db, warehouse):
+    import outbox
+    march = make_statement(TRANSACTIONS[:2])
+    quarter = make_statement(TRANSACTIONS[:1] + [tx("2024-03-25", "PRESTO", 3.30)], statement_date="2024-03-30")
+
+    def ship_pending():
+        entries = outbox._claim_batch(outbox.DATABRICKS_KIND, 100)
+        outbox.ship_databricks_batch(entries)
+        outbox._mark_delivered([entry["id"] for entry in entries])
+        return len(entries)
+
+    def totals():
+        local = _query(db, compile_metric("spending_overview", SQLITE))["total_spent"]
+        with warehouse.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(compile_metric("spending_overview", DATABRICKS))
+            return local, float(cur.fetchone()[1])
+
+    db.ingest_statement(march, "u1", outbox_kinds=[outbox.DATABRICKS_KIND])
+    db.ingest_statement(quarter, "u1", outbox_kinds=[outbox.DATABRICKS_KIND])
+    assert ship_pending() == 2
+    assert totals() == pytest.approx((65.39, 65.39))
+
+    # Dropping SOBEYS from March promotes the quarter's copy, so both statements are re-delivered
+    db.ingest_statement(make_statement(TRANSACTIONS[1:2]), "u1", outbox_kinds=[outbox.DATABRICKS_KIND])
+    assert ship_pending() == 2
+    assert totals() == pytest.approx((65.39, 65.39))
@@ -0,0 +1,97 @@
+"""Running Welford statistics and anomaly alerts (anomalies.py)"""
+import random
+import statistics
+
+import pytest
+
+import anomalies
+from conftest import make_statement, tx
+
+def test_welford_add_and_remove_match_the_batch_statistics():
+    rng = random.Random(7)
+    values = [rng.uniform(1, 500) for _ in range(200)]
+    stats = [0, 0.0, 0.0]
+    for x in values:
+        anomalies._add(stats, x)
+    for x in values[:50]:
+        anomalies._remove(stats, x)
+    rest = values[50:]
+    assert stats[0] == len(rest)
+    assert stats[1] == pytest.approx(statistics.mean(rest))
+    assert anomalies._stddev(stats) == pytest.approx(statistics.stdev(rest))
+
+def test_zscore_respects_history_floor_and_spread_floor():
+    stats = [0, 0.0, 0.0]
+    for x in (9.99,) * 10:
+        anomalies._add(stats, x)
+    assert anomalies._zscore(stats, 10.49, 5) is None  # below ANOMALY_MIN_AMOUNT, spread floor
+    assert anomalies._zscore([3, 50.0, 10.0], 500.0, 5) is None  # not enough history
+    z, spread = anomalies._zscore(stats, 100.0, 5)
+    assert spread == pytest.approx(anomalies.ANOMALY_MIN_STDDEV_RATIO * 9.99)
+    assert z >= anomalies.ANOMALY_ZSCORE
+
+HISTORY = [40.0, 45.0, 50.0, 55.0, 60.0, 48.0]
+
+def _ingest_history(db):
+    for month, amount in enumerate(HISTORY, start=1):
+        db.ingest_statement(make_statement([tx(f"2024-{month:02d}-10", "SOBEYS #123", amount)],
+                                           statement_date=f"2024-{month:02d}-28"), "u1")
+
+def _state(db):
+    conn = db.get_db_connection()
+    try:
+        stats = {(r["scope"], r["key"]): (r["n"], r["mean"], r["m2"])
+                 for r in conn.execute("SELECT * FROM spend_stats WHERE user_id = 'u1'")}
+        alerts = [(r["scope"], r["period"], r["amount"]) for r in conn.execute("SELECT * FROM alerts ORDER BY id")]
+        return stats, alerts
+    finally:
+        conn.close()
+
+def test_outlier_charge_raises_an_alert(db):
+    _ingest_history(db)
+    result = db.ingest_statement(make_statement([tx("2024-07-10", "SOBEYS #123", 500.0)],
+                                                statement_date="2024-07-28"), "u1")
+    scopes = {alert["scope"] for alert in result["alerts"]}
+    assert {"merchant", "category"} <= scopes
+    assert all(alert["amount"] == 500.0 for alert in result["alerts"])
+
+def test_incremental_stats_match_a_rebuild(db):
+    _ingest_history(db)
+    db.ingest_statement(make_statement([tx("2024-03-10", "SOBEYS #123", 52.0)], statement_date="2024-03-28"), "u1")
+    incremental, _ = _state(db)
+    conn = db.get_db_connection()
+    try:
+        db._rebuild_spend_stats(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+    rebuilt, _ = _state(db)
+    assert incremental.keys() == rebuilt.keys()
+    for key, (n, mean, m2) in incremental.items():
+        assert (n, mean, m2) == pytest.approx(rebuilt[key]), key
+
+def test_unchanged_reingest_under_new_ids_leaves_stats_and_alerts_alone(db):
+    _ingest_history(db)
+    outlier = make_statement([tx("2024-07-10", "SOBEYS #123", 500.0), tx("2024-07-11", "NETFLIX.COM", 16.99)],
+                             statement_date="2024-07-28")
+    db.ingest_statement(outlier, "u1")
+    stats_before, alerts_before = _state(db)
+    assert alerts_before
+
+    # Rows without fingerprints (ingested before fingerprinting) are deleted and
+    # re-inserted under new ids by the next upload of the same statement
+    conn = db.get_db_connection()
+    try:
+        conn.execute("UPDATE transactions SET fingerprint = NULL WHERE transaction_date >= '2024-07-01'")
+        conn.commit()
+    finally:
+        conn.close()
+    result = db.ingest_statement(outlier, "u1")
+    assert result["changes"]["transactions"]["inserted"] == 2
+    assert result["alerts"] == []
+
+    stats_after, alerts_after = _state(db)
+    assert alerts_after == alerts_before
+    assert stats_after.keys() == stats_before.keys()
+    for key, values in stats_before.items():
+        assert stats_after[key] == pytest.approx(values), key
@@ -0,0 +1,78 @@
+"""Nearest-neighbour merchant categorization (categorizer.py)"""
+import numpy as np
+import pytest
+
+import categorizer
+from conftest import make_statement, tx
+
+# Fake embedding axes: grocery-like names, entertainment-like names, unrelated names; everything else on the last
+AXES = (
+    ("SOBEYS", "FOOD BASICS", "WAL MART", "WALMART", "DOLLARAMA", "LCBO", "FROOTLAND", "COSTCO"),
+    ("SPOTIFY", "NETFLIX", "ENTERTAINMENT", "CINEPLEX"),
+    ("MYSTERY",),
+)
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.requests = []
+
+    def _vector(self, text):
+        axis = next((i for i, words in enumerate(AXES) if any(w in text for w in words)), len(AXES))
+        return [float(i == axis) for i in range(len(AXES) + 1)]
+
+    def embeddings(self, model, input):
+        self.requests.append(list(input))
+        return {"data": [{"index": i, "embedding": self._vector(t)} for i, t in enumerate(input)]}
+
+def _categories(db):
+    conn = db.get_db_connection()
+    try:
+        return {row[0]: row[1] for row in conn.execute("SELECT name, category FROM merchants")}
+    finally:
+        conn.close()
+
+def test_nearest_categories_votes_and_respects_the_similarity_floor():
+    matrix = np.array([[1, 0], [0, 1], [0.9, 0.1], [0.6, 0.8], [-1, 0]], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    names = categorizer.CATEGORY_NAMES
+    labels = np.array([names.index("Food & Dining"), names.index("Education")])
+    categories, best = categorizer.nearest_categories(matrix, np.array([2, 3, 4]), np.array([0, 1]), labels)
+    assert [names[c] for c in categories] == ["Food & Dining", "Education", "Other"]
+    assert best[0] == pytest.approx(0.9939, abs=1e-3)
+
+def test_run_labels_rule_misses_from_their_neighbours(db):
+    db.ingest_statement(make_statement([
+        tx("2024-03-02", "COSTCO WHOLESALE #123", 80.00),
+        tx("2024-03-03", "CINEPLEX ODEON 55", 14.50),
+        tx("2024-03-04", "ZZZ MYSTERY VENDOR", 9.00),
+        tx("2024-03-05", "SOBEYS #123", 45.10),
+    ]), "u1")
+    client = FakeEmbeddings()
+    result = categorizer.run(client=client)
+    assert result["merchants_scanned"] == 3
+    learned = _categories(db)
+    assert learned["COSTCO WHOLESALE"] == "Shopping & Groceries"
+    assert learned["CINEPLEX ODEON"] == "Entertainment"
+    assert learned["ZZZ MYSTERY VENDOR"] is None
+
+    conn = db.get_db_connection()
+    try:
+        daily = dict(conn.execute("SELECT category, spend_cents FROM daily_spend WHERE day = '2024-03-02'").fetchall())
+    finally:
+        conn.close()
+    assert daily == {"Shopping & Groceries": 8000}
+
+def test_seen_names_are_never_embedded_again(db):
+    db.ingest_statement(make_statement([tx("2024-03-02", "COSTCO WHOLESALE #123", 80.00)]), "u1")
+    client = FakeEmbeddings()
+    categorizer.run(client=client)
+    sent = sum(len(r) for r in client.requests)
+
+    rerun = categorizer.run(full=True, client=client)
+    assert rerun["merchants_scanned"] == 1
+    assert rerun["embedding_requests"] == 0 and sum(len(r) for r in client.requests) == sent
+
+    db.ingest_statement(make_statement([tx("2024-04-02", "CINEPLEX ODEON 55", 14.50)], statement_date="2024-04-30"),
+                        "u1")
+    categorizer.run(client=client)
+    assert client.requests[-1] == ["CINEPLEX ODEON"]
@@ -0,0 +1,49 @@
+"""Async wrappers over the SQLite access layer (db_async)"""
+import asyncio
+import inspect
+import threading
+
+import db_async
+import sqlite_db
+import subscriptions
+from conftest import make_statement, tx
+
+# sqlite_db functions that are helpers for other modules rather than endpoint queries
+HELPERS = {
+    "get_db_connection", "change_log_head", "change_log_watermark", "save_watermark", "changed_statement_ids",
+    "trim_change_log", "transaction_fingerprints", "promotion_fingerprints", "disclosure_fingerprints",
+    "transaction_dedup_keys", "duplicate_markers", "enqueue_outbox",
+}
+
+def _public_functions(module):
+    return {name: func for name, func in inspect.getmembers(module, inspect.isfunction)
+            if not name.startswith("_") and func.__module__ == module.__name__}
+
+def _wrappers():
+    return {name: func for name, func in _public_functions(db_async).items()
+            if inspect.iscoroutinefunction(func) and name != "run_db"}
+
+def test_every_query_has_an_async_wrapper():
+    assert set(_public_functions(sqlite_db)) - HELPERS - set(_wrappers()) == set()
+
+def _parameters(func):
+    return [(p.name, p.kind, p.default) for p in inspect.signature(func).parameters.values()]
+
+def test_wrappers_keep_the_parameters_they_mirror():
+    for name, wrapper in _wrappers().items():
+        target = getattr(sqlite_db, name, None) or getattr(subscriptions, name)
+        assert _parameters(wrapper) == _parameters(target), name
+
+def test_wrappers_run_on_the_db_pool_and_return_the_same_result(db):
+    db.ingest_statement(make_statement([tx("2024-03-02", "SOBEYS #123", 45.10)]), "u1")
+    seen = []
+
+    def probe():
+        seen.append(threading.current_thread().name)
+        return "ok"
+
+    async def calls():
+        return await db_async.run_db(probe), await db_async.search_transactions("sob")
+
+    assert asyncio.run(calls()) == ("ok", db.search_transactions("sob"))
+    assert seen[0].startswith("sqlite")
@@ -0,0 +1,134 @@
+"""Connection pool eviction and liveness checks (dbx_pool.ConnectionPool)"""
+import threading
+import time
+
+import pytest
+
+import dbx_pool
+
+class FakeConnection:
+    def __init__(self, hang: threading.Event = None):
+        self.hang = hang
+        self.closed = threading.Event()
+        self.pings = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed.set()
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql):
+        self.conn.pings += 1
+        if self.conn.closed.is_set():
+            raise RuntimeError("connection closed")
+        if self.conn.hang is not None:
+            self.conn.hang.wait(5)
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def opened():
+    return []
+
+def _pool(opened, factory=FakeConnection, **kwargs):
+    def connect():
+        conn = factory()
+        opened.append(conn)
+        return conn
+    kwargs.setdefault("acquire_timeout", 1)
+    return dbx_pool.ConnectionPool(connect, max_size=2, **kwargs)
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+def test_idle_connections_are_reused_then_evicted(opened):
+    pool = _pool(opened, idle_timeout=0.05)
+    with pool.connection():
+        pass
+    with pool.connection() as conn:
+        assert conn is opened[0]
+    time.sleep(0.1)
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert opened[0].closed.is_set()
+    metrics = pool.metrics()
+    assert (metrics["created"], metrics["reused"], metrics["evicted_idle"]) == (2, 1, 1)
+
+def test_failed_ping_replaces_the_connection(opened):
+    pool = _pool(opened, check_after=0)
+    with pool.connection():
+        pass
+    opened[0].close()
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert pool.metrics()["failed_checks"] == 1
+    assert pool.metrics()["open"] == 1
+
+def test_timed_out_ping_never_returns_the_connection(opened):
+    hang = threading.Event()
+    pool = _pool(opened, check_after=0, check_timeout=0.05)
+    with pool.connection():
+        pass
+    opened[0].hang = hang
+
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert not opened[0].closed.is_set()  # still in use by the ping
+    assert all(c is not opened[0] for c, _, _ in pool._idle)
+    hang.set()
+    assert _wait_until(opened[0].closed.is_set)
+    assert _wait_until(lambda: dbx_pool._hung_pings == 0)
+
+def test_check_discards_a_dead_connection(opened):
+    pool = _pool(opened)
+    with pool.connection():
+        pass
+    opened[0].close()
+    assert pool.check() is False
+    assert pool.metrics()["open"] == 0 and pool.metrics()["idle"] == 0
+    assert pool.check() is True
+    assert pool.metrics()["idle"] == 1
+
+def test_hung_pings_are_bounded(opened, monkeypatch):
+    monkeypatch.setattr(dbx_pool, "POOL_MAX_HUNG_PINGS", 1)
+    hang = threading.Event()
+    pool = _pool(opened, check_after=0, check_timeout=0.05)
+    with pool.connection():
+        pass
+    opened[0].hang = hang
+    with pool.connection():  # first ping hangs: opened[0] is replaced by opened[1]
+        pass
+    assert dbx_pool._hung_pings == 1
+
+    with pool.connection() as conn:  # no ping slot left: replaced without a ping
+        assert conn is opened[2]
+    assert opened[1].pings == 0 and opened[1].closed.is_set()
+    hang.set()
+    assert _wait_until(lambda: dbx_pool._hung_pings == 0)
+
+def test_counters_are_exact_under_concurrency(opened):
+    pool = _pool(opened)
+    def worker():
+        for _ in range(200):
+            with pool.connection():
+                pass
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics = pool.metrics()
+    assert metrics["created"] + metrics["reused"] == 1600
+    assert metrics["wait"]["count"] == 1000  # sample window
@@ -0,0 +1,64 @@
+"""Cross-statement duplicate detection (sqlite_db._register_duplicates)"""
+from conftest import make_statement, tx
+
+MARCH = [tx("2024-03-02", "SOBEYS #123", 45.10), tx("2024-03-05", "NETFLIX.COM", 16.99)]
+# Quarterly export of the same account: same purchases, new ref numbers
+QUARTER = [tx("2024-03-02", "SOBEYS #123", 45.10, ref="Q1"), tx("2024-03-20", "PRESTO", 3.30, ref="Q2")]
+
+def _query(db, sql, params=()):
+    conn = db.get_db_connection()
+    try:
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+def _duplicates(db):
+    return {(r["statement_id"], r["description"], r["dedup_key"]): r["canonical"] for r in _query(db, """
+        SELECT t.statement_id, t.description, t.dedup_key, c.statement_id AS canonical
+        FROM transactions t LEFT JOIN transactions c ON c.id = t.duplicate_of
+    """)}
+
+def test_overlapping_statement_points_at_the_earlier_copy(db):
+    march = db.ingest_statement(make_statement(MARCH), "u1")["statement_id"]
+    quarter = db.ingest_statement(make_statement(QUARTER, statement_date="2024-03-30"), "u1")["statement_id"]
+    flagged = {(sid, desc): canon for (sid, desc, _), canon in _duplicates(db).items() if canon}
+    assert flagged == {(quarter, "SOBEYS #123"): march}
+
+def test_removing_the_canonical_copy_promotes_the_next(db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    quarter = db.ingest_statement(make_statement(QUARTER, statement_date="2024-03-30"), "u1")["statement_id"]
+    db.ingest_statement(make_statement(MARCH[1:]), "u1")
+    assert not any(_duplicates(db).values())
+    sobeys = _query(db, "SELECT d.statement_id FROM transaction_dedup d JOIN transactions t "
+                        "ON t.id = d.transaction_id WHERE t.description = 'SOBEYS #123'")
+    assert sobeys == [{"statement_id": quarter}]
+
+def test_changed_dedup_key_drops_the_stale_entry(db):
+    # Two rides that differ only by ref number: distinct fingerprints, dedup keys K#0 and K#1
+    rides = [tx("2024-03-04", "UBER TRIP", 12.00, ref="A"), tx("2024-03-04", "UBER TRIP", 12.00, ref="B")]
+    db.ingest_statement(make_statement(rides), "u1")
+    kept_id = _query(db, "SELECT id FROM transactions WHERE ref_number = 'B'")[0]["id"]
+
+    # Dropping ride A keeps ride B's fingerprint (same id) but shifts its key to K#0
+    db.ingest_statement(make_statement(rides[1:]), "u1")
+    assert _query(db, "SELECT id FROM transactions")[0]["id"] == kept_id
+    entries = _query(db, "SELECT d.dedup_key, t.dedup_key AS row_key FROM transaction_dedup d "
+                         "JOIN transactions t ON t.id = d.transaction_id")
+    assert [e["dedup_key"] for e in entries] == [e["row_key"] for e in entries]
+    assert len(entries) == 1
+
+    # A later export with both rides: only the first matches the kept row
+    later = db.ingest_statement(make_statement(rides, statement_date="2024-03-30"), "u1")["statement_id"]
+    flagged = [desc for (sid, desc, _), canon in _duplicates(db).items() if sid == later and canon]
+    assert flagged == ["UBER TRIP"]
+
+def test_reingest_keeps_inserted_at_and_canonical_order(db):
+    march = db.ingest_statement(make_statement(MARCH), "u1")["statement_id"]
+    inserted_at = _query(db, "SELECT inserted_at FROM statements WHERE statement_id = ?", (march,))
+    db.ingest_statement(make_statement(QUARTER, statement_date="2024-03-30"), "u1")
+    db.ingest_statement(make_statement(MARCH), "u1")
+    assert _query(db, "SELECT inserted_at FROM statements WHERE statement_id = ?", (march,)) == inserted_at
+
+    before = _duplicates(db)
+    assert db.rebuild_dedup_index()["duplicates"] == 1
+    assert _duplicates(db) == before
@@ -0,0 +1,97 @@
+"""Persistent embeddings cache (DataExtractor.embeddingCache.CachedEmbeddings)"""
+import pytest
+
+from DataExtractor import embeddingCache
+from DataExtractor.embeddingCache import CachedEmbeddings
+
+class FakeClient:
+    """client.embeddings() stand-in: a text's vector is (0.1 * len(text), 0.1)"""
+
+    def __init__(self):
+        self.requests = []
+
+    def embeddings(self, model, input, **kwargs):
+        self.requests.append(list(input))
+        return {
+            "model": "fake-embed",
+            # Out of order on purpose: callers must sort by index
+            "data": [{"index": i, "embedding": [0.1 * len(text), 0.1]} for i, text in reversed(list(enumerate(input)))],
+            "usage": {"prompt_tokens": len(input)},
+        }
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000.0]
+    monkeypatch.setattr(embeddingCache.time, "time", lambda: now[0])
+    return now
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+def _cache(tmp_path, client, **kwargs):
+    return CachedEmbeddings(client, path=str(tmp_path / "embeddings.db"), **kwargs)
+
+def _vectors(response):
+    return [item["embedding"] for item in response["data"]]
+
+def test_duplicates_are_sent_once_and_answers_keep_input_order(tmp_path, client):
+    cache = _cache(tmp_path, client)
+    response = cache.embeddings(input=["  netflix   com", "netflix com", "uber"])
+    assert client.requests == [["netflix com", "uber"]]
+    assert _vectors(response)[0] == _vectors(response)[1]
+    assert _vectors(response)[2] == pytest.approx([0.4, 0.1])
+    assert response["cache"] == {"hits": 0, "misses": 2, "deduplicated": 1}
+
+def test_hits_and_misses_return_the_same_vector(tmp_path, client):
+    cache = _cache(tmp_path, client)
+    first = cache.embeddings(input="a")
+    second = cache.embeddings(input="a")
+    assert len(client.requests) == 1
+    assert _vectors(first) == _vectors(second)
+    assert second["cache"]["hits"] == 1
+    # A new process reads the same vectors back from disk
+    assert _vectors(_cache(tmp_path, client).embeddings(input="a")) == _vectors(first)
+
+def test_request_options_are_part_of_the_key(tmp_path, client):
+    cache = _cache(tmp_path, client)
+    cache.embeddings(input="a")
+    cache.embeddings(input="a", dimensions=8)
+    cache.embeddings(model="other", input="a")
+    assert len(client.requests) == 3
+
+def test_misses_are_split_into_even_batches(tmp_path, client):
+    cache = _cache(tmp_path, client, batch_size=2, max_workers=2)
+    texts = [f"text {i}" for i in range(5)]
+    response = cache.embeddings(input=texts)
+    assert sorted(len(chunk) for chunk in client.requests) == [1, 2, 2]
+    assert sorted(text for chunk in client.requests for text in chunk) == texts
+    assert _vectors(response) == [[pytest.approx(0.6), pytest.approx(0.1)]] * 5
+    assert response["usage"] == {"prompt_tokens": 5}
+
+def test_least_recently_used_vectors_are_evicted(tmp_path, client, clock):
+    # Each entry stores 8 vector bytes plus its 1-character text
+    cache = _cache(tmp_path, client, max_bytes=2 * 9)
+    for text in ("a", "b"):
+        clock[0] += 1
+        cache.embeddings(input=text)
+    clock[0] += 1
+    cache.embeddings(input="a")  # "b" is now the least recently used
+    clock[0] += 1
+    cache.embeddings(input="c")
+    assert cache.metrics()["evicted"] == 1 and cache.metrics()["entries"] == 2
+
+    client.requests.clear()
+    cache.embeddings(input=["a", "b", "c"])
+    assert client.requests == [["b"]]
+
+def test_metrics_report_hit_rate_and_bytes(tmp_path, client):
+    cache = _cache(tmp_path, client)
+    cache.embeddings(input=["a", "b"])
+    cache.embeddings(input=["a", "a", "c"])
+    metrics = cache.metrics()
+    assert (metrics["calls"], metrics["inputs"], metrics["hits"], metrics["misses"]) == (2, 5, 1, 3)
+    assert metrics["deduplicated"] == 1 and metrics["requests"] == 2
+    assert metrics["hit_rate"] == 0.25
+    assert metrics["entries"] == 3 and metrics["stored_bytes"] == 3 * 9
+    assert metrics["bytes_saved"] > 0 and metrics["bytes_fetched"] > 0
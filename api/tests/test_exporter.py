@@ -0,0 +1,57 @@
+"""Incremental Parquet export follows change_log (exporter.export_table_to_parquet)"""
+import pyarrow.dataset as ds
+
+import exporter
+from conftest import make_statement, tx
+
+TRANSACTIONS = [
+    tx("2024-02-28", "SOBEYS #123", 45.10),
+    tx("2024-03-05", "NETFLIX.COM", 16.99),
+    tx("2024-03-07", "TIM HORTONS", 2.10),
+]
+
+def _exported(export_dir, table="transactions"):
+    dataset = ds.dataset(str(export_dir / table), format="parquet", partitioning="hive")
+    return sorted(dataset.to_table().column("description" if table == "transactions" else "statement_id").to_pylist())
+
+def test_reupload_replaces_the_statements_rows(db, tmp_path):
+    export_dir = tmp_path / "exports"
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    first = exporter.export_table_to_parquet("transactions", str(export_dir))
+    assert first["full"] and first["files"] == 2  # February and March partitions
+    assert _exported(export_dir) == ["NETFLIX.COM", "SOBEYS #123", "TIM HORTONS"]
+
+    # The re-upload drops the only February row and one March row
+    db.ingest_statement(make_statement(TRANSACTIONS[2:] + [tx("2024-03-09", "PRESTO", 3.30)]), "u1")
+    second = exporter.export_table_to_parquet("transactions", str(export_dir))
+    assert not second["full"] and second["statements"] == 1
+    assert _exported(export_dir) == ["PRESTO", "TIM HORTONS"]
+    assert not list((export_dir / "transactions").rglob("month=2024-02/*.parquet"))
+
+def test_unchanged_run_writes_nothing(db, tmp_path):
+    export_dir = tmp_path / "exports"
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    exporter.export_to_parquet(str(export_dir))
+    db.ingest_statement(make_statement(TRANSACTIONS, statement_date="2024-04-30"), "u2")
+    result = exporter.export_to_parquet(str(export_dir))
+    assert [t["statements"] for t in result["tables"]] == [1, 1]
+    assert len(_exported(export_dir, "statements")) == 2
+    assert [t["statements"] for t in exporter.export_to_parquet(str(export_dir))["tables"]] == [0, 0]
+
+def _duplicate_flags(export_dir):
+    table = ds.dataset(str(export_dir / "transactions"), format="parquet", partitioning="hive").to_table()
+    return sorted(zip(table.column("statement_id").to_pylist(), table.column("description").to_pylist(),
+                      [d is not None for d in table.column("duplicate_of").to_pylist()]))
+
+def test_promoted_duplicate_reexports_the_other_statement(db, tmp_path):
+    export_dir = tmp_path / "exports"
+    march = db.ingest_statement(make_statement(TRANSACTIONS[:2]), "u1")["statement_id"]
+    quarter = db.ingest_statement(make_statement(TRANSACTIONS[:1], statement_date="2024-03-30"), "u1")["statement_id"]
+    exporter.export_table_to_parquet("transactions", str(export_dir))
+    assert (quarter, "SOBEYS #123", True) in _duplicate_flags(export_dir)
+
+    # Dropping the canonical copy from March promotes the quarter's row
+    db.ingest_statement(make_statement(TRANSACTIONS[1:2]), "u1")
+    result = exporter.export_table_to_parquet("transactions", str(export_dir))
+    assert not result["full"] and result["statements"] == 2
+    assert _duplicate_flags(export_dir) == sorted([(march, "NETFLIX.COM", False), (quarter, "SOBEYS #123", False)])
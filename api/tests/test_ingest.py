@@ -0,0 +1,57 @@
+"""Statement re-ingest: child rows are diffed by fingerprint (sqlite_db.ingest_statement)"""
+from conftest import make_statement, tx
+
+TRANSACTIONS = [
+    tx("2024-03-02", "SOBEYS #123", 45.10),
+    tx("2024-03-05", "NETFLIX.COM", 16.99),
+    tx("2024-03-07", "TIM HORTONS", 2.10),
+    tx("2024-03-07", "TIM HORTONS", 2.10),  # same purchase twice in one day
+]
+
+def _rows(db, table="transactions"):
+    conn = db.get_db_connection()
+    try:
+        return {row["fingerprint"]: dict(row) for row in conn.execute(f"SELECT * FROM {table}")}
+    finally:
+        conn.close()
+
+def test_first_ingest_inserts_every_row(db):
+    result = db.ingest_statement(make_statement(TRANSACTIONS, promotions=[{"description": "0% BT", "rate": "0%"}],
+                                                disclosures=["Interest applies"]), "u1")
+    assert result["changes"]["transactions"] == {"inserted": 4, "updated": 0, "deleted": 0, "unchanged": 0}
+    assert result["changes"]["promotions"]["inserted"] == 1
+    assert result["changes"]["disclosures"]["inserted"] == 1
+    # Identical rows still get distinct fingerprints
+    assert len(_rows(db)) == 4
+
+def test_unchanged_reingest_touches_nothing(db):
+    statement = make_statement(TRANSACTIONS)
+    db.ingest_statement(statement, "u1")
+    before = _rows(db)
+    result = db.ingest_statement(statement, "u1")
+    assert result["changes"]["transactions"] == {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 4}
+    assert {fp: row["id"] for fp, row in _rows(db).items()} == {fp: row["id"] for fp, row in before.items()}
+
+def test_changed_reingest_applies_only_the_difference(db):
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    before = _rows(db)
+    changed = [dict(t) for t in TRANSACTIONS]
+    changed[0]["location"] = "Guelph, ON"           # value column: updated in place
+    del changed[1]                                   # dropped: deleted
+    changed.append(tx("2024-03-09", "PRESTO", 3.30))  # new: inserted
+    result = db.ingest_statement(make_statement(changed), "u1")
+
+    assert result["statement_id"] == db._make_statement_id(make_statement(changed), "u1")
+    assert result["changes"]["transactions"] == {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 2}
+    after = _rows(db)
+    assert len(after) == 4
+    updated = next(row for row in after.values() if row["description"] == "SOBEYS #123")
+    assert updated["location"] == "Guelph, ON"
+    assert updated["id"] == next(row["id"] for row in before.values() if row["description"] == "SOBEYS #123")
+    assert not any(row["description"] == "NETFLIX.COM" for row in after.values())
+
+def test_reingest_with_no_transactions_clears_them(db):
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    result = db.ingest_statement(make_statement([]), "u1")
+    assert result["changes"]["transactions"]["deleted"] == 4
+    assert _rows(db) == {}
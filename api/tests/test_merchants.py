@@ -0,0 +1,70 @@
+"""Merchant dictionary: description normalization, fuzzy matching and backfill (merchants)"""
+import merchants
+from conftest import make_statement, tx
+from merchants import MerchantResolver, core_name, normalize_description, trigrams
+
+UBER = ["UBER* TRIP", "UBER CANADA/UBEREATS", "UBER *EATS PENDING", "Uber Eats"]
+
+def test_normalize_description_ignores_case_punctuation_and_spacing():
+    assert normalize_description("Sobeys #934") == normalize_description("SOBEYS  #934 ") == "SOBEYS 934"
+    assert normalize_description("UBER CANADA/UBEREATS") == "UBER CANADA UBEREATS"
+    assert normalize_description(None) == ""
+
+def test_core_name_drops_codes_noise_words_and_extra_words():
+    assert core_name("SOBEYS #934") == core_name("SOBEYS 1021") == "SOBEYS"
+    assert core_name("HARVEY'S #123") == "HARVEYS"
+    assert core_name("UBER *EATS PENDING") == "UBER EATS"
+    assert core_name("AMZN MKTP CA WWW AMAZON CA") == "AMZN MKTP AMAZON"
+    # A description of nothing but codes keeps its first token
+    assert core_name("12345 678") == "12345"
+
+def test_trigrams_are_word_padded():
+    assert trigrams("UBER") == {" UB", "UBE", "BER", "ER "}
+    assert trigrams("") == frozenset()
+
+def _resolve(db, descriptions):
+    conn = db.get_db_connection()
+    try:
+        ids = MerchantResolver(conn.cursor()).resolve_many(descriptions)
+        conn.commit()
+        return ids, merchants.merchant_names(conn.cursor(), [i for i in ids if i is not None])
+    finally:
+        conn.close()
+
+def test_uber_variants_resolve_to_one_merchant(db):
+    ids, names = _resolve(db, UBER)
+    assert len(set(ids)) == 1
+    # The shortest spelling becomes the display name
+    assert names[ids[0]] == "UBER"
+
+def test_guelph_institutions_stay_separate(db):
+    ids, names = _resolve(db, ["UNIV OF GUELPH", "CITY OF GUELPH", "UNIV OF GUELPH #2"])
+    assert ids[0] == ids[2] != ids[1]
+    assert sorted(names.values()) == ["CITY OF GUELPH", "UNIV OF GUELPH"]
+
+def test_close_spellings_match_through_the_trigram_index(db):
+    ids, _ = _resolve(db, ["WALMART SUPERCENTRE", "WALMART SUPERCENTR", "WALGREENS"])
+    assert ids[0] == ids[1] != ids[2]
+
+def test_committed_aliases_are_served_from_the_lru(db):
+    ids, _ = _resolve(db, ["SOBEYS #934"])
+    assert merchants.cache_info()["aliases"] == 0  # created aliases wait for the commit
+    assert _resolve(db, ["SOBEYS #934"])[0] == ids
+    assert merchants.cache_info()["aliases"] == 1
+    assert _resolve(db, [None, ""])[0] == [None, None]
+
+def test_backfill_assigns_rows_without_a_merchant(db):
+    db.ingest_statement(make_statement([tx(f"2024-03-{i + 1:02d}", d, 10.00) for i, d in enumerate(UBER)]
+                                       + [tx("2024-03-09", "CITY OF GUELPH", 80.00)]), "u1")
+    conn = db.get_db_connection()
+    try:
+        assigned = dict(conn.execute("SELECT id, merchant_id FROM transactions").fetchall())
+        conn.execute("UPDATE transactions SET merchant_id = NULL")
+        conn.commit()
+        merchants.cache_clear()
+        result = merchants.backfill(conn, batch_size=2)
+        assert result == {"transactions_updated": 5, "merchants": 2}
+        assert dict(conn.execute("SELECT id, merchant_id FROM transactions").fetchall()) == assigned
+        assert merchants.backfill(conn)["transactions_updated"] == 0
+    finally:
+        conn.close()
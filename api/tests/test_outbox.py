@@ -0,0 +1,134 @@
+"""Outbox delivery: per-entry retry, backoff, dead-lettering and pruning (outbox.py)"""
+import json
+
+import pytest
+
+import outbox
+from conftest import make_statement, tx
+
+KIND = "test_kind"
+
+def _enqueue(db, *payloads, entity_key=None):
+    conn = db.get_db_connection()
+    try:
+        ids = [db.enqueue_outbox(conn.cursor(), KIND, payload, entity_key) for payload in payloads]
+        conn.commit()
+        return ids
+    finally:
+        conn.close()
+
+def _rows(db):
+    conn = db.get_db_connection()
+    try:
+        return {row["id"]: dict(row) for row in conn.execute("SELECT * FROM outbox WHERE kind = ?", (KIND,))}
+    finally:
+        conn.close()
+
+def _make_due(db):
+    conn = db.get_db_connection()
+    try:
+        conn.execute("UPDATE outbox SET next_attempt_at = '2000-01-01'")
+        conn.commit()
+    finally:
+        conn.close()
+
+class Destination:
+    """ship() callback that rejects payloads marked bad, or everything when down"""
+
+    def __init__(self):
+        self.down = False
+        self.shipped = []
+        self.calls = 0
+
+    def __call__(self, entries):
+        self.calls += 1
+        payloads = [json.loads(entry["payload"]) for entry in entries]
+        if self.down or any(p.get("bad") for p in payloads):
+            raise RuntimeError("rejected")
+        self.shipped += [p["n"] for p in payloads]
+
+@pytest.fixture
+def destination():
+    return Destination()
+
+def test_bad_payload_only_backs_off_itself(db, destination):
+    ids = _enqueue(db, {"n": 1}, {"n": 2, "bad": True}, {"n": 3})
+    shipper = outbox.OutboxShipper(kind=KIND, ship=destination)
+    assert shipper.run_once() == 2
+    assert destination.shipped == [1, 3]
+    rows = _rows(db)
+    assert rows[ids[1]]["delivered_at"] is None and rows[ids[1]]["attempts"] == 1
+    assert rows[ids[1]]["next_attempt_at"] > rows[ids[1]]["created_at"]
+    assert all(rows[i]["delivered_at"] and rows[i]["attempts"] == 1 for i in (ids[0], ids[2]))
+
+def test_entry_is_dead_lettered_after_max_attempts(db, destination, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    (bad,) = _enqueue(db, {"n": 1, "bad": True})
+    shipper = outbox.OutboxShipper(kind=KIND, ship=destination)
+    for _ in range(5):
+        _make_due(db)
+        shipper.run_once()
+    assert _rows(db)[bad]["attempts"] == 3
+    assert _rows(db)[bad]["dead_at"] is not None
+    assert outbox.get_outbox_status()[KIND]["dead"] == 1
+    assert outbox.get_outbox_status()[KIND]["pending"] == 0
+
+    assert outbox.requeue_dead_letters(KIND) == 1
+    assert _rows(db)[bad]["dead_at"] is None and _rows(db)[bad]["attempts"] == 0
+
+def test_outage_charges_only_the_probed_entries(db, destination):
+    ids = _enqueue(db, *({"n": n} for n in range(6)))
+    destination.down = True
+    shipper = outbox.OutboxShipper(kind=KIND, ship=destination)
+    assert shipper.run_once() == 0
+    assert destination.calls == 3  # the batch, then two single entries
+    attempts = [_rows(db)[i]["attempts"] for i in ids]
+    assert attempts == [1, 1, 0, 0, 0, 0]
+    # Deferred, not left due: the next run ships nothing until the backoff passes
+    destination.down = False
+    assert shipper.run_once() == 0
+
+    _make_due(db)
+    assert shipper.run_once() == 6
+    assert destination.shipped[:4] == [2, 3, 4, 5]  # uncharged entries go first
+
+def test_delivered_entries_are_pruned(db, destination):
+    _enqueue(db, {"n": 1}, {"n": 2})
+    shipper = outbox.OutboxShipper(kind=KIND, ship=destination)
+    shipper.run_once()
+    assert len(_rows(db)) == 2
+    conn = db.get_db_connection()
+    try:
+        conn.execute("UPDATE outbox SET delivered_at = '2000-01-01'")
+        conn.commit()
+    finally:
+        conn.close()
+    shipper.run_once()
+    assert _rows(db) == {}
+
+def test_newer_entry_supersedes_an_undelivered_one(db):
+    _enqueue(db, {"n": 1}, entity_key="s1")
+    (newer,) = _enqueue(db, {"n": 2}, entity_key="s1")
+    _enqueue(db, {"n": 3}, entity_key="s2")
+    assert sorted(_rows(db)) == [newer, newer + 1]
+
+def test_emptied_statement_deletes_its_warehouse_rows(db, warehouse):
+    statement = make_statement([tx("2024-03-02", "SOBEYS #123", 45.10)], disclosures=["Interest applies"])
+    entry = {"id": 1, "attempts": 0}
+    outbox.ship_databricks_batch([dict(entry, payload=json.dumps({"statement": statement, "user_id": "u1"}))])
+    statement["transactions"] = []
+    outbox.ship_databricks_batch([dict(entry, payload=json.dumps({"statement": statement, "user_id": "u1"}))])
+    with warehouse.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM finance.transactions")
+        assert cur.fetchone()[0] == 0
+        cur.execute("SELECT COUNT(*) FROM finance.disclosures")
+        assert cur.fetchone()[0] == 1
+
+def test_delivered_batch_invalidates_the_analytics_cache(db, warehouse):
+    from databricks_viz import databricks_viz
+    databricks_viz._analytics_cache = (float("inf"), {"stale": True})
+    statement = make_statement([tx("2024-03-02", "SOBEYS #123", 45.10)])
+    outbox.ship_databricks_batch([{"id": 1, "attempts": 0,
+                                   "payload": json.dumps({"statement": statement, "user_id": "u1"})}])
+    assert databricks_viz._analytics_cache is None
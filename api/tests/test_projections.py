@@ -0,0 +1,126 @@
+"""Monte Carlo savings projections (projections.simulate / project)"""
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+import projections
+
+def _annuity_factor(rate, months):
+    return ((1 + rate) ** months - 1) / rate
+
+def test_mean_path_matches_the_closed_form_annuity():
+    annual_return, _ = projections.PORTFOLIOS["balanced"]
+    simulation = projections.simulate("balanced", 60, paths=20_000)
+    assert simulation.annuity[:, -1].mean() == pytest.approx(_annuity_factor(annual_return / 12, 60), rel=0.01)
+    assert simulation.lump[:, -1].mean() == pytest.approx((1 + annual_return / 12) ** 60, rel=0.01)
+
+def test_simulation_is_deterministic_per_profile_and_horizon():
+    first = projections.simulate("growth", 24, paths=1_000)
+    second = projections.simulate("growth", 24, paths=1_000)
+    assert np.array_equal(first.annuity, second.annuity) and np.array_equal(first.lump, second.lump)
+    assert not np.array_equal(first.lump, projections.simulate("income", 24, paths=1_000).lump)
+
+def test_cached_simulations_keep_only_the_checkpoint_factors():
+    simulation = projections.simulate("growth", 240, paths=100)
+    arrays = [value for value in vars(simulation).values() if isinstance(value, np.ndarray)]
+    # 21 checkpoints (0, 12 ... 240) instead of 240 monthly returns per path
+    assert max(a.shape[-1] for a in arrays) == 21
+    assert sum(a.nbytes for a in arrays) < 100 * 240 * 4
+
+def test_checkpoints_include_a_partial_final_year():
+    assert list(projections._checkpoints(30)) == [0, 12, 24, 30]
+    simulation = projections.simulate("balanced", 30, paths=10)
+    assert simulation.annuity.shape == (10, 4)
+    assert np.all(simulation.annuity[:, 0] == 0)
+    assert np.all(simulation.lump[:, 0] == 1)
+
+def test_project_bands_are_ordered_and_scale_with_contributions():
+    result = projections.project("moderate", 1_000, 60, initial=5_000, target=80_000)
+    assert result["portfolio_type"] == "balanced"
+    assert result["p10"] < result["p50"] < result["p90"]
+    assert [year["month"] for year in result["by_year"]] == [12, 24, 36, 48, 60]
+    assert 0 < result["probability_of_target"] < 1
+
+    doubled = projections.project("moderate", 2_000, 60, initial=10_000)
+    assert doubled["p50"] == pytest.approx(2 * result["p50"], rel=1e-6)
+    assert "probability_of_target" not in doubled
+
+def test_riskier_profiles_have_wider_bands():
+    calm = projections.project("very-conservative", 500, 120)
+    wild = projections.project("very-aggressive", 500, 120)
+    assert wild["p90"] - wild["p10"] > calm["p90"] - calm["p10"]
+
+def test_unknown_tolerance_falls_back_to_moderate():
+    assert projections.portfolio_for("yolo")[0] == "balanced"
+
+def test_horizon_and_portfolio_validation():
+    with pytest.raises(ValueError):
+        projections.get_simulation("balanced", projections.PROJECTION_MAX_MONTHS + 1)
+    with pytest.raises(ValueError):
+        projections.get_simulation("balanced", 0)
+    with pytest.raises(ValueError):
+        projections.get_simulation("crypto", 12)
+
+def test_simulation_cache_is_bounded_lru(monkeypatch):
+    monkeypatch.setattr(projections, "PROJECTION_CACHE_SIZE", 2)
+    monkeypatch.setattr(projections, "_cache", OrderedDict())
+    first = projections.get_simulation("income", 12)
+    assert projections.get_simulation("income", 12) is first
+    projections.get_simulation("income", 13)
+    projections.get_simulation("income", 12)
+    projections.get_simulation("income", 14)
+    assert list(projections._cache) == [("income", 12), ("income", 14)]
+
+# --------------------------
+# Scenario grid
+# --------------------------
+def _scalar_scenario(income, rent, cut, horizon, risk, target):
+    rate = projections.PORTFOLIOS[projections.RISK_PROFILES[risk]][0] / 12
+    savings = max(income * (1 - projections.CREDIT_CARD_SHARE) - rent + cut, 0)
+    months = 0
+    if savings <= 0:
+        months = -1
+    else:
+        while savings * _annuity_factor(rate, months) < target:
+            months += 1
+    return savings, savings * _annuity_factor(rate, horizon), months
+
+def test_expand_range_is_inclusive_and_rounded():
+    assert projections.expand_range(0.1, 0.5, 0.1) == [0.1, 0.2, 0.3, 0.4, 0.5]
+    assert projections.expand_range(1000, 1250, 100) == [1000, 1100, 1200]
+    with pytest.raises(ValueError):
+        projections.expand_range(0, 10, 0)
+    with pytest.raises(ValueError):
+        projections.expand_range(10, 0, 1)
+
+def test_grid_cells_match_the_scalar_calculation():
+    axes = ([4000, 6000], [1500, 2500, 5200], [0, 250], [12, 60], ["very-conservative", "moderate", "very-aggressive"])
+    grid = projections.scenario_grid(*axes, target=20_000)
+    assert grid["shape"] == [2, 3, 2, 2, 3]
+    assert grid["cells"] == 72
+    for index in np.ndindex(*grid["shape"]):
+        income, rent, cut, horizon, risk = (axis[i] for axis, i in zip(axes, index))
+        savings, projected, months = _scalar_scenario(income, rent, cut, horizon, risk, 20_000)
+        assert grid["monthly_savings"][index] == pytest.approx(savings, abs=0.01)
+        assert grid["projected_value"][index] == pytest.approx(projected, abs=0.01)
+        assert grid["months_to_target"][index] == months
+        assert grid["reaches_target_in_horizon"][index] == (0 <= months <= horizon)
+
+def test_grid_without_savings_never_reaches_the_target():
+    grid = projections.scenario_grid([1000], [5000], [0], [600], ["moderate"], target=1)
+    assert grid["monthly_savings"].item() == 0
+    assert grid["projected_value"].item() == 0
+    assert grid["months_to_target"].item() == -1
+    assert not grid["reaches_target_in_horizon"].item()
+
+def test_grid_validation(monkeypatch):
+    with pytest.raises(ValueError, match="Unknown risk tolerance"):
+        projections.scenario_grid([5000], [1000], [0], [12], ["yolo"], target=0)
+    with pytest.raises(ValueError):
+        projections.scenario_grid([5000], [1000], [0], [0], ["moderate"], target=0)
+    with pytest.raises(ValueError):
+        projections.scenario_grid([], [1000], [0], [12], ["moderate"], target=0)
+    monkeypatch.setattr(projections, "SCENARIO_MAX_CELLS", 4)
+    with pytest.raises(ValueError, match="more than 4"):
+        projections.scenario_grid([1, 2, 3], [1, 2], [0], [12], ["moderate"], target=0)
@@ -0,0 +1,130 @@
+"""Pre-provisioned RBC sandbox clients (rbc_service.ClientPool)"""
+import threading
+import time
+
+import pytest
+
+from rbc_service import ClientPool, PooledClient
+
+class FakeRBC:
+    """InvestEasyAPI stand-in whose portfolios lose `fee` on every transfer"""
+
+    def __init__(self, fee=0.0, echo_value=True):
+        self.fee = fee
+        self.echo_value = echo_value
+        self.values = {}
+        self.calls = []
+        self.deleted = []
+        self.fail_reads = False
+        self.provisioning = threading.Event()
+        self.provisioning.set()
+
+    def create_client(self, name, email, cash):
+        self.provisioning.wait(5)
+        return {"id": f"client-{len(self.calls)}-{name}"}
+
+    def create_portfolio(self, client_id, portfolio_type, initial_amount):
+        portfolio_id = f"{client_id}/{portfolio_type}"
+        self.values[portfolio_id] = initial_amount
+        return {"id": portfolio_id, "current_value": initial_amount}
+
+    def _write(self, portfolio_id, change):
+        self.values[portfolio_id] += change
+        if not self.echo_value:
+            return {"ok": True}
+        return {"portfolio": {"id": portfolio_id, "current_value": self.values[portfolio_id]}}
+
+    def transfer_to_portfolio(self, portfolio_id, amount):
+        self.calls.append(("transfer", amount))
+        return self._write(portfolio_id, amount - self.fee)
+
+    def withdraw_from_portfolio(self, portfolio_id, amount):
+        self.calls.append(("withdraw", amount))
+        return self._write(portfolio_id, -amount)
+
+    def get_portfolio(self, portfolio_id):
+        self.calls.append(("get", portfolio_id))
+        if self.fail_reads:
+            raise ConnectionError("RBC unreachable")
+        return {"id": portfolio_id, "current_value": self.values[portfolio_id]}
+
+    def deposit_to_client(self, client_id, amount):
+        self.calls.append(("deposit", amount))
+
+    def delete_client(self, client_id):
+        self.deleted.append(client_id)
+
+def _client(api, client_id="c1", value=100.0):
+    pooled = PooledClient(client_id=client_id, cash=1_000_000)
+    pooled.portfolios["balanced"] = {"id": f"{client_id}/balanced", "current_value": value}
+    api.values[f"{client_id}/balanced"] = value
+    return pooled
+
+def test_reset_reports_the_value_rbc_returns():
+    api = FakeRBC(fee=5.0)
+    pool = ClientPool(api, size=0)
+    pooled = _client(api)
+    result = pool.reset(pooled, "balanced", 1_000)
+    assert api.calls == [("transfer", 900)]
+    assert result["current_value"] == 995
+    assert pooled.portfolios["balanced"]["current_value"] == 995
+
+def test_reset_reads_back_when_the_write_response_has_no_value():
+    api = FakeRBC(fee=5.0, echo_value=False)
+    pool = ClientPool(api, size=0)
+    pooled = _client(api)
+    result = pool.reset(pooled, "balanced", 1_000)
+    assert api.calls == [("transfer", 900), ("get", "c1/balanced")]
+    assert result["current_value"] == 995 and result["calls"] == 2
+
+    api.calls.clear()
+    assert pool.reset(pooled, "balanced", 995)["calls"] == 0
+
+def test_failed_read_back_is_retried_on_the_next_reset():
+    api = FakeRBC(echo_value=False)
+    pool = ClientPool(api, size=0)
+    pooled = _client(api)
+    api.fail_reads = True
+    with pytest.raises(ConnectionError):
+        pool.reset(pooled, "balanced", 400)
+    assert pooled.portfolios["balanced"]["current_value"] is None
+
+    api.fail_reads = False
+    api.calls.clear()
+    result = pool.reset(pooled, "balanced", 300)
+    assert api.calls == [("get", "c1/balanced"), ("withdraw", 100), ("get", "c1/balanced")]
+    assert result["current_value"] == 300
+
+def test_release_never_grows_the_idle_queue_past_size():
+    api = FakeRBC()
+    pool = ClientPool(api, size=1, max_users=1)
+    first, second, third = (_client(api, f"c{i}") for i in range(3))
+    for pooled in (first, second, third):
+        pool._owned[pooled.client_id] = pooled
+    pool.release(first, "alice")
+    pool.release(second, "bob")      # alice's client goes idle
+    pool.release(third, "carol")     # bob's client has no room left
+    assert list(pool._idle) == [first]
+    assert api.deleted == ["c1"]
+    metrics = pool.metrics()
+    assert metrics["idle"] == 1 and metrics["bound_to_users"] == 1 and metrics["surplus"] == 1
+
+def test_replenish_drops_a_client_released_clients_made_redundant():
+    api = FakeRBC()
+    pool = ClientPool(api, size=1, max_users=1)
+    api.provisioning.clear()
+    pool.start()
+    try:
+        # While the pool provisions its one client, release() refills the idle queue
+        first, second = _client(api, "c0"), _client(api, "c1")
+        pool._owned.update({"c0": first, "c1": second})
+        pool.release(first, "alice")
+        pool.release(second, "bob")
+        api.provisioning.set()
+        deadline = time.time() + 5
+        while not api.deleted and time.time() < deadline:
+            time.sleep(0.01)
+        assert list(pool._idle) == [first]
+        assert len(api.deleted) == 1 and api.deleted[0].startswith("client-")
+    finally:
+        pool.stop()
@@ -0,0 +1,122 @@
+"""Per-endpoint circuit breakers and read cache of the RBC wrapper (rbcAPIWrapper)"""
+import pytest
+import requests
+
+import rbcAPIWrapper
+from rbcAPIWrapper import CircuitBreaker, CircuitOpenError, InvestEasyAPI
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000.0]
+    monkeypatch.setattr(rbcAPIWrapper.time, "time", lambda: now[0])
+    return now
+
+def _opened(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(False, 0.1)
+    assert breaker.state == "open"
+    clock[0] += 30
+    return breaker
+
+def test_breaker_opens_after_consecutive_failures_and_rejects(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record(False, 0.1)
+    breaker.record(True, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.state == "closed"
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+    clock[0] += 29
+    assert not breaker.allow()
+    assert breaker.metrics()["rejected"] == 1 and breaker.metrics()["opened"] == 1
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = _opened(clock)
+    assert breaker.allow()
+    assert breaker.state == "half-open"
+    assert not breaker.allow()
+
+def test_successful_trial_closes(clock):
+    breaker = _opened(clock)
+    breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == "closed" and breaker.failures == 0
+
+def test_failed_trial_reopens(clock):
+    breaker = _opened(clock)
+    breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+def test_client_error_trial_stays_half_open(clock):
+    breaker = _opened(clock)
+    breaker.allow()
+    breaker.record_client_error(0.1)
+    assert breaker.state == "half-open"
+    # The trial slot is free again for the next caller
+    assert breaker.allow()
+    assert not breaker.allow()
+
+class FakeResponse:
+    def __init__(self, status, body=None):
+        self.status_code = status
+        self.body = body or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}", response=self)
+
+    def json(self):
+        return self.body
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        return self.responses.pop(0)
+
+def test_request_keeps_the_breaker_half_open_on_a_4xx_trial(clock):
+    api = InvestEasyAPI(failure_threshold=1, reset_timeout=30)
+    api.session = FakeSession(FakeResponse(503), FakeResponse(404), FakeResponse(200, {"id": "p1"}))
+    with pytest.raises(requests.HTTPError):
+        api.get_portfolio("p1")
+    with pytest.raises(CircuitOpenError):
+        api.get_portfolio("p1")
+    clock[0] += 30
+    with pytest.raises(requests.HTTPError):
+        api.get_portfolio("p1")
+    assert api.metrics()["endpoints"]["portfolios"]["state"] == "half-open"
+    assert api.get_portfolio("p1") == {"id": "p1"}
+    assert api.metrics()["endpoints"]["portfolios"]["state"] == "closed"
+
+def test_cached_reads_are_copies(clock):
+    api = InvestEasyAPI()
+    api.session = FakeSession(FakeResponse(200, {"id": "p1", "holdings": [{"symbol": "XIU"}]}))
+    first = api.get_portfolio("p1")
+    first["holdings"].append({"symbol": "VFV"})
+    first["current_value"] = 0
+    second = api.get_portfolio("p1")
+    assert second == {"id": "p1", "holdings": [{"symbol": "XIU"}]}
+    second["holdings"].clear()
+    assert api.get_portfolio("p1")["holdings"] == [{"symbol": "XIU"}]
+    assert api.session.requests == 1
+    assert api.metrics()["cache"]["hits"] == 2
+
+def test_portfolio_writes_drop_cached_simulations(clock):
+    api = InvestEasyAPI()
+    api.session = FakeSession(
+        FakeResponse(200, {"projected": 100}), FakeResponse(200, {"id": "p1"}), FakeResponse(200, {"projected": 250}),
+        FakeResponse(200, {"id": "p1"}), FakeResponse(200, {"projected": 40}),
+    )
+    assert api.simulate_client("c1", 12) == {"projected": 100}
+    api.transfer_to_portfolio("p1", 150)
+    assert api.simulate_client("c1", 12) == {"projected": 250}
+    api.withdraw_from_portfolio("p1", 210)
+    assert api.simulate_client("c1", 12) == {"projected": 40}
+    assert api.session.requests == 5
@@ -0,0 +1,69 @@
+"""Full-text transaction search (sqlite_db.search_transactions)"""
+from conftest import make_statement, tx
+
+MARCH = [
+    tx("2024-03-02", "SOBEYS #123", 45.10),
+    tx("2024-03-05", "NETFLIX.COM", 16.99, location="Los Gatos, CA"),
+    tx("2024-03-09", "UBER CANADA/UBERTRIP", 23.40),
+    tx("2024-03-12", "UBER EATS", 31.75),
+    tx("2024-03-20", "PAYMENT SCOTIABANK", -200.00),
+]
+
+def _descriptions(result):
+    return sorted(r["description"] for r in result["transactions"])
+
+def test_terms_match_as_prefixes_of_description_and_location(db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    assert _descriptions(db.search_transactions("sob")) == ["SOBEYS #123"]
+    assert _descriptions(db.search_transactions("netf com")) == ["NETFLIX.COM"]
+    assert _descriptions(db.search_transactions("gatos")) == ["NETFLIX.COM"]
+    assert _descriptions(db.search_transactions("ub")) == ["UBER CANADA/UBERTRIP", "UBER EATS"]
+    assert _descriptions(db.search_transactions("scotiabank")) == []
+    assert db.search_transactions("  !! ")["transactions"] == []
+
+def test_filters_narrow_the_matches(db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    assert _descriptions(db.search_transactions("uber", start="2024-03-10")) == ["UBER EATS"]
+    assert _descriptions(db.search_transactions("uber", end="2024-03-10")) == ["UBER CANADA/UBERTRIP"]
+    assert _descriptions(db.search_transactions("uber", min_amount=30)) == ["UBER EATS"]
+    assert _descriptions(db.search_transactions("uber", max_amount=30)) == ["UBER CANADA/UBERTRIP"]
+
+def test_duplicates_from_overlapping_statements_are_found_once(db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    db.ingest_statement(make_statement(MARCH[:1], statement_date="2024-03-30"), "u1")
+    assert len(db.search_transactions("sobeys")["transactions"]) == 1
+
+def test_pages_walk_every_match(db):
+    db.ingest_statement(make_statement([tx(f"2024-03-{d:02d}", f"PRESTO FARE {d}", 3.30) for d in range(1, 6)]), "u1")
+    first = db.search_transactions("presto", limit=2)
+    second = db.search_transactions("presto", limit=2, offset=2)
+    last = db.search_transactions("presto", limit=2, offset=4)
+    assert first["has_more"] and second["has_more"] and not last["has_more"]
+    ids = [r["id"] for page in (first, second, last) for r in page["transactions"]]
+    assert len(ids) == len(set(ids)) == 5
+    assert not first["truncated"] and first["candidates"] == 5
+
+def test_matches_past_the_candidate_window_are_reported(db, monkeypatch):
+    monkeypatch.setattr(db, "SEARCH_CANDIDATES", 3)
+    db.ingest_statement(make_statement([tx(f"2024-03-{d:02d}", f"PRESTO FARE {d}", 3.30) for d in range(1, 6)]), "u1")
+    result = db.search_transactions("presto", limit=2)
+    assert result["truncated"] and result["candidates"] == 3
+    assert all(r["description"] != "PRESTO FARE 1" for r in result["transactions"])
+    # Paging past the window widens it instead of dropping rows
+    assert db.search_transactions("presto", limit=2, offset=4)["candidates"] == 5
+
+def test_index_follows_updates_and_deletes(db):
+    db.ingest_statement(make_statement(MARCH), "u1")
+    conn = db.get_db_connection()
+    try:
+        conn.execute("UPDATE transactions SET description = 'FRESHCO #9' WHERE description = 'SOBEYS #123'")
+        conn.commit()
+    finally:
+        conn.close()
+    assert db.search_transactions("sobeys")["transactions"] == []
+    assert _descriptions(db.search_transactions("fresh")) == ["FRESHCO #9"]
+
+    # Re-uploading the statement without the Uber rows deletes them
+    db.ingest_statement(make_statement(MARCH[:2]), "u1")
+    assert db.search_transactions("uber")["transactions"] == []
+    assert _descriptions(db.search_transactions("netflix")) == ["NETFLIX.COM"]
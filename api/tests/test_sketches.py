@@ -0,0 +1,68 @@
+"""Accuracy of the mergeable spending sketches (sketches.TDigest / HyperLogLog)"""
+import numpy as np
+import pytest
+
+from sketches import CategorySketch, HyperLogLog, TDigest
+
+@pytest.fixture
+def amounts():
+    return np.random.default_rng(45).lognormal(mean=3.5, sigma=1.0, size=20_000)
+
+def _rank_error(values, estimate, q):
+    return abs(np.mean(values <= estimate) - q)
+
+@pytest.mark.parametrize("q", [0.01, 0.25, 0.5, 0.9, 0.95, 0.99])
+def test_tdigest_quantiles_within_half_a_percent_of_rank(amounts, q):
+    digest = TDigest()
+    for x in amounts:
+        digest.add(x)
+    assert _rank_error(amounts, digest.quantile(q), q) < 0.005
+
+def test_tdigest_merge_and_round_trip_keep_accuracy(amounts):
+    merged = TDigest()
+    for part in np.array_split(amounts, 16):
+        digest = TDigest()
+        for x in part:
+            digest.add(x)
+        merged.merge(TDigest.from_bytes(digest.to_bytes()))
+    assert merged.count == len(amounts)
+    assert len(merged.means) <= 2 * merged.compression
+    for q in (0.5, 0.95):
+        assert _rank_error(amounts, merged.quantile(q), q) < 0.005
+
+def test_tdigest_is_exact_for_small_sets():
+    values = [12.5, 3.0, 45.1, 8.25, 19.99]
+    digest = TDigest()
+    for x in values:
+        digest.add(x)
+    for q in (0.0, 0.5, 0.95, 1.0):
+        assert digest.quantile(q) == pytest.approx(np.percentile(values, q * 100))
+
+@pytest.mark.parametrize("n", [10, 200, 5_000, 50_000])
+def test_hll_count_within_three_standard_errors(n):
+    hll = HyperLogLog()
+    for i in range(n):
+        hll.add(f"merchant-{i}")
+    standard_error = 1.04 / np.sqrt(len(hll.registers))
+    assert abs(hll.count() - n) <= max(3 * standard_error * n, 1)
+
+def test_hll_merge_counts_the_union():
+    a, b = HyperLogLog(), HyperLogLog()
+    for i in range(3_000):
+        a.add(f"loc-{i}")
+    for i in range(2_000, 6_000):
+        b.add(f"loc-{i}")
+    a.merge(HyperLogLog.from_bytes(b.to_bytes()))
+    assert a.count() == pytest.approx(6_000, rel=0.1)
+
+def test_category_summary_matches_exact_statistics(amounts):
+    sketch = CategorySketch()
+    for i, x in enumerate(amounts[:5_000]):
+        sketch.add(("s1", "2024-03-01", i % 40 + 1, "Other", float(x), f"City {i % 7}"))
+    summary = sketch.summary()
+    values = amounts[:5_000]
+    assert summary["total_spent"] == pytest.approx(values.sum(), abs=0.01)
+    assert summary["spending_volatility"] == pytest.approx(np.std(values, ddof=1), abs=0.01)
+    assert _rank_error(values, summary["median_spend"], 0.5) < 0.005
+    assert abs(summary["distinct_merchants"] - 40) <= 2  # linear counting at small cardinalities
+    assert abs(summary["distinct_locations"] - 7) <= 1
@@ -0,0 +1,64 @@
+"""Recurring subscription detection (subscriptions.detect / run / get_subscriptions)"""
+import numpy as np
+
+import subscriptions
+from conftest import make_statement, tx
+
+def _days(*dates):
+    return np.array(dates, dtype="datetime64[D]").astype(np.int64)
+
+def test_detect_finds_steady_monthly_charges():
+    days = _days("2024-01-05", "2024-02-05", "2024-03-05", "2024-01-09", "2024-01-20", "2024-03-02")
+    cents = np.array([1699, 1699, 1749, 4510, 2210, 980], dtype=np.int64)
+    merchants = np.array([7, 7, 7, 9, 9, 9], dtype=np.int64)
+    found = subscriptions.detect(days, cents, merchants)
+    assert len(found) == 1
+    netflix = found[0]
+    assert netflix["merchant"] == 7 and netflix["cadence"] == "monthly"
+    assert netflix["amount"] == 17.49 and netflix["monthly_cost"] == 17.49
+    assert netflix["charges"] == 3 and netflix["active"]
+    assert netflix["next_expected"] == netflix["last_charge"] + netflix["period_days"]
+
+def test_detect_needs_enough_charges_and_flags_lapsed_ones():
+    assert subscriptions.detect(_days("2024-01-05", "2024-02-05"), np.array([999, 999]), np.array([1, 1])) == []
+    days = _days("2024-01-05", "2024-02-05", "2024-03-05", "2024-09-01")
+    found = subscriptions.detect(days, np.array([999, 999, 999, 4000]), np.array([1, 1, 1, 2]))
+    assert [(s["merchant"], s["active"]) for s in found] == [(1, False)]
+
+def _monthly(description, amount, months):
+    return [tx(f"2024-{m:02d}-05", description, amount) for m in months]
+
+def test_run_is_incremental_and_sees_reuploads(db):
+    db.ingest_statement(make_statement(_monthly("NETFLIX.COM", 16.99, [1])), "u1")
+    db.ingest_statement(make_statement(_monthly("SPOTIFY", 11.99, [1, 2, 3])), "u2")
+    first = subscriptions.run()
+    assert first["mode"] == "full" and first["subscriptions"] == 1
+
+    # Re-uploading u1's statement (same id, inserted_at kept) with two more charges
+    db.ingest_statement(make_statement(_monthly("NETFLIX.COM", 16.99, [1, 2, 3])), "u1")
+    second = subscriptions.run()
+    assert second["mode"] == "incremental" and second["users_scanned"] == 1
+    assert [s["cadence"] for s in subscriptions.get_subscriptions("u1")["subscriptions"]] == ["monthly"]
+
+    assert subscriptions.run()["users_scanned"] == 0
+    assert subscriptions.run(full=True)["users_scanned"] == 2
+
+def test_removed_charges_drop_the_subscription(db):
+    db.ingest_statement(make_statement(_monthly("NETFLIX.COM", 16.99, [1, 2, 3])), "u1")
+    subscriptions.run()
+    db.ingest_statement(make_statement(_monthly("NETFLIX.COM", 16.99, [1])), "u1")
+    assert subscriptions.run()["users_scanned"] == 1
+    assert subscriptions.get_subscriptions("u1")["subscriptions"] == []
+
+def test_get_subscriptions_orders_active_first_and_totals_them(db):
+    db.ingest_statement(make_statement(
+        _monthly("NETFLIX.COM", 16.99, [1, 2, 3]) + _monthly("SPOTIFY", 11.99, [1, 2, 3])
+        + [tx(f"2023-{m:02d}-10", "CRAVE TV", 9.99) for m in (1, 2, 3)]
+    ), "u1")
+    subscriptions.run()
+    summary = subscriptions.get_subscriptions("u1")
+    assert [(s["monthly_cost"], s["active"]) for s in summary["subscriptions"]] == \
+        [(16.99, True), (11.99, True), (9.99, False)]
+    assert summary["active_count"] == 2
+    assert summary["monthly_cost"] == 28.98
+    assert subscriptions.get_subscriptions("nobody")["subscriptions"] == []
@@ -0,0 +1,91 @@
+"""change_log-driven sync to the warehouse (databricks_viz.sync_sqlite_to_databricks)"""
+import pytest
+
+from conftest import make_statement, tx
+
+TRANSACTIONS = [
+    tx("2024-03-02", "SOBEYS #123", 45.10),
+    tx("2024-03-05", "NETFLIX.COM", 16.99),
+    tx("2024-03-07", "TIM HORTONS", 2.10),
+    tx("2024-03-07", "TIM HORTONS", 2.10),
+]
+
+@pytest.fixture
+def visualizer(db, warehouse, monkeypatch):
+    import databricks_viz
+    monkeypatch.setattr(databricks_viz, "get_warehouse", lambda *args, **kwargs: warehouse)
+    return databricks_viz.DatabricksVisualizer()
+
+def _local(db):
+    conn = db.get_db_connection()
+    try:
+        return sorted((r["statement_id"], r["fingerprint"], r["location"])
+                      for r in conn.execute("SELECT statement_id, fingerprint, location FROM transactions"))
+    finally:
+        conn.close()
+
+def _remote(warehouse):
+    with warehouse.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT statement_id, fingerprint, location FROM finance.transactions")
+        return sorted(cur.fetchall())
+
+def _change_log_rows(db):
+    conn = db.get_db_connection()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_first_sync_ships_a_snapshot(db, warehouse, visualizer):
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    result = visualizer.sync_sqlite_to_databricks()
+    assert result["status"] == "success", result
+    assert result["synced_records"]["statements"] == 1
+    assert _remote(warehouse) == _local(db)
+    assert visualizer.sync_sqlite_to_databricks()["status"] == "up_to_date"
+
+def test_changed_reingest_syncs_without_conflicting_merge_rows(db, warehouse, visualizer):
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    assert visualizer.sync_sqlite_to_databricks()["status"] == "success"
+
+    # A corrected upload drops NETFLIX, the next one restores it: between syncs
+    # the same (statement_id, fingerprint) is deleted and re-inserted under a new id
+    db.ingest_statement(make_statement(TRANSACTIONS[:1] + TRANSACTIONS[2:]), "u1")
+    changed = [dict(t) for t in TRANSACTIONS]
+    changed[0]["location"] = "Guelph, ON"
+    changed.append(tx("2024-03-09", "PRESTO", 3.30))
+    db.ingest_statement(make_statement(changed), "u1")
+    db.ingest_statement(make_statement(changed, statement_date="2024-04-30"), "u1")
+
+    result = visualizer.sync_sqlite_to_databricks(batch_size=3)
+    assert result["status"] == "success", result
+    assert _remote(warehouse) == _local(db)
+    assert ("Guelph, ON",) in {(loc,) for _, _, loc in _remote(warehouse)}
+
+def test_change_log_is_trimmed_behind_every_consumer(db, warehouse, visualizer):
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    assert _change_log_rows(db) == 0  # no consumer registered yet: nothing to keep
+    visualizer.sync_sqlite_to_databricks()
+
+    db.ingest_statement(make_statement(TRANSACTIONS[:2]), "u1")
+    assert _change_log_rows(db) > 0
+    visualizer.sync_sqlite_to_databricks()
+    assert _change_log_rows(db) == 0
+    assert _remote(warehouse) == _local(db)
+
+def test_consumer_behind_the_trimmed_log_resyncs_in_full(db, warehouse, visualizer, monkeypatch):
+    db.ingest_statement(make_statement(TRANSACTIONS), "u1")
+    visualizer.sync_sqlite_to_databricks()
+
+    monkeypatch.setattr(db, "CHANGE_LOG_MAX_ROWS", 1)
+    db.ingest_statement(make_statement(TRANSACTIONS[1:]), "u1")
+    db.ingest_statement(make_statement(TRANSACTIONS, statement_date="2024-04-30"), "u1")
+    conn = db.get_db_connection()
+    try:
+        assert db.change_log_watermark(conn.cursor(), "databricks")[1] is True
+    finally:
+        conn.close()
+
+    assert visualizer.sync_sqlite_to_databricks()["status"] == "success"
+    assert _remote(warehouse) == _local(db)
@@ -0,0 +1,46 @@
+"""Databricks -> DuckDB SQL translation (warehouse.translate_sql)"""
+import pytest
+
+from warehouse import DuckDBWarehouse, translate_sql
+
+def _one(sql):
+    (translated,) = translate_sql(sql)
+    return translated
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT DATE_FORMAT(d, 'yyyy-MM') FROM t", "SELECT strftime(d, '%Y-%m') FROM t"),
+    ("SELECT DATE_FORMAT(COALESCE(a, b), 'yyyy-MM') FROM t",
+     "SELECT strftime(COALESCE(a, b), '%Y-%m') FROM t"),
+    ("SELECT date_format(CAST(x AS DATE), 'yyyy-MM-dd'), DATE_FORMAT(y, 'HH') FROM t",
+     "SELECT strftime(CAST(x AS DATE), '%Y-%m-%d'), strftime(y, '%H') FROM t"),
+    ("SELECT DATE_FORMAT(DATE_FORMAT(d, 'yyyy'), 'yyyy') FROM t",
+     "SELECT strftime(strftime(d, '%Y'), '%Y') FROM t"),
+    ("SELECT DATE_FORMAT(COALESCE(a, '2024-01-01'), 'yyyy-MM') FROM t",
+     "SELECT strftime(COALESCE(a, '2024-01-01'), '%Y-%m') FROM t"),
+])
+def test_date_format_handles_nested_calls(sql, expected):
+    assert _one(sql) == expected
+
+def test_backticks_and_null_safe_equality():
+    assert _one("SELECT * FROM `finance`.`t` WHERE a <=> b") == 'SELECT * FROM "finance"."t" WHERE a IS NOT DISTINCT FROM b'
+
+def test_add_columns_keeps_parenthesized_types():
+    assert translate_sql("ALTER TABLE `s`.`t` ADD COLUMNS (a DECIMAL(18,2), b STRING)") == (
+        'ALTER TABLE "s"."t" ADD COLUMN IF NOT EXISTS a DECIMAL(18,2)',
+        'ALTER TABLE "s"."t" ADD COLUMN IF NOT EXISTS b STRING',
+    )
+
+def test_delta_only_statements_are_dropped():
+    assert translate_sql("OPTIMIZE `s`.`t` ZORDER BY (a)") == ()
+
+def test_translated_query_runs_on_duckdb():
+    warehouse = DuckDBWarehouse(":memory:")
+    try:
+        with warehouse.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("CREATE TABLE t (a DATE, b DATE)")
+            cur.execute("INSERT INTO t VALUES (NULL, DATE '2024-03-15')")
+            cur.execute("SELECT DATE_FORMAT(COALESCE(a, b), 'yyyy-MM') AS month FROM t")
+            assert cur.fetchall() == [("2024-03",)]
+    finally:
+        warehouse.close()
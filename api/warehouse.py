@@ -0,0 +1,382 @@
+"""
+Pluggable SQL warehouse backend
+Everything that talks to the analytics warehouse (dbxLoader, databricks_viz,
+the outbox shipper, credit-card spending lookups) borrows connections from
+get_warehouse(). WAREHOUSE_BACKEND selects the implementation:
+
+  databricks (default) - pooled Databricks SQL Warehouse sessions (dbx_pool)
+  duckdb               - a local DuckDB file that accepts the same DDL, MERGE and
+                         analytics SQL by translating Databricks dialect on the fly
+
+The DuckDB backend lets the sync and analytics paths run and be benchmarked
+offline, and can serve analytics locally for small deployments.
+"""
+import os
+import re
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WAREHOUSE_BACKEND = os.getenv("WAREHOUSE_BACKEND", "databricks").lower()
+DUCKDB_PATH = os.getenv("WAREHOUSE_DUCKDB_PATH", os.path.join(os.path.dirname(__file__), "warehouse.duckdb"))
+
+# Fail at import time when the selected driver is missing, like the optional imports in main.py
+if WAREHOUSE_BACKEND == "duckdb":
+    import duckdb
+else:
+    from databricks import sql as _databricks_sql  # noqa: F401
+
+# --------------------------
+# Databricks -> DuckDB dialect translation
+# --------------------------
+_JAVA_DATE_TOKENS = {
+    "yyyy": "%Y", "yy": "%y", "MMMM": "%B", "MMM": "%b", "MM": "%m", "dd": "%d",
+    "EEEE": "%A", "EEE": "%a", "E": "%a", "HH": "%H", "hh": "%I", "mm": "%M", "ss": "%S", "a": "%p",
+}
+
+def _java_to_strftime(fmt: str) -> str:
+    return re.sub(r"([A-Za-z])\1*", lambda m: _JAVA_DATE_TOKENS.get(m.group(0), m.group(0)), fmt)
+
+def _outside_literals(sql: str, fn: Callable[[str], str]) -> str:
+    """Apply fn only to the parts of sql that are not inside single-quoted literals"""
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    return "".join(part if i % 2 else fn(part) for i, part in enumerate(parts))
+
+def _matching_paren(sql: str, open_idx: int) -> int:
+    depth = 0
+    in_literal = False
+    for i in range(open_idx, len(sql)):
+        ch = sql[i]
+        if ch == "'":
+            in_literal = not in_literal
+        elif not in_literal and ch == "(":
+            depth += 1
+        elif not in_literal and ch == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError("Unbalanced parentheses in warehouse SQL")
+
+def _split_top_level(sql: str) -> List[str]:
+    """Split on commas that are outside parentheses and literals"""
+    parts, depth, start, in_literal = [], 0, 0, False
+    for i, ch in enumerate(sql):
+        if ch == "'":
+            in_literal = not in_literal
+        elif in_literal:
+            continue
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append(sql[start:i])
+            start = i + 1
+    parts.append(sql[start:])
+    return parts
+
+def _rewrite_date_format(sql: str) -> str:
+    """`DATE_FORMAT(expr, 'java fmt')` -> `strftime(expr, '%fmt')`, for any expr including nested calls"""
+    out = []
+    pos = 0
+    for match in re.finditer(r"\bDATE_FORMAT\s*\(", sql, re.IGNORECASE):
+        if match.start() < pos:
+            continue  # nested inside a call already rewritten
+        close = _matching_paren(sql, match.end() - 1)
+        args = _split_top_level(sql[match.end():close])
+        fmt = re.fullmatch(r"\s*'([^']*)'\s*", args[-1]) if len(args) == 2 else None
+        if fmt is None:
+            continue  # not a literal format; leave it for DuckDB to reject
+        out.append(sql[pos:match.start()])
+        out.append(f"strftime({_rewrite_date_format(args[0].strip())}, '{_java_to_strftime(fmt.group(1))}')")
+        pos = close + 1
+    out.append(sql[pos:])
+    return "".join(out)
+
+def _wrap_from_values(sql: str) -> str:
+    """`FROM VALUES (..), (..) AS s(cols)` -> `FROM (VALUES (..), (..)) AS s(cols)`"""
+    out = []
+    pos = 0
+    for match in re.finditer(r"\bFROM\s+VALUES\s+", sql, re.IGNORECASE):
+        if match.start() < pos:
+            continue
+        end = match.end()
+        while True:
+            end = _matching_paren(sql, end) + 1
+            following = re.match(r"\s*,\s*(?=\()", sql[end:])
+            if not following:
+                break
+            end += following.end()
+        out.append(sql[pos:match.start()])
+        out.append(f"FROM ({sql[match.start() + 4:end].strip()})")
+        pos = end
+    out.append(sql[pos:])
+    return "".join(out)
+
+def _strip_tblproperties(sql: str) -> str:
+    match = re.search(r"\bTBLPROPERTIES\s*\(", sql, re.IGNORECASE)
+    while match:
+        sql = sql[:match.start()] + sql[_matching_paren(sql, match.end() - 1) + 1:]
+        match = re.search(r"\bTBLPROPERTIES\s*\(", sql, re.IGNORECASE)
+    return sql
+
+@lru_cache(maxsize=512)
+def translate_sql(sql: str, attach_dir: Optional[str] = None) -> Tuple[str, ...]:
+    """Translate one Databricks SQL statement into zero or more DuckDB statements"""
+    stripped = sql.strip().rstrip(";")
+
+    match = re.match(r"CREATE\s+CATALOG\s+IF\s+NOT\s+EXISTS\s+`?(\w+)`?$", stripped, re.IGNORECASE)
+    if match:
+        # A catalog maps to an attached DuckDB database next to the main file
+        target = os.path.join(attach_dir, f"{match.group(1)}.duckdb") if attach_dir else ":memory:"
+        return (f"ATTACH IF NOT EXISTS '{target}' AS \"{match.group(1)}\"",)
+    match = re.match(r"USE\s+CATALOG\s+`?(\w+)`?$", stripped, re.IGNORECASE)
+    if match:
+        return (f'USE "{match.group(1)}"',)
+    if re.match(r"(OPTIMIZE|VACUUM|ANALYZE\s+TABLE)\b", stripped, re.IGNORECASE):
+        return ()  # Delta maintenance has no DuckDB equivalent
+
+    match = re.match(r"ALTER\s+TABLE\s+(\S+)\s+ADD\s+COLUMNS\s*\((.*)\)$", stripped, re.IGNORECASE | re.DOTALL)
+    if match:
+        table = match.group(1).replace("`", '"')
+        return tuple(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {col.strip()}"
+                     for col in _split_top_level(match.group(2)) if col.strip())
+
+    stripped = _rewrite_date_format(stripped)
+
+    def rewrite(part: str) -> str:
+        part = part.replace("`", '"')
+        part = re.sub(r"\bcurrent_timestamp\(\s*\)", "CAST(current_timestamp AS TIMESTAMP)", part, flags=re.IGNORECASE)
+        part = re.sub(r"(\S+)\s*<=>\s*(\S+)", r"\1 IS NOT DISTINCT FROM \2", part)
+        part = re.sub(r"\bUSING\s+DELTA\b", "", part, flags=re.IGNORECASE)
+        return part
+
+    stripped = _outside_literals(stripped, rewrite)
+    stripped = _strip_tblproperties(stripped)
+    stripped = _wrap_from_values(stripped)
+
+    if re.match(r"MERGE\s+INTO\b", stripped, re.IGNORECASE):
+        # Lets the cursor report Delta-style num_*_rows metrics
+        stripped += "\nRETURNING merge_action"
+    return (stripped,)
+
+# --------------------------
+# DuckDB backend
+# --------------------------
+_MERGE_METRICS = ["num_affected_rows", "num_updated_rows", "num_deleted_rows", "num_inserted_rows"]
+
+class DuckDBCursor:
+    """DB-API cursor that runs Databricks SQL against DuckDB"""
+
+    def __init__(self, cursor, attach_dir: Optional[str]):
+        self._cursor = cursor
+        self._attach_dir = attach_dir
+        self._rows: Optional[List[tuple]] = None
+        self._reader = None
+        self.description = None
+
+    def execute(self, operation: str, parameters: Optional[Sequence[Any]] = None) -> "DuckDBCursor":
+        statements = translate_sql(operation, self._attach_dir)
+        self._rows, self._reader, self.description = None, None, None
+        for statement in statements:
+            # Placeholders only ever appear in single-statement SQL
+            self._cursor.execute(statement, list(parameters) if parameters else None)
+        if statements and statements[-1].endswith("RETURNING merge_action"):
+            actions = [row[0] for row in self._cursor.fetchall()]
+            self._rows = [(len(actions), actions.count("UPDATE"), actions.count("DELETE"), actions.count("INSERT"))]
+            self.description = [(name, "bigint", None, None, None, None, None) for name in _MERGE_METRICS]
+        elif statements:
+            self.description = self._cursor.description
+        return self
+
+    def fetchone(self):
+        if self._rows is not None:
+            return self._rows.pop(0) if self._rows else None
+        return self._cursor.fetchone() if self.description else None
+
+    def fetchall(self) -> List[tuple]:
+        if self._rows is not None:
+            rows, self._rows = self._rows, []
+            return rows
+        return self._cursor.fetchall() if self.description else []
+
+    def fetchmany(self, size: int = 1) -> List[tuple]:
+        if self._rows is not None:
+            rows, self._rows = self._rows[:size], self._rows[size:]
+            return rows
+        return self._cursor.fetchmany(size) if self.description else []
+
+    def fetchall_arrow(self):
+        """Remaining rows as a pyarrow.Table, like the Databricks connector"""
+        if self._rows is not None:
+            import pyarrow as pa
+            rows, self._rows = self._rows, []
+            return pa.table({name: [row[i] for row in rows] for i, name in enumerate(_MERGE_METRICS)})
+        if self._reader is not None:
+            return self._reader.read_all()
+        return self._cursor.to_arrow_table()
+
+    def fetchmany_arrow(self, size: int):
+        """The next `size` rows as a pyarrow.Table"""
+        import pyarrow as pa
+        if self._rows is not None:
+            rows, self._rows = self._rows[:size], self._rows[size:]
+            return pa.table({name: [row[i] for row in rows] for i, name in enumerate(_MERGE_METRICS)})
+        if self._reader is None:
+            self._reader = self._cursor.to_arrow_reader(size)
+        batches = []
+        fetched = 0
+        while fetched < size:
+            try:
+                batch = self._reader.read_next_batch()
+            except StopIteration:
+                break
+            batches.append(batch)
+            fetched += batch.num_rows
+        return pa.Table.from_batches(batches, schema=self._reader.schema)
+
+    def close(self) -> None:
+        self._cursor.close()
+
+class DuckDBConnection:
+    """Connection facade handing out thread-safe DuckDB cursors"""
+
+    def __init__(self, database, attach_dir: Optional[str]):
+        self._database = database
+        self._attach_dir = attach_dir
+
+    def cursor(self) -> DuckDBCursor:
+        # duckdb cursors are independent connections to the same database
+        return DuckDBCursor(self._database.cursor(), self._attach_dir)
+
+    def commit(self) -> None:
+        pass  # every statement autocommits
+
+    def close(self) -> None:
+        pass  # the shared database stays open until the backend closes
+
+class DuckDBWarehouse:
+    """Local DuckDB stand-in for the Databricks SQL Warehouse"""
+
+    name = "duckdb"
+    check_timeout = 5.0
+
+    def __init__(self, path: str = DUCKDB_PATH):
+        self.path = path
+        self._database = duckdb.connect(path)
+        self._connection = DuckDBConnection(self._database, None if path == ":memory:" else os.path.dirname(path))
+        self._once_done: Dict[str, bool] = {}
+        self._once_lock = threading.Lock()
+        self._queries = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[DuckDBConnection]:
+        self._queries += 1
+        yield self._connection
+
+    def run_once(self, key: str, fn: Callable[..., Any], *args) -> None:
+        if self._once_done.get(key):
+            return
+        with self._once_lock:
+            if not self._once_done.get(key):
+                fn(*args)
+                self._once_done[key] = True
+
+    def check(self) -> bool:
+        with self.connection() as conn:
+            cur = conn.cursor()
+            try:
+                return cur.execute("SELECT 1").fetchone()[0] == 1
+            finally:
+                cur.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"backend": self.name, "path": self.path, "connections_borrowed": self._queries}
+
+    def close(self) -> None:
+        self._database.close()
+
+# --------------------------
+# Arrow results
+# --------------------------
+def arrow_to_records(table) -> List[Dict[str, Any]]:
+    """
+    JSON-ready records from an Arrow table. Decimals become floats and temporal
+    columns ISO strings with columnar casts, so no per-cell Python conversion
+    (or FastAPI jsonable_encoder walk) is needed before json.dumps.
+    """
+    import pyarrow as pa
+    columns = []
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_decimal(field.type):
+            # Via string: a direct decimal->double cast can round 2.53 to 2.5300000000000002
+            column = column.cast(pa.string()).cast(pa.float64())
+        elif pa.types.is_temporal(field.type):
+            column = column.cast(pa.string())
+        columns.append(column)
+    return pa.table(columns, names=table.column_names).to_pylist()
+
+def arrow_to_ipc(table) -> bytes:
+    """Serialize an Arrow table as an IPC stream"""
+    import pyarrow as pa
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+# --------------------------
+# Databricks backend
+# --------------------------
+class DatabricksWarehouse:
+    """Databricks SQL Warehouse through the shared connection pool"""
+
+    name = "databricks"
+
+    def __init__(self, server_hostname: Optional[str] = None, http_path: Optional[str] = None,
+                 access_token: Optional[str] = None):
+        import dbx_pool
+        self.host = server_hostname or dbx_pool.DATABRICKS_HOST
+        self._pool = dbx_pool.get_pool(self.host, http_path or dbx_pool.DATABRICKS_HTTP_PATH,
+                                       access_token or dbx_pool.DATABRICKS_TOKEN)
+        self.check_timeout = self._pool.check_timeout
+
+    def connection(self):
+        return self._pool.connection()
+
+    def run_once(self, key: str, fn: Callable[..., Any], *args) -> None:
+        self._pool.run_once(key, fn, *args)
+
+    def check(self) -> bool:
+        return self._pool.check()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"backend": self.name, "host": self.host, **self._pool.metrics()}
+
+    def close(self) -> None:
+        self._pool.close_all()
+
+_warehouses: Dict[tuple, Any] = {}
+_warehouses_lock = threading.Lock()
+
+def get_warehouse(server_hostname: Optional[str] = None, http_path: Optional[str] = None,
+                  access_token: Optional[str] = None):
+    """Process-wide warehouse for the configured backend (connection args only apply to Databricks)"""
+    key = (WAREHOUSE_BACKEND,) if WAREHOUSE_BACKEND == "duckdb" else (server_hostname, http_path, access_token)
+    with _warehouses_lock:
+        if key not in _warehouses:
+            if WAREHOUSE_BACKEND == "duckdb":
+                _warehouses[key] = DuckDBWarehouse()
+            else:
+                _warehouses[key] = DatabricksWarehouse(server_hostname, http_path, access_token)
+        return _warehouses[key]
+
+def close_warehouses() -> None:
+    with _warehouses_lock:
+        for warehouse in _warehouses.values():
+            warehouse.close()
+        _warehouses.clear()
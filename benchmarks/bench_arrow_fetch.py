@@ -0,0 +1,111 @@
+"""
+Row-dict vs Arrow result fetching benchmark
+Runs against the local DuckDB warehouse backend (WAREHOUSE_BACKEND=duckdb), so
+no Databricks workspace is needed. For each result size it compares:
+  rows       - cur.fetchall() + dict(zip(...)) per row + FastAPI jsonable_encoder + json.dumps
+  arrow-json - cur.fetchall_arrow() + arrow_to_records() + json.dumps
+  arrow-ipc  - cur.fetchall_arrow() + Arrow IPC serialization
+and the same three paths with a per-category aggregation done after the
+fetch (Python loop over row dicts vs pyarrow group_by on the table).
+
+Run: python benchmarks/bench_arrow_fetch.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ["WAREHOUSE_BACKEND"] = "duckdb"
+os.environ["WAREHOUSE_DUCKDB_PATH"] = ":memory:"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+from fastapi.encoders import jsonable_encoder
+
+from warehouse import get_warehouse, arrow_to_records, arrow_to_ipc
+
+CATEGORIES = ["Transportation", "Groceries", "Dining", "Entertainment", "Other"]
+
+def build_table(warehouse, rows: int) -> None:
+    with warehouse.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("CREATE SCHEMA IF NOT EXISTS `finance`")
+        cur.execute("DROP TABLE IF EXISTS `finance`.`bench_transactions`")
+        cur.execute(f"""
+        CREATE TABLE `finance`.`bench_transactions` AS
+        SELECT
+            'stmt-' || (i % 50) AS statement_id,
+            md5(i::VARCHAR) AS fingerprint,
+            DATE '2025-01-01' + CAST(i % 365 AS INTEGER) AS transaction_date,
+            'MERCHANT #' || (i % 997) AS description,
+            CAST(((i * 7919) % 15000) / 100.0 AS DECIMAL(18,2)) AS amount,
+            {"[" + ", ".join(f"'{c}'" for c in CATEGORIES) + "]"}[(i % {len(CATEGORIES)}) + 1] AS category
+        FROM range({rows}) t(i)
+        """)
+        cur.close()
+
+QUERY = "SELECT statement_id, fingerprint, transaction_date, description, amount, category FROM `finance`.`bench_transactions`"
+
+def rows_path(warehouse, aggregate: bool) -> int:
+    with warehouse.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(QUERY)
+        rows = cur.fetchall()
+        columns = [col[0] for col in cur.description]
+        cur.close()
+    records = [dict(zip(columns, row)) for row in rows]
+    if aggregate:
+        totals = {}
+        for record in records:
+            totals[record["category"]] = totals.get(record["category"], 0) + record["amount"]
+        records = [{"category": k, "total": v} for k, v in totals.items()]
+    return len(json.dumps(jsonable_encoder(records)))
+
+def arrow_table(warehouse, aggregate: bool):
+    with warehouse.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(QUERY)
+        table = cur.fetchall_arrow()
+        cur.close()
+    if aggregate:
+        table = table.group_by("category").aggregate([("amount", "sum")])
+    return table
+
+def arrow_json_path(warehouse, aggregate: bool) -> int:
+    return len(json.dumps(arrow_to_records(arrow_table(warehouse, aggregate))))
+
+def arrow_ipc_path(warehouse, aggregate: bool) -> int:
+    return len(arrow_to_ipc(arrow_table(warehouse, aggregate)))
+
+def timed(fn, *args, repeat: int = 3) -> tuple:
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    warehouse = get_warehouse()
+    paths = (("rows", rows_path), ("arrow-json", arrow_json_path), ("arrow-ipc", arrow_ipc_path))
+    for rows in args.sizes:
+        build_table(warehouse, rows)
+        for aggregate in (False, True):
+            label = "fetch+aggregate" if aggregate else "fetch"
+            baseline = None
+            for name, path in paths:
+                # The row path is minutes at 1M rows; one run is enough to see the gap
+                repeat = 1 if name == "rows" and rows >= 1_000_000 else args.repeat
+                elapsed, size = timed(path, warehouse, aggregate, repeat=repeat)
+                baseline = baseline or elapsed
+                print(f"{rows:>9,} rows  {label:16s} {name:11s} {elapsed * 1000:10.1f} ms  "
+                      f"{baseline / elapsed:6.1f}x  {size / 1e6:8.2f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Dashboard concurrency benchmark
+Fires 100 parallel dashboard clients at two in-process ASGI endpoints:
+  before - `async def` handler calling sqlite_db.get_dashboard_data() directly
+  after  - the same handler awaiting db_async.get_dashboard_data()
+and reports throughput, latency percentiles, event-loop stall and the latency
+of a trivial /ping request issued while the dashboards are in flight (what
+every other user of the API experiences). On multi-core hosts the thread pool
+also lets the dashboard queries themselves overlap.
+
+Run: python benchmarks/bench_dashboard_concurrency.py [--rows 20000] [--clients 100] [--requests 5]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import httpx
+from fastapi import FastAPI
+
+import sqlite_db
+import db_async
+
+MERCHANTS = ["SOBEYS #934", "PRESTO FARE", "UBER* TRIP", "MCDONALD'S #40569", "SPOTIFY P1",
+             "LCBO/RAO #0511", "H&M CA0123", "AMANO ITALIAN KITCHEN", "WAL-MART #3045", "NETFLIX.COM"]
+
+def build_database(rows: int) -> str:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    sqlite_db.DB_PATH = path
+    sqlite_db.init_database()
+    conn = sqlite_db.get_db_connection()
+    conn.execute("INSERT INTO statements (statement_id, user_id) VALUES ('bench', 'user_1')")
+    conn.executemany(
+        "INSERT INTO transactions (statement_id, transaction_date, post_date, description, amount, location) "
+        "VALUES ('bench', ?, ?, ?, ?, 'TORONTO ON')",
+        (
+            (f"2025-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",) * 2
+            + (random.choice(MERCHANTS), round(random.uniform(1, 150), 2))
+            for _ in range(rows)
+        )
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/before")
+    async def before():
+        return sqlite_db.get_dashboard_data()
+
+    @app.get("/after")
+    async def after():
+        return await db_async.get_dashboard_data()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+async def measure_loop_stall(stop: asyncio.Event, samples: list) -> None:
+    """Record how late a 10 ms heartbeat fires - a blocked loop shows up here"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        samples.append(time.perf_counter() - start - 0.01)
+
+async def run(app: FastAPI, path: str, clients: int, requests_per_client: int) -> dict:
+    latencies = []
+    pings = []
+    stalls = []
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(measure_loop_stall(stop, stalls))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                resp = await client.get(path)
+                resp.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        async def prober(done: asyncio.Event):
+            # Pings are due every 50 ms; latency is measured from when a ping was due,
+            # not when a blocked loop finally got round to sending it
+            due = time.perf_counter()
+            while True:
+                (await client.get("/ping")).raise_for_status()
+                now = time.perf_counter()
+                while due <= now:
+                    pings.append(now - due)
+                    due += 0.05
+                if done.is_set():
+                    break
+                await asyncio.sleep(max(due - now, 0))
+
+        done = asyncio.Event()
+        probe = asyncio.create_task(prober(done))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe
+
+    stop.set()
+    await heartbeat
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "ping_p95_ms": sorted(pings)[max(int(len(pings) * 0.95) - 1, 0)] * 1000 if pings else 0,
+        "max_loop_stall_ms": max(stalls, default=0) * 1000,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"Building {args.rows:,} transaction database...")
+    build_database(args.rows)
+    app = build_app()
+
+    for label, path in (("before (blocking)", "/before"), ("after (db_async)", "/after")):
+        result = asyncio.run(run(app, path, args.clients, args.requests))
+        print(f"{label:20s} {result['requests']} req  {result['throughput_rps']:7.1f} req/s  "
+              f"p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  "
+              f"ping p95 {result['ping_p95_ms']:8.1f} ms  max loop stall {result['max_loop_stall_ms']:8.1f} ms")
+
+    db_async.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,177 @@
--- 📊 DATABRICKS SQL QUERIES FOR YOUR FINANCIAL DATA VISUALIZATION
+-- 📊 ANALYTICS QUERIES (DATABRICKS)
+-- Generated by api/analytics_sql.py - edit the metric definitions there, not this file.
 
--- 1. 💰 SPENDING OVERVIEW
-SELECT 
-    COUNT(*) as total_transactions,
-    SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_spent,
-    SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_credits,
-    AVG(CASE WHEN amount < 0 THEN ABS(amount) ELSE NULL END) as avg_transaction
-FROM finance.transactions;
+-- 💰 Spending overview [spending_overview, relies on: full scan of transactions]
+SELECT
+    COUNT(*) AS total_transactions,
+    COALESCE(SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END), 0) AS total_spent,
+    COALESCE(SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END), 0) AS total_credits,
+    COALESCE(AVG(CASE WHEN amount > 0 THEN amount END), 0) AS avg_transaction
+FROM `finance`.`transactions`
+WHERE UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL;
 
--- 2. 📈 DAILY SPENDING TREND
-SELECT 
+-- 🏪 Spending by category [spending_by_category, relies on: full scan of transactions]
+SELECT
+    CASE
+        WHEN UPPER(description) LIKE '%PRESTO%' OR UPPER(description) LIKE '%METROLINX%' OR UPPER(description) LIKE '%GO TRANSIT%' OR UPPER(description) LIKE '%HOPP%' OR UPPER(description) LIKE '%CITY OF GUELPH%' THEN 'Transportation'
+        WHEN UPPER(description) LIKE '%SOBEYS%' OR UPPER(description) LIKE '%FOOD BASICS%' OR UPPER(description) LIKE '%WAL-MART%' OR UPPER(description) LIKE '%WALMART%' OR UPPER(description) LIKE '%DOLLARAMA%' OR UPPER(description) LIKE '%LCBO%' OR UPPER(description) LIKE '%FROOTLAND%' THEN 'Shopping & Groceries'
+        WHEN UPPER(description) LIKE '%MCDONALD%' OR UPPER(description) LIKE '%HARVEY%' OR UPPER(description) LIKE '%CHIPOTLE%' OR UPPER(description) LIKE '%THAI%' OR UPPER(description) LIKE '%UBER%' OR UPPER(description) LIKE '%RESTAURANT%' OR UPPER(description) LIKE '%AMANO%' OR UPPER(description) LIKE '%POULET%' THEN 'Food & Dining'
+        WHEN UPPER(description) LIKE '%SPOTIFY%' OR UPPER(description) LIKE '%NETFLIX%' OR UPPER(description) LIKE '%ENTERTAINMENT%' THEN 'Entertainment'
+        WHEN UPPER(description) LIKE '%UNIV%' OR UPPER(description) LIKE '%COLLEGE%' OR UPPER(description) LIKE '%SCHOOL%' THEN 'Education'
+        WHEN UPPER(description) LIKE '%H&M%' OR UPPER(description) LIKE '%HM CA%' OR UPPER(description) LIKE '%CLOTHING%' THEN 'Clothing'
+        WHEN UPPER(description) LIKE '%RENT%' OR UPPER(description) LIKE '%MORTGAGE%' OR UPPER(description) LIKE '%UTILITIES%' THEN 'Housing'
+        ELSE 'Other'
+    END AS category,
+    COUNT(*) AS transaction_count,
+    SUM(amount) AS total_amount,
+    AVG(amount) AS avg_amount
+FROM `finance`.`transactions`
+WHERE amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
+GROUP BY 1
+ORDER BY total_amount DESC;
+
+-- 💳 Card spending on a user's latest statement (parameter: user_id) [latest_statement_spend, relies on: idx_statements_user, idx_transactions_statement_fingerprint (statement_id prefix)]
+SELECT COALESCE(SUM(amount), 0) AS total_spending
+FROM `finance`.`transactions`
+WHERE statement_id = (
+    SELECT statement_id
+    FROM `finance`.`statements`
+    WHERE user_id = ?
+    ORDER BY statement_date DESC, inserted_at DESC
+    LIMIT 1
+) AND amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%';
+
+-- 💳 Recent transactions [recent_transactions, relies on: idx_transactions_recent]
+SELECT transaction_date, description, amount, location
+FROM `finance`.`transactions`
+WHERE UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
+ORDER BY transaction_date DESC, post_date DESC
+LIMIT 10;
+
+-- 📈 Daily spending trend [daily_spending, relies on: idx_transactions_date]
+SELECT
     transaction_date,
-    SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as daily_spending,
-    COUNT(*) as transaction_count
-FROM finance.transactions 
-WHERE amount < 0
+    SUM(amount) AS daily_spending,
+    COUNT(*) AS transaction_count
+FROM `finance`.`transactions`
+WHERE amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
 GROUP BY transaction_date
 ORDER BY transaction_date;
 
--- 3. 🏪 TOP SPENDING CATEGORIES (by merchant)
-SELECT 
-    CASE 
-        WHEN UPPER(description) LIKE '%PRESTO%' OR UPPER(description) LIKE '%METROLINX%' THEN 'Transportation'
-        WHEN UPPER(description) LIKE '%SOBEYS%' OR UPPER(description) LIKE '%FOOD BASICS%' OR UPPER(description) LIKE '%WAL-MART%' THEN 'Groceries'
-        WHEN UPPER(description) LIKE '%MCDONALD%' OR UPPER(description) LIKE '%HARVEY%' OR UPPER(description) LIKE '%CHIPOTLE%' OR UPPER(description) LIKE '%THAI%' OR UPPER(description) LIKE '%UBER%' THEN 'Dining'
-        WHEN UPPER(description) LIKE '%SPOTIFY%' THEN 'Entertainment'
-        WHEN UPPER(description) LIKE '%UNIV%' OR UPPER(description) LIKE '%ACT*%' THEN 'Education'
-        ELSE 'Other'
-    END as category,
-    COUNT(*) as transaction_count,
-    SUM(ABS(amount)) as total_amount,
-    AVG(ABS(amount)) as avg_amount
-FROM finance.transactions 
-WHERE amount < 0
+-- 📊 Monthly spending summary [monthly_summary, relies on: idx_transactions_date]
+SELECT
+    DATE_FORMAT(transaction_date, 'yyyy-MM') AS month,
+    COUNT(*) AS transactions,
+    SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) AS spending,
+    SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END) AS credits
+FROM `finance`.`transactions`
+WHERE UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
 GROUP BY 1
-ORDER BY total_amount DESC;
+ORDER BY month DESC;
 
--- 4. 📍 SPENDING BY LOCATION
-SELECT 
+-- 💰 Spending patterns by month and category [monthly_category_spending, relies on: full scan of transactions]
+SELECT
+    DATE_FORMAT(transaction_date, 'yyyy-MM') AS month,
+    CASE
+        WHEN UPPER(description) LIKE '%PRESTO%' OR UPPER(description) LIKE '%METROLINX%' OR UPPER(description) LIKE '%GO TRANSIT%' OR UPPER(description) LIKE '%HOPP%' OR UPPER(description) LIKE '%CITY OF GUELPH%' THEN 'Transportation'
+        WHEN UPPER(description) LIKE '%SOBEYS%' OR UPPER(description) LIKE '%FOOD BASICS%' OR UPPER(description) LIKE '%WAL-MART%' OR UPPER(description) LIKE '%WALMART%' OR UPPER(description) LIKE '%DOLLARAMA%' OR UPPER(description) LIKE '%LCBO%' OR UPPER(description) LIKE '%FROOTLAND%' THEN 'Shopping & Groceries'
+        WHEN UPPER(description) LIKE '%MCDONALD%' OR UPPER(description) LIKE '%HARVEY%' OR UPPER(description) LIKE '%CHIPOTLE%' OR UPPER(description) LIKE '%THAI%' OR UPPER(description) LIKE '%UBER%' OR UPPER(description) LIKE '%RESTAURANT%' OR UPPER(description) LIKE '%AMANO%' OR UPPER(description) LIKE '%POULET%' THEN 'Food & Dining'
+        WHEN UPPER(description) LIKE '%SPOTIFY%' OR UPPER(description) LIKE '%NETFLIX%' OR UPPER(description) LIKE '%ENTERTAINMENT%' THEN 'Entertainment'
+        WHEN UPPER(description) LIKE '%UNIV%' OR UPPER(description) LIKE '%COLLEGE%' OR UPPER(description) LIKE '%SCHOOL%' THEN 'Education'
+        WHEN UPPER(description) LIKE '%H&M%' OR UPPER(description) LIKE '%HM CA%' OR UPPER(description) LIKE '%CLOTHING%' THEN 'Clothing'
+        WHEN UPPER(description) LIKE '%RENT%' OR UPPER(description) LIKE '%MORTGAGE%' OR UPPER(description) LIKE '%UTILITIES%' THEN 'Housing'
+        ELSE 'Other'
+    END AS category,
+    COUNT(*) AS transaction_count,
+    SUM(amount) AS total_amount,
+    AVG(amount) AS avg_amount,
+    MIN(amount) AS min_amount,
+    MAX(amount) AS max_amount
+FROM `finance`.`transactions`
+WHERE amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
+GROUP BY 1, 2
+ORDER BY month DESC, total_amount DESC;
+
+-- 🕒 Spending by weekday and hour [weekday_hour_spending, relies on: full scan of transactions]
+SELECT
+    DATE_FORMAT(transaction_date, 'EEEE') AS day_of_week,
+    HOUR(COALESCE(post_date, transaction_date)) AS hour_of_day,
+    COUNT(*) AS transaction_count,
+    SUM(amount) AS total_spent
+FROM `finance`.`transactions`
+WHERE amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
+GROUP BY 1, 2
+ORDER BY CASE day_of_week WHEN 'Sunday' THEN 7 WHEN 'Monday' THEN 1 WHEN 'Tuesday' THEN 2 WHEN 'Wednesday' THEN 3 WHEN 'Thursday' THEN 4 WHEN 'Friday' THEN 5 WHEN 'Saturday' THEN 6 END, hour_of_day;
+
+-- 📍 Top spending locations [top_locations, relies on: full scan of transactions]
+SELECT
     location,
-    COUNT(*) as transactions,
-    SUM(ABS(amount)) as total_spent
-FROM finance.transactions 
-WHERE amount < 0 AND location IS NOT NULL
+    COUNT(*) AS visits,
+    SUM(amount) AS total_spent,
+    AVG(amount) AS avg_per_visit
+FROM `finance`.`transactions`
+WHERE amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL AND location IS NOT NULL
 GROUP BY location
-ORDER BY total_spent DESC;
+ORDER BY total_spent DESC
+LIMIT 10;
+
+-- 🎯 Statement overview [statement_overview, relies on: idx_transactions_statement_fingerprint (statement_id prefix)]
+SELECT
+    s.statement_id, s.bank_name, s.card_type, s.period_start, s.period_end,
+    s.ending_balance, s.minimum_payment, s.payment_due_date,
+    COUNT(t.statement_id) AS transaction_count
+FROM `finance`.`statements` s
+LEFT JOIN `finance`.`transactions` t ON s.statement_id = t.statement_id
+GROUP BY s.statement_id, s.bank_name, s.card_type, s.period_start, s.period_end,
+         s.ending_balance, s.minimum_payment, s.payment_due_date
+ORDER BY s.period_end DESC;
 
--- 5. 💳 RECENT TRANSACTIONS (Last 10)
-SELECT 
+-- 💰 Running spend with window functions [running_spend, relies on: idx_transactions_date]
+SELECT
     transaction_date,
     description,
     amount,
-    location
-FROM finance.transactions 
-ORDER BY transaction_date DESC, post_date DESC
-LIMIT 10;
+    SUM(amount) OVER (ORDER BY transaction_date ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS running_total,
+    LAG(amount, 1) OVER (ORDER BY transaction_date) AS prev_amount,
+    CASE WHEN amount > AVG(amount) OVER () THEN 'Above Average' ELSE 'Below Average' END AS spending_category
+FROM `finance`.`transactions`
+WHERE amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
+ORDER BY transaction_date DESC;
 
--- 6. 📊 MONTHLY SPENDING SUMMARY
-SELECT 
-    DATE_FORMAT(transaction_date, 'yyyy-MM') as month,
-    COUNT(*) as transactions,
-    SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as spending,
-    SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as credits
-FROM finance.transactions
-GROUP BY DATE_FORMAT(transaction_date, 'yyyy-MM')
-ORDER BY month DESC;
+-- 📊 Category performance with percentiles [category_percentiles, relies on: full scan of transactions]
+SELECT
+    category,
+    COUNT(*) AS transactions,
+    SUM(amount) AS total_spent,
+    PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY amount) AS median_spend,
+    PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY amount) AS p95_spend,
+    STDDEV(amount) AS spending_volatility
+FROM (
+    SELECT CASE
+        WHEN UPPER(description) LIKE '%PRESTO%' OR UPPER(description) LIKE '%METROLINX%' OR UPPER(description) LIKE '%GO TRANSIT%' OR UPPER(description) LIKE '%HOPP%' OR UPPER(description) LIKE '%CITY OF GUELPH%' THEN 'Transportation'
+        WHEN UPPER(description) LIKE '%SOBEYS%' OR UPPER(description) LIKE '%FOOD BASICS%' OR UPPER(description) LIKE '%WAL-MART%' OR UPPER(description) LIKE '%WALMART%' OR UPPER(description) LIKE '%DOLLARAMA%' OR UPPER(description) LIKE '%LCBO%' OR UPPER(description) LIKE '%FROOTLAND%' THEN 'Shopping & Groceries'
+        WHEN UPPER(description) LIKE '%MCDONALD%' OR UPPER(description) LIKE '%HARVEY%' OR UPPER(description) LIKE '%CHIPOTLE%' OR UPPER(description) LIKE '%THAI%' OR UPPER(description) LIKE '%UBER%' OR UPPER(description) LIKE '%RESTAURANT%' OR UPPER(description) LIKE '%AMANO%' OR UPPER(description) LIKE '%POULET%' THEN 'Food & Dining'
+        WHEN UPPER(description) LIKE '%SPOTIFY%' OR UPPER(description) LIKE '%NETFLIX%' OR UPPER(description) LIKE '%ENTERTAINMENT%' THEN 'Entertainment'
+        WHEN UPPER(description) LIKE '%UNIV%' OR UPPER(description) LIKE '%COLLEGE%' OR UPPER(description) LIKE '%SCHOOL%' THEN 'Education'
+        WHEN UPPER(description) LIKE '%H&M%' OR UPPER(description) LIKE '%HM CA%' OR UPPER(description) LIKE '%CLOTHING%' THEN 'Clothing'
+        WHEN UPPER(description) LIKE '%RENT%' OR UPPER(description) LIKE '%MORTGAGE%' OR UPPER(description) LIKE '%UTILITIES%' THEN 'Housing'
+        ELSE 'Other'
+    END AS category, amount
+    FROM `finance`.`transactions`
+    WHERE amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
+) t
+GROUP BY category
+ORDER BY total_spent DESC;
 
--- 7. 🎯 STATEMENT OVERVIEW
-SELECT 
-    s.statement_id,
-    s.bank_name,
-    s.card_type,
-    s.statement_period_start,
-    s.statement_period_end,
-    s.ending_balance,
-    s.minimum_payment,
-    s.payment_due_date,
-    COUNT(t.ref_number) as transaction_count
-FROM finance.statements s
-LEFT JOIN finance.transactions t ON s.statement_id = t.statement_id
-GROUP BY s.statement_id, s.bank_name, s.card_type, s.statement_period_start, 
-         s.statement_period_end, s.ending_balance, s.minimum_payment, s.payment_due_date
-ORDER BY s.statement_period_end DESC;
+-- 🕒 Weekly features for forecasting [weekly_features, relies on: idx_transactions_date]
+SELECT
+    DATE_TRUNC('week', transaction_date) AS week_start,
+    COUNT(*) AS weekly_transactions,
+    SUM(amount) AS weekly_spending,
+    AVG(amount) AS avg_transaction_size,
+    COUNT(DISTINCT transaction_date) AS active_days,
+    SUM(amount) / COUNT(DISTINCT transaction_date) AS daily_avg_spending
+FROM `finance`.`transactions`
+WHERE amount > 0 AND UPPER(description) NOT LIKE '%SCOTIABANK%' AND duplicate_of IS NULL
+GROUP BY 1
+ORDER BY week_start;
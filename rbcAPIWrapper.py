@@ -1,28 +1,179 @@
+import copy
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
 import requests
-from typing import Any, Dict, Optional
+from requests.adapters import HTTPAdapter
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint family whose breaker is open."""
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures; open
+    rejects calls for `reset_timeout` seconds, then half-open lets one trial
+    call through: success (2xx) closes the breaker, failure opens it again,
+    and a 4xx answer leaves it half-open for the next trial.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.counters = {"calls": 0, "errors": 0, "rejected": 0, "opened": 0}
+        self.latencies: Deque[float] = deque(maxlen=256)
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.time() - self.opened_at >= self.reset_timeout:
+            self.state = "half-open"
+        if self.state == "closed" or (self.state == "half-open" and not self.trial_in_flight):
+            self.trial_in_flight = self.state == "half-open"
+            return True
+        self.counters["rejected"] += 1
+        return False
+
+    def record(self, ok: bool, seconds: float) -> None:
+        self.counters["calls"] += 1
+        self.latencies.append(seconds)
+        self.trial_in_flight = False
+        if ok:
+            self.state = "closed"
+            self.failures = 0
+            return
+        self.counters["errors"] += 1
+        self.failures += 1
+        if self.state == "half-open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.counters["opened"] += 1
+            self.state = "open"
+            self.opened_at = time.time()
+
+    def record_client_error(self, seconds: float) -> None:
+        """A 4xx: the endpoint answered, but that proves nothing about it succeeding"""
+        self.counters["calls"] += 1
+        self.latencies.append(seconds)
+        self.trial_in_flight = False
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            **self.counters,
+            "avg_ms": round(sum(latencies) * 1000 / len(latencies), 1) if latencies else 0.0,
+            "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1) if latencies else 0.0,
+        }
+
+def _is_failure(error: Exception) -> bool:
+    """Outages trip the breaker; 4xx answers are the caller's mistake and do not"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
 
 class InvestEasyAPI:
     BASE_URL = "https://2dcq63co40.execute-api.us-east-1.amazonaws.com/dev"
 
-    def __init__(self, token: Optional[str] = None, timeout: int = 10):
+    def __init__(self, token: Optional[str] = None, timeout: int = 10, pool_maxsize: int = 16,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, cache_ttl: float = 30.0):
         self.session = requests.Session()
+        # Keep-alive connections for the concurrent callers (request threads, client pool)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=False)
+        self.session.mount("https://", adapter)
         self.token = token
         self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+        self._cache_counters = {"hits": 0, "misses": 0, "invalidated": 0}
 
     # --------------------------
     # Internal request handler
     # --------------------------
+    def _breaker(self, path: str) -> CircuitBreaker:
+        # Endpoint family: /teams, /clients, /portfolios, /client (simulations)
+        family = path.split("/")[1]
+        breaker = self._breakers.get(family)
+        if breaker is None:
+            breaker = self._breakers[family] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
     def _request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
         url = f"{self.BASE_URL}{path}"
         headers = kwargs.pop("headers", {})
         if self.token:
             headers["Authorization"] = f"Bearer {self.token}"
-        resp = self.session.request(
-            method, url, headers=headers, timeout=self.timeout, **kwargs
-        )
-        resp.raise_for_status()
+        with self._lock:
+            breaker = self._breaker(path)
+            if not breaker.allow():
+                raise CircuitOpenError(f"RBC {path.split('/')[1]} endpoints are failing; retrying after "
+                                       f"{breaker.reset_timeout:g}s")
+        started = time.time()
+        try:
+            resp = self.session.request(
+                method, url, headers=headers, timeout=self.timeout, **kwargs
+            )
+            resp.raise_for_status()
+        except Exception as e:
+            with self._lock:
+                if _is_failure(e):
+                    breaker.record(False, time.time() - started)
+                else:
+                    breaker.record_client_error(time.time() - started)
+            raise
+        with self._lock:
+            breaker.record(True, time.time() - started)
         return resp.json()
 
+    # --------------------------
+    # Read cache
+    # --------------------------
+    def _cached(self, kind: str, key: str, fetch: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """A copy of fetch()'s result, reused for cache_ttl seconds"""
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get((kind, key))
+            if entry is not None and entry[0] > now:
+                self._cache_counters["hits"] += 1
+                return copy.deepcopy(entry[1])
+            self._cache_counters["misses"] += 1
+        data = fetch()
+        with self._lock:
+            if len(self._cache) >= 1024:
+                self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+            self._cache[(kind, key)] = (now + self.cache_ttl, copy.deepcopy(data))
+        return data
+
+    def _invalidate(self, kinds: Tuple[str, ...], key: Optional[str] = None) -> None:
+        """Drop cached reads of `key` (and of its sub-keys, e.g. each simulated horizon); every key when None"""
+        with self._lock:
+            stale = [k for k in self._cache
+                     if k[0] in kinds and (key is None or k[1] == key or k[1].startswith(key + "/"))]
+            for k in stale:
+                del self._cache[k]
+            self._cache_counters["invalidated"] += len(stale)
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Breaker state and latency per endpoint family, and read cache hit rate"""
+        with self._lock:
+            breakers = {family: b.metrics() for family, b in sorted(self._breakers.items())}
+            cache = dict(self._cache_counters)
+            cache["entries"] = len(self._cache)
+        looked_up = cache["hits"] + cache["misses"]
+        cache["hit_rate"] = round(cache["hits"] / looked_up, 4) if looked_up else 0.0
+        return {"endpoints": breakers, "cache": cache}
+
     # --------------------------
     # Authentication
     # --------------------------
@@ -60,10 +211,14 @@ class InvestEasyAPI:
         return self._request("PUT", f"/clients/{client_id}", json=payload)
 
     def delete_client(self, client_id: str) -> Dict[str, Any]:
-        return self._request("DELETE", f"/clients/{client_id}")
+        result = self._request("DELETE", f"/clients/{client_id}")
+        self._invalidate(("simulate",), client_id)
+        return result
 
     def deposit_to_client(self, client_id: str, amount: float) -> Dict[str, Any]:
-        return self._request("POST", f"/clients/{client_id}/deposit", json={"amount": amount})
+        result = self._request("POST", f"/clients/{client_id}/deposit", json={"amount": amount})
+        self._invalidate(("simulate",), client_id)
+        return result
 
     # --------------------------
     # Portfolios
@@ -71,26 +226,39 @@ class InvestEasyAPI:
     def create_portfolio(self, client_id: str, portfolio_type: str,
                          initial_amount: float) -> Dict[str, Any]:
         payload = {"type": portfolio_type, "initialAmount": initial_amount}
-        return self._request("POST", f"/clients/{client_id}/portfolios", json=payload)
+        result = self._request("POST", f"/clients/{client_id}/portfolios", json=payload)
+        self._invalidate(("simulate",), client_id)
+        return result
 
     def list_portfolios(self, client_id: str) -> Dict[str, Any]:
         return self._request("GET", f"/clients/{client_id}/portfolios")
 
     def get_portfolio(self, portfolio_id: str) -> Dict[str, Any]:
-        return self._request("GET", f"/portfolios/{portfolio_id}")
+        return self._cached("portfolio", portfolio_id,
+                            lambda: self._request("GET", f"/portfolios/{portfolio_id}"))
 
     def transfer_to_portfolio(self, portfolio_id: str, amount: float) -> Dict[str, Any]:
-        return self._request("POST", f"/portfolios/{portfolio_id}/transfer", json={"amount": amount})
+        result = self._request("POST", f"/portfolios/{portfolio_id}/transfer", json={"amount": amount})
+        self._invalidate(("portfolio", "analysis"), portfolio_id)
+        # The owning client's holdings changed, and a portfolio id does not say which client that is
+        self._invalidate(("simulate",))
+        return result
 
     def withdraw_from_portfolio(self, portfolio_id: str, amount: float) -> Dict[str, Any]:
-        return self._request("POST", f"/portfolios/{portfolio_id}/withdraw", json={"amount": amount})
+        result = self._request("POST", f"/portfolios/{portfolio_id}/withdraw", json={"amount": amount})
+        self._invalidate(("portfolio", "analysis"), portfolio_id)
+        self._invalidate(("simulate",))
+        return result
 
     def analyze_portfolio(self, portfolio_id: str) -> Dict[str, Any]:
-        return self._request("GET", f"/portfolios/{portfolio_id}/analysis")
+        return self._cached("analysis", portfolio_id,
+                            lambda: self._request("GET", f"/portfolios/{portfolio_id}/analysis"))
 
     # --------------------------
     # Simulations
     # --------------------------
     def simulate_client(self, client_id: str, months: int) -> Dict[str, Any]:
         payload = {"months": months}
-        return self._request("POST", f"/client/{client_id}/simulate", json=payload)
\ No newline at end of file
+        # Simulations depend only on the client's holdings, so repeats within the TTL are reused
+        return self._cached("simulate", f"{client_id}/{months}",
+                            lambda: self._request("POST", f"/client/{client_id}/simulate", json=payload))
\ No newline at end of file